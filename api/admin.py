@@ -1,11 +1,17 @@
 from django.contrib import admin
-from .models import ExtendUser, Exercise, SessionLog, WorkoutLog, SessionLog_Exercise
+from .models import ExtendUser, Exercise, SessionLog, WorkoutLog, SessionLog_Exercise, RepMax, PersonalRecord, DailySummary, Tombstone, AppliedOperation, Job
 
 admin.site.register(ExtendUser)
 admin.site.register(Exercise)
 admin.site.register(SessionLog)
 admin.site.register(SessionLog_Exercise)
 admin.site.register(WorkoutLog)
+admin.site.register(RepMax)
+admin.site.register(PersonalRecord)
+admin.site.register(DailySummary)
+admin.site.register(Tombstone)
+admin.site.register(AppliedOperation)
+admin.site.register(Job)
 
 
 
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .persisted import persisted_queries
+        # Registers the background tasks run by `manage.py run_worker`.
+        from . import tasks
+
+        registry = settings.GRAPHQL_PERSISTED_QUERIES['REGISTRY']
+        if registry:
+            persisted_queries.load(registry)
@@ -0,0 +1,233 @@
+import graphene
+import graphql_jwt
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from graphql_jwt.decorators import login_required
+from .models import ExtendUser, Exercise, WorkoutLog, SessionLog, SessionLog_Exercise
+from .loaders import acollect
+from .optimizer import optimize
+from .pagination import paginate
+from .execution import ApiSchema
+from .result_cache import acached_result, aexercise_owner, ainvalidate_user, asession_owner
+from .auth import get_user
+from .pubsub import get_pubsub, personal_best_channel
+from .summaries import summary_series, user_summaries
+from .writes import ainsert_row, apayload_row, aupdate_row, does_not_exist
+from .schema import (
+    Query, Subscription, date_range, UserConnection, ExerciseConnection, SessionLogConnection, WorkoutLogConnection,
+    UserMutationCreate, UserMutationUpdate, UserMutationDelete,
+    ExerciseMutationCreate, ExerciseMutationUpdate, ExerciseMutationDelete,
+    WorkoutMutationCreate, WorkoutMutationBulkCreate, WorkoutMutationUpdate, WorkoutMutationDelete,
+    SessionMutationCreate, SessionMutationUpdate, SessionMutationDelete, SessionMutationLog,
+    SessionExerciseMutationCreate, SessionExerciseMutationDelete, ReplayOperations,
+)
+
+# The same API as api.schema, resolved with Django's async ORM so a request
+# waiting on the database does not hold a worker thread. Types, arguments,
+# subscriptions and error messages are shared with the sync schema; only the
+# query and mutation resolvers differ. Writes here run in autocommit, so
+# events are published straight away rather than on commit.
+
+
+def in_thread(field):
+    # For resolvers that need transaction.atomic() or third-party sync code,
+    # which have no async form. Workout writes are among them, as the insert
+    # and the personal best update must commit together, and so are deletes,
+    # which leave tombstones for sync in the same transaction.
+    field.resolver = sync_to_async(field.resolver)
+    return field
+
+
+class AsyncQuery(Query):
+    class Meta:
+        name = 'Query'
+
+    async def resolve_get_all_users(self, info):
+        return await acollect(info, optimize(ExtendUser.objects.filter(deleted_at=None).order_by('pk'), info))
+
+    async def resolve_get_user_by_user_id(self, info, user_id):
+        return await optimize(ExtendUser.objects.filter(deleted_at=None), info).aget(pk=user_id)
+
+    @login_required
+    async def resolve_logged_in(self, info):
+        return await sync_to_async(get_user)(info)
+
+    async def resolve_get_all_exercises(self, info):
+        return await acollect(info, optimize(Exercise.objects.order_by('pk'), info))
+
+    async def resolve_get_exercises_by_user_id(self, info, user_id):
+        return await acached_result(info, user_id, lambda: acollect(info, optimize(Exercise.objects.filter(user_id=user_id).order_by('pk'), info)))
+
+    async def resolve_get_exercise_by_exercise_id(self, info, exercise_id):
+        return await optimize(Exercise.objects.all(), info).aget(pk=exercise_id)
+
+    async def resolve_get_all_sessions(self, info):
+        return await acollect(info, optimize(SessionLog.objects.order_by('date_time', 'pk'), info))
+
+    async def resolve_get_sessions_by_user_id(self, info, user_id, date_from=None, date_to=None):
+        return await acached_result(info, user_id, lambda: acollect(info, optimize(date_range(SessionLog.objects.filter(user_id=user_id), date_from, date_to).order_by('date_time', 'pk'), info)))
+
+    async def resolve_get_session_by_session_id(self, info, session_id):
+        return await optimize(SessionLog.objects.all(), info).aget(pk=session_id)
+
+    async def resolve_get_all_workouts(self, info):
+        return await acollect(info, optimize(WorkoutLog.objects.order_by('date_time', 'pk'), info))
+
+    async def resolve_get_workouts_by_exercise_id(self, info, exercise_id, date_from=None, date_to=None):
+        return await acached_result(info, await aexercise_owner(exercise_id), lambda: acollect(info, optimize(date_range(WorkoutLog.objects.filter(exercise_id=exercise_id), date_from, date_to).order_by('date_time', 'pk'), info)))
+
+    async def resolve_get_workout_by_workout_id(self, info, workout_id):
+        return await optimize(WorkoutLog.objects.all(), info).aget(pk=workout_id)
+
+    async def resolve_get_workouts_by_user_id(self, info, user_id, date_from=None, date_to=None):
+        return await acached_result(info, user_id, lambda: acollect(info, optimize(date_range(WorkoutLog.objects.filter(user_id=user_id), date_from, date_to).order_by('date_time', 'pk'), info)))
+
+    async def resolve_get_training_summaries(self, info, user_id, period, exercise_id=None, date_from=None, date_to=None):
+        # The rollup builds its rows in Python, so it runs in a thread.
+        return await acached_result(info, user_id, lambda: sync_to_async(summary_series)(user_summaries(user_id, exercise_id, date_from, date_to), period.value))
+
+    async def resolve_get_exercises_by_session_id(self, info, session_id):
+        return await acollect(info, optimize(SessionLog_Exercise.objects.filter(session_id=session_id).order_by('pk'), info))
+
+    # A page is two dependent reads; paginate() runs them in one thread hop.
+    async def resolve_get_all_users_connection(self, info, **kwargs):
+        return await sync_to_async(paginate)(info, UserConnection, ExtendUser.objects.filter(deleted_at=None), ('pk',), **kwargs)
+
+    async def resolve_get_all_exercises_connection(self, info, **kwargs):
+        return await sync_to_async(paginate)(info, ExerciseConnection, Exercise.objects.all(), ('pk',), **kwargs)
+
+    async def resolve_get_all_sessions_connection(self, info, **kwargs):
+        return await sync_to_async(paginate)(info, SessionLogConnection, SessionLog.objects.all(), ('date_time', 'pk'), **kwargs)
+
+    async def resolve_get_sessions_by_user_id_connection(self, info, user_id, date_from=None, date_to=None, **kwargs):
+        return await sync_to_async(paginate)(info, SessionLogConnection, date_range(SessionLog.objects.filter(user_id=user_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
+
+    async def resolve_get_all_workouts_connection(self, info, **kwargs):
+        return await sync_to_async(paginate)(info, WorkoutLogConnection, WorkoutLog.objects.all(), ('date_time', 'pk'), **kwargs)
+
+    async def resolve_get_workouts_by_exercise_id_connection(self, info, exercise_id, date_from=None, date_to=None, **kwargs):
+        return await sync_to_async(paginate)(info, WorkoutLogConnection, date_range(WorkoutLog.objects.filter(exercise_id=exercise_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
+
+    async def resolve_get_workouts_by_user_id_connection(self, info, user_id, date_from=None, date_to=None, **kwargs):
+        return await sync_to_async(paginate)(info, WorkoutLogConnection, date_range(WorkoutLog.objects.filter(user_id=user_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
+
+
+class AsyncUserMutationCreate(UserMutationCreate):
+    class Meta:
+        name = 'UserMutationCreate'
+
+    @classmethod
+    async def mutate(cls, root, info, username, email, password):
+        user = ExtendUser(username=username, email=email)
+        # Hashing is deliberately slow; keep it off the event loop.
+        await sync_to_async(user.set_password)(password)
+        await user.asave()
+        await ainvalidate_user(user.pk)
+        return cls(user = user)
+
+class AsyncUserMutationUpdate(UserMutationUpdate):
+    class Meta:
+        name = 'UserMutationUpdate'
+
+    @classmethod
+    async def mutate(cls, root, info, user_id, username):
+        values = await aupdate_row(ExtendUser, user_id, username=username)
+        await ainvalidate_user(user_id)
+        return cls(user = await apayload_row(info, 'user', ExtendUser, user_id, **values))
+
+class AsyncExerciseMutationCreate(ExerciseMutationCreate):
+    class Meta:
+        name = 'ExerciseMutationCreate'
+
+    @classmethod
+    async def mutate(cls, root, info, user_id, external_exercise_id, external_exercise_name, external_exercise_bodypart):
+        exercise = Exercise(user_id_id=user_id, external_exercise_id=external_exercise_id, external_exercise_name=external_exercise_name, external_exercise_bodypart=external_exercise_bodypart)
+        await ainsert_row(exercise, 'user_id')
+        await ainvalidate_user(user_id)
+        return cls(exercise=exercise)
+
+class AsyncExerciseMutationUpdate(ExerciseMutationUpdate):
+    class Meta:
+        name = 'ExerciseMutationUpdate'
+
+    @classmethod
+    async def mutate(cls, root, info, exercise_id, personal_best):
+        changed = await Exercise.objects.filter(exercise_id=exercise_id).exclude(personal_best=personal_best).aupdate(personal_best=personal_best, updated_at=timezone.now())
+        exercise = await Exercise.objects.aget(exercise_id=exercise_id)
+        if changed:
+            await ainvalidate_user(exercise.user_id_id)
+            get_pubsub().publish(personal_best_channel(exercise.pk), exercise)
+        return cls(exercise=exercise)
+
+class AsyncSessionMutationCreate(SessionMutationCreate):
+    class Meta:
+        name = 'SessionMutationCreate'
+
+    @classmethod
+    async def mutate(cls, root, info, user_id, session_name):
+        session = SessionLog(user_id_id=user_id, session_name=session_name)
+        await ainsert_row(session, 'user_id')
+        await ainvalidate_user(user_id)
+        return cls(session=session)
+
+class AsyncSessionMutationUpdate(SessionMutationUpdate):
+    class Meta:
+        name = 'SessionMutationUpdate'
+
+    @classmethod
+    async def mutate(cls, root, info, session_id, session_name):
+        values = await aupdate_row(SessionLog, session_id, session_name=session_name)
+        owner = await asession_owner(session_id)
+        await ainvalidate_user(owner)
+        return cls(session=await apayload_row(info, 'session', SessionLog, session_id, user_id_id=owner, **values))
+
+class AsyncSessionExerciseMutationCreate(SessionExerciseMutationCreate):
+    class Meta:
+        name = 'SessionExerciseMutationCreate'
+
+    @classmethod
+    async def mutate(cls, root, info, session_id, exercise_id):
+        owner = await asession_owner(session_id)
+        if owner is None:
+            raise does_not_exist(SessionLog)
+        if await aexercise_owner(exercise_id) is None:
+            raise does_not_exist(Exercise)
+        session_exercise = SessionLog_Exercise(session_id_id=session_id, exercise_id_id=exercise_id, user_id_id=owner)
+        await ainsert_row(session_exercise, 'session_id', 'exercise_id')
+        await ainvalidate_user(owner)
+        return cls(session_exercise=session_exercise)
+
+
+class AsyncMutation(graphene.ObjectType):
+    class Meta:
+        name = 'Mutation'
+
+    create_user = AsyncUserMutationCreate.Field()
+    update_user = AsyncUserMutationUpdate.Field()
+    delete_user = in_thread(UserMutationDelete.Field())
+
+    create_exercise = AsyncExerciseMutationCreate.Field()
+    update_exercise = AsyncExerciseMutationUpdate.Field()
+    delete_exercise = in_thread(ExerciseMutationDelete.Field())
+
+    create_workout = in_thread(WorkoutMutationCreate.Field())
+    create_workouts = in_thread(WorkoutMutationBulkCreate.Field())
+    update_workout = in_thread(WorkoutMutationUpdate.Field())
+    delete_workout = in_thread(WorkoutMutationDelete.Field())
+
+    create_session = AsyncSessionMutationCreate.Field()
+    update_session = AsyncSessionMutationUpdate.Field()
+    delete_session = in_thread(SessionMutationDelete.Field())
+    log_session = in_thread(SessionMutationLog.Field())
+
+    create_session_exercise = AsyncSessionExerciseMutationCreate.Field()
+    delete_session_exercise = in_thread(SessionExerciseMutationDelete.Field())
+
+    replay_operations = in_thread(ReplayOperations.Field())
+
+    token_auth = in_thread(graphql_jwt.ObtainJSONWebToken.Field())
+    verify_token = in_thread(graphql_jwt.Verify.Field())
+    refresh_token = in_thread(graphql_jwt.Refresh.Field())
+
+
+async_schema = ApiSchema(query=AsyncQuery, mutation=AsyncMutation, subscription=Subscription)
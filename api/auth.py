@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.utils.functional import cached_property
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization, get_payload, get_user_by_payload
+from graphql_jwt.utils import jwt_payload as default_jwt_payload
+
+from .models import ExtendUser
+
+
+def jwt_payload(user, context=None):
+    # Tokens also carry the user id so the claims-only mode can identify the
+    # user without reading the row.
+    payload = default_jwt_payload(user, context)
+    payload['user_id'] = user.pk
+    return payload
+
+
+class TokenUser:
+    # Lightweight principal built from verified token claims. The ExtendUser
+    # row is only read if something asks for it through `user`.
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, payload):
+        self.pk = self.user_id = payload['user_id']
+        self.username = payload.get(ExtendUser.USERNAME_FIELD)
+
+    @cached_property
+    def user(self):
+        return ExtendUser.objects.get(pk=self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+def get_user(info):
+    # Resolvers that need the full row go through here rather than reading
+    # info.context.user directly.
+    user = info.context.user
+    return user.user if isinstance(user, TokenUser) else user
+
+
+def get_user_by_token(token, context=None):
+    # For tokens that do not arrive in an Authorization header, such as the
+    # connection_init payload of a WebSocket.
+    payload = get_payload(token, context)
+    if settings.GRAPHQL_CLAIMS_ONLY_AUTH and 'user_id' in payload:
+        return TokenUser(payload)
+    return get_user_by_payload(payload)
+
+
+def authenticate_request(request):
+    # Verifies the JWT once per HTTP request and attaches the user, instead
+    # of graphql_jwt's middleware doing it around every resolved field.
+    if getattr(request, '_jwt_authenticated', False):
+        return
+    request._jwt_authenticated = True
+    request.jwt_error = None
+
+    user = getattr(request, 'user', None)
+    token = get_http_authorization(request)
+    if (user is not None and not user.is_anonymous) or token is None:
+        return
+    try:
+        if settings.GRAPHQL_CLAIMS_ONLY_AUTH:
+            payload = get_payload(token, request)
+            user = TokenUser(payload) if 'user_id' in payload else authenticate(request=request)
+        else:
+            user = authenticate(request=request)
+    except JSONWebTokenError as error:
+        request.jwt_error = error
+        return
+    if user is not None:
+        request.user = user
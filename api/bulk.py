@@ -0,0 +1,36 @@
+from django.db import connection
+
+# Per database alias: whether the server gives one multi-row INSERT
+# consecutive ids, which MySQL only promises with innodb_autoinc_lock_mode 0
+# ("traditional") or 1 ("consecutive") and auto_increment_increment 1. Lock
+# mode 2, MySQL 8's default, interleaves ids between concurrent inserts.
+consecutive_ids = {}
+
+
+def has_consecutive_ids():
+    if connection.alias not in consecutive_ids:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment')
+            lock_mode, increment = cursor.fetchone()
+        consecutive_ids[connection.alias] = int(lock_mode) in (0, 1) and int(increment) == 1
+    return consecutive_ids[connection.alias]
+
+
+def bulk_insert(model, objects):
+    # bulk_create() that always hands back primary keys. Backends that can
+    # return rows (sqlite, PostgreSQL, MariaDB) set them already. MySQL gives
+    # a single multi-row INSERT consecutive ids starting at LAST_INSERT_ID()
+    # only when configured as above; otherwise every row is inserted on its
+    # own so each id is read back, which is slower but never wrong.
+    if not connection.features.can_return_rows_from_bulk_insert and not has_consecutive_ids():
+        for instance in objects:
+            instance.save(force_insert=True)
+        return objects
+    objects = model._default_manager.bulk_create(objects)
+    if objects and objects[0].pk is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT LAST_INSERT_ID()')
+            first_id = cursor.fetchone()[0]
+        for offset, instance in enumerate(objects):
+            instance.pk = first_id + offset
+    return objects
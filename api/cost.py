@@ -0,0 +1,93 @@
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError, get_named_type, get_nullable_type, is_list_type
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode, IntValueNode, OperationDefinitionNode, VariableNode
+from graphql.utilities import get_operation_root_type
+
+
+class QueryCost:
+    # Estimates the cost of an operation before it runs. Every field costs its
+    # weight (1 for objects, 0 for scalars unless FIELD_WEIGHTS says otherwise)
+    # and list fields multiply the cost of everything beneath them by `first`
+    # / `last` or, when no page size is given, DEFAULT_LIST_SIZE.
+
+    def __init__(self, schema, document, operation_name=None, variables=None):
+        options = settings.GRAPHQL_QUERY_COST
+        self.schema = schema
+        self.variables = variables or {}
+        self.max_cost = options['MAX_COST']
+        self.max_depth = options['MAX_DEPTH']
+        self.default_list_size = options['DEFAULT_LIST_SIZE']
+        self.field_weights = options.get('FIELD_WEIGHTS', {})
+        self.fragments = {}
+        self.operation = None
+        for definition in document.definitions:
+            if isinstance(definition, OperationDefinitionNode):
+                if operation_name is None or (definition.name and definition.name.value == operation_name):
+                    self.operation = self.operation or definition
+            else:
+                self.fragments[definition.name.value] = definition
+        self.cost, self.depth = 0, 0
+        if self.operation is not None:
+            root_type = get_operation_root_type(schema, self.operation)
+            self.cost, self.depth = self.selection_cost(root_type, self.operation.selection_set, set())
+
+    def fields(self, selection_set, visited):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from self.fields(selection.selection_set, visited)
+            elif isinstance(selection, FragmentSpreadNode) and selection.name.value not in visited:
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is not None:
+                    yield from self.fields(fragment.selection_set, visited | {selection.name.value})
+
+    def page_size(self, node):
+        for argument in node.arguments or ():
+            if argument.name.value in ('first', 'last'):
+                value = argument.value
+                if isinstance(value, VariableNode):
+                    value = self.variables.get(value.name.value)
+                elif isinstance(value, IntValueNode):
+                    value = int(value.value)
+                if isinstance(value, int):
+                    # Out-of-range sizes are rejected by paginate(), but a
+                    # negative one must not cancel out the cost of siblings.
+                    return min(max(value, 0), graphene_settings.RELAY_CONNECTION_MAX_LIMIT)
+        return None
+
+    def selection_cost(self, parent_type, selection_set, visited):
+        cost, depth = 0, 0
+        for node in self.fields(selection_set, visited):
+            name = node.name.value
+            if name.startswith('__') or name not in getattr(parent_type, 'fields', {}):
+                continue
+            field = parent_type.fields[name]
+            field_type = field.type
+            named_type = get_named_type(field_type)
+            weight = self.field_weights.get(parent_type.name + '.' + name, 0 if node.selection_set is None else 1)
+            child_cost, child_depth = 0, 0
+            if node.selection_set is not None:
+                child_cost, child_depth = self.selection_cost(named_type, node.selection_set, visited)
+
+            multiplier = self.page_size(node)
+            if multiplier is None:
+                # A connection's edges are already bounded by its first / last.
+                is_connection_edges = name == 'edges' and parent_type.name.endswith('Connection')
+                is_list = is_list_type(get_nullable_type(field_type)) and not is_connection_edges
+                multiplier = self.default_list_size if is_list or 'first' in field.args else 1
+            cost += weight + multiplier * child_cost
+            depth = max(depth, child_depth + 1)
+        return cost, depth
+
+    def errors(self):
+        errors = []
+        if self.depth > self.max_depth:
+            errors.append(GraphQLError('Query depth {} exceeds the maximum of {}.'.format(self.depth, self.max_depth)))
+        if self.cost > self.max_cost:
+            errors.append(GraphQLError('Query cost {} exceeds the maximum of {}.'.format(self.cost, self.max_cost)))
+        return errors
+
+    def extensions(self):
+        return {'cost': {'estimated': self.cost, 'depth': self.depth, 'maximum': self.max_cost}}
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import AppliedOperation, DailySummary, Exercise, ExtendUser, SessionLog, SessionLog_Exercise, Tombstone, WorkoutLog
+from .result_cache import forget_owner, forget_owners, invalidate_user
+from .sync import bury, bury_object
+from .writes import delete_row, does_not_exist
+
+# Users and exercises own too many rows to delete through one
+# Model.delete(), whose collector loads every dependent row before deleting
+# anything. Here dependents go first, a chunk of primary keys per short
+# transaction, leaves before the tables they reference. By the time a
+# chunk's own collector runs, the rows it would cascade to are gone or are
+# removed with one set-based DELETE per table.
+
+
+def chunk_size():
+    return settings.ACCOUNT_DELETION['CHUNK_SIZE']
+
+
+def delete_in_chunks(queryset, tombstones=False):
+    # Deletes every row of `queryset`, leaving sync tombstones for them in
+    # the same transactions if asked, and forgetting the cached owners of
+    # exercises and sessions. Returns the number of rows deleted.
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size()])
+            if not chunk:
+                return deleted
+            rows = queryset.model.objects.filter(pk__in=chunk)
+            if tombstones:
+                bury(rows)
+            rows.delete()
+            if queryset.model in (Exercise, SessionLog):
+                forget_owners(queryset.model, chunk)
+        deleted += len(chunk)
+
+
+def purge_exercise(exercise_id, owner):
+    # Rep maxes and personal records go with their workouts.
+    delete_in_chunks(SessionLog_Exercise.objects.filter(exercise_id=exercise_id), tombstones=True)
+    delete_in_chunks(WorkoutLog.objects.filter(exercise_id=exercise_id), tombstones=True)
+    delete_in_chunks(DailySummary.objects.filter(exercise_id=exercise_id))
+    with transaction.atomic():
+        bury_object(Exercise(exercise_id=exercise_id, user_id_id=owner))
+        delete_row(Exercise, exercise_id)
+        forget_owner(Exercise, exercise_id)
+
+
+def purge_user(user_id):
+    # No tombstones: they would belong to the user being deleted.
+    for queryset in (
+        SessionLog_Exercise.objects.filter(user_id=user_id),
+        WorkoutLog.objects.filter(user_id=user_id),
+        SessionLog.objects.filter(user_id=user_id),
+        DailySummary.objects.filter(user_id=user_id),
+        Exercise.objects.filter(user_id=user_id),
+        Tombstone.objects.filter(user_id=user_id),
+        AppliedOperation.objects.filter(user_id=user_id),
+    ):
+        delete_in_chunks(queryset)
+    # Whatever else references the user, e.g. admin log entries.
+    delete_row(ExtendUser, user_id)
+    invalidate_user(user_id)
+
+
+def is_large_account(user_id):
+    # Reads at most BACKGROUND_AFTER entries of the (user_id, date_time) index.
+    limit = settings.ACCOUNT_DELETION['BACKGROUND_AFTER']
+    return limit is not None and WorkoutLog.objects.filter(user_id=user_id).values('pk')[limit:limit + 1].exists()
+
+
+def delete_user(user_id):
+    # Large accounts are only marked deleted here: they disappear from the
+    # API and can no longer log in, and a background job removes their rows.
+    # Returns whether that is the case.
+    if not is_large_account(user_id):
+        purge_user(user_id)
+        return False
+    with transaction.atomic():
+        if not ExtendUser.objects.filter(pk=user_id, deleted_at=None).update(deleted_at=timezone.now(), is_active=False):
+            raise does_not_exist(ExtendUser)
+        enqueue('purge_user', user_id=int(user_id))
+    return True
+
+
+def deleted_users():
+    return ExtendUser.objects.exclude(deleted_at=None).order_by('deleted_at', 'pk').values_list('pk', flat=True)
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import QuerySet
+from graphene.types.schema import normalize_execute_kwargs
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, execute_sync, get_operation_ast, parse, validate, validate_schema
+from graphql.execution import MapAsyncIterator, MiddlewareManager, create_source_event_stream
+from graphql.language import DocumentNode
+from graphql.pyutils import is_awaitable
+
+from .cost import QueryCost
+from .loaders import LoaderRegistry
+
+
+class DocumentCache:
+    # Bounded LRU of parsed and validated documents keyed by the sha256 of
+    # the operation text. Entries belong to one GraphQL schema and are
+    # dropped as soon as a different schema asks for them.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.documents = OrderedDict()
+        self.schema = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, schema, source):
+        key = sha256(source.encode()).hexdigest()
+        with self.lock:
+            if self.schema is not schema:
+                self.documents.clear()
+                self.schema = schema
+            entry = self.documents.get(key)
+            if entry is not None:
+                self.documents.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = parse_and_validate(schema, source)
+        with self.lock:
+            if self.schema is schema:
+                self.documents[key] = entry
+                if len(self.documents) > self.maxsize:
+                    self.documents.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.documents), 'maxsize': self.maxsize}
+
+
+def parse_and_validate(schema, source):
+    try:
+        document = source if isinstance(source, DocumentNode) else parse(source)
+    except GraphQLError as error:
+        return None, [error]
+    return document, validate(schema, document)
+
+
+class EvaluateQuerySetsMiddleware:
+    # Under async execution a field that hands back an unevaluated queryset
+    # (a reverse relation the optimizer did not prefetch) would be read on
+    # the event loop, which Django refuses; read it in a thread instead.
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if isinstance(result, QuerySet) and result._result_cache is None:
+            return sync_to_async(list)(result)
+        return result
+
+
+class ApiSchema(graphene.Schema):
+    # graphql_sync() and graphql() with a cost check between validation and
+    # execution, so an over-budget operation is rejected before any resolver
+    # touches the DB.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.document_cache = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+    def get_document(self, source):
+        if isinstance(source, DocumentNode):
+            return parse_and_validate(self.graphql_schema, source)
+        return self.document_cache.get(self.graphql_schema, source)
+
+    def prepare(self, source, kwargs, subscription=False, prepared=None):
+        # Returns the document and its cost, or an ExecutionResult if the
+        # operation must not run. Subscriptions only run through subscribe().
+        # `prepared` is the (document, errors) get_document() already gave a
+        # caller for `source`, so the text is not looked up twice.
+        schema_errors = validate_schema(self.graphql_schema)
+        if schema_errors:
+            return None, None, ExecutionResult(data=None, errors=schema_errors)
+
+        document, errors = prepared or self.get_document(source)
+        if errors:
+            return None, None, ExecutionResult(data=None, errors=errors)
+
+        operation = get_operation_ast(document, kwargs.get('operation_name'))
+        if operation is not None and (operation.operation == OperationType.SUBSCRIPTION) != subscription:
+            if subscription:
+                message = 'Only subscription operations can be subscribed to.'
+            else:
+                message = 'Subscriptions are only served over WebSockets.'
+            return None, None, ExecutionResult(data=None, errors=[GraphQLError(message)])
+
+        cost = QueryCost(self.graphql_schema, document, kwargs.get('operation_name'), kwargs.get('variable_values'))
+        cost_errors = cost.errors()
+        if cost_errors:
+            return None, None, ExecutionResult(data=None, errors=cost_errors, extensions=cost.extensions())
+        return document, cost, None
+
+    def execute(self, source, prepared=None, **kwargs):
+        kwargs = normalize_execute_kwargs(kwargs)
+        document, cost, result = self.prepare(source, kwargs, prepared=prepared)
+        if result is not None:
+            return result
+
+        result = execute_sync(self.graphql_schema, document, **kwargs)
+        result.extensions = dict(result.extensions or {}, **cost.extensions())
+        return result
+
+    async def execute_async(self, source, prepared=None, **kwargs):
+        kwargs = normalize_execute_kwargs(kwargs)
+        document, cost, result = self.prepare(source, kwargs, prepared=prepared)
+        if result is not None:
+            return result
+
+        middleware = kwargs.get('middleware') or []
+        if isinstance(middleware, MiddlewareManager):
+            middleware = list(middleware.middlewares)
+        kwargs['middleware'] = [*middleware, EvaluateQuerySetsMiddleware()]
+        result = execute(self.graphql_schema, document, **kwargs)
+        if is_awaitable(result):
+            result = await result
+        result.extensions = dict(result.extensions or {}, **cost.extensions())
+        return result
+
+    async def subscribe(self, source, **kwargs):
+        # Returns an async iterator of ExecutionResults, one per event, or an
+        # ExecutionResult if the subscription could not be started.
+        kwargs = normalize_execute_kwargs(kwargs)
+        document, cost, result = self.prepare(source, kwargs, subscription=True)
+        if result is not None:
+            return result
+
+        context = kwargs.get('context_value')
+        variables = kwargs.get('variable_values')
+        operation_name = kwargs.get('operation_name')
+        stream = await create_source_event_stream(
+            self.graphql_schema, document, kwargs.get('root_value'), context, variables, operation_name
+        )
+        if isinstance(stream, ExecutionResult):
+            return stream
+
+        async def map_event(event):
+            # Fresh loaders per event, so rows are never served from an
+            # earlier event's cache.
+            if context is not None:
+                context._api_loaders = LoaderRegistry()
+            result = execute(
+                self.graphql_schema, document, event, context, variables, operation_name,
+                middleware=[EvaluateQuerySetsMiddleware()],
+            )
+            return await result if is_awaitable(result) else result
+
+        return MapAsyncIterator(stream, map_event)
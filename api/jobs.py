@@ -0,0 +1,141 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Job
+
+# A job queue kept in the Job table, so heavy work can leave the request
+# without a broker. Mutations enqueue jobs inside their own transaction: a
+# job exists exactly when the write that asked for it committed. Workers
+# (`manage.py run_worker`) claim due jobs with SELECT ... FOR UPDATE SKIP
+# LOCKED, so any number of them can poll side by side without waiting on
+# each other's rows.
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between retries when the database is unavailable.
+MAX_BACKOFF = 60
+
+tasks = {}
+
+
+class Task:
+
+    def __init__(self, function, limit, max_attempts):
+        self.function = function
+        self.limit = limit
+        self.max_attempts = max_attempts
+
+
+def task(name, limit=None, max_attempts=None):
+    # Registers a function to run the jobs called `name` with their payload
+    # as keyword arguments. At most `limit` of them run at once across all
+    # workers; a limit is checked when claiming, so it holds as long as two
+    # workers do not claim the last free slot in the same instant.
+    def register(function):
+        tasks[name] = Task(function, limit, max_attempts or settings.JOB_QUEUE['MAX_ATTEMPTS'])
+        return function
+    return register
+
+
+def enqueue(name, run_at=None, **payload):
+    # The payload must be JSON, e.g. ids rather than model instances.
+    return Job.objects.create(name=name, payload=payload, run_at=run_at or timezone.now())
+
+
+def requeue_lost():
+    # Jobs still running long after they were claimed lost their worker.
+    # Their attempt counts, so a job that kills its worker is not retried
+    # forever.
+    stale = timezone.now() - timedelta(seconds=settings.JOB_QUEUE['STALE_AFTER'])
+    for job in Job.objects.filter(state=Job.RUNNING, locked_at__lt=stale):
+        fail(job, 'The worker running this job was lost.')
+
+
+def busy_names():
+    # Tasks running as many jobs as their limit allows.
+    running = Job.objects.filter(state=Job.RUNNING).order_by().values_list('name').annotate(count=Count('pk'))
+    return [name for name, count in running if name in tasks and tasks[name].limit is not None and count >= tasks[name].limit]
+
+
+def claim():
+    # The next due job, marked running, or None.
+    requeue_lost()
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            state=Job.QUEUED, run_at__lte=timezone.now(),
+        ).exclude(name__in=busy_names()).order_by('run_at', 'pk').first()
+        if job is None:
+            return None
+        job.state = Job.RUNNING
+        job.locked_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['state', 'locked_at', 'attempts'])
+    return job
+
+
+def fail(job, error):
+    # Retried after RETRY_DELAY seconds, doubling with every attempt, until
+    # the task's attempts are used up.
+    task = tasks.get(job.name)
+    if task is not None and job.attempts < task.max_attempts:
+        delay = settings.JOB_QUEUE['RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        Job.objects.filter(pk=job.pk).update(state=Job.QUEUED, run_at=timezone.now() + timedelta(seconds=delay), last_error=error)
+    else:
+        Job.objects.filter(pk=job.pk).update(state=Job.FAILED, finished_at=timezone.now(), last_error=error)
+
+
+def run(job):
+    task = tasks.get(job.name)
+    if task is None:
+        fail(job, 'No task is registered as ' + job.name + '.')
+        return
+    try:
+        task.function(**job.payload)
+    except Exception:
+        fail(job, traceback.format_exc())
+    else:
+        Job.objects.filter(pk=job.pk).update(state=Job.DONE, finished_at=timezone.now())
+
+
+def run_due_jobs():
+    # One at a time until none is due, e.g. from cron or a test.
+    count = 0
+    job = claim()
+    while job is not None:
+        run(job)
+        count += 1
+        job = claim()
+    return count
+
+
+def work():
+    # A worker thread's loop, until the process stops. Connections are
+    # checked between jobs as Django does between requests. If the database
+    # fails, e.g. while it restarts, the error is logged and the worker
+    # waits twice as long before every retry, up to MAX_BACKOFF seconds.
+    backoff = settings.JOB_QUEUE['POLL_INTERVAL']
+    try:
+        while True:
+            try:
+                close_old_connections()
+                job = claim()
+                if job is None:
+                    time.sleep(settings.JOB_QUEUE['POLL_INTERVAL'])
+                else:
+                    run(job)
+            except Exception:
+                logger.exception('The job worker could not reach the database; retrying in %s seconds.', backoff)
+                connection.close()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            else:
+                backoff = settings.JOB_QUEUE['POLL_INTERVAL']
+    finally:
+        connection.close()
@@ -0,0 +1,123 @@
+import asyncio
+
+from django.db.models import ForeignKey
+
+
+class ModelLoader:
+    # Collects primary keys for one model and resolves every pending key
+    # with a single in_bulk() the first time any of them is asked for.
+
+    def __init__(self, registry, model):
+        self.registry = registry
+        self.model = model
+        self.cache = {}
+        self.pending = set()
+        self.loading = {}
+
+    def prime(self, pk):
+        if pk is not None and pk not in self.cache:
+            self.pending.add(pk)
+
+    def load(self, pk):
+        if pk not in self.cache:
+            self.pending.add(pk)
+            keys = self.pending
+            self.pending = set()
+            batch = self.model._default_manager.in_bulk(keys)
+            for key in keys:
+                self.cache[key] = batch.get(key)
+            self.registry.collect(batch.values())
+        return self.cache[pk]
+
+    async def aload(self, pk):
+        # Same batching on the event loop: the first key asked for starts one
+        # ain_bulk() for everything pending and the others wait for it.
+        if pk not in self.cache and pk not in self.loading:
+            self.pending.add(pk)
+            keys = self.pending
+            self.pending = set()
+            task = asyncio.ensure_future(self.fetch(keys))
+            for key in keys:
+                self.loading[key] = task
+        if pk not in self.cache:
+            await self.loading[pk]
+        return self.cache[pk]
+
+    async def fetch(self, keys):
+        try:
+            batch = await self.model._default_manager.ain_bulk(keys)
+            for key in keys:
+                self.cache[key] = batch.get(key)
+            self.registry.collect(batch.values())
+        finally:
+            for key in keys:
+                self.loading.pop(key, None)
+
+
+class LoaderRegistry:
+    # One registry lives on each request, so batches never leak between users.
+
+    def __init__(self):
+        self.loaders = {}
+
+    def for_model(self, model):
+        if model not in self.loaders:
+            self.loaders[model] = ModelLoader(self, model)
+        return self.loaders[model]
+
+    def collect(self, instances):
+        # Queue the foreign keys of a freshly fetched list so the next level
+        # of the query is loaded in one batch per model.
+        instances = list(instances)
+        for instance in instances:
+            deferred = instance.get_deferred_fields()
+            for field in instance._meta.concrete_fields:
+                if isinstance(field, ForeignKey) and field.attname not in deferred and not field.is_cached(instance):
+                    self.for_model(field.related_model).prime(getattr(instance, field.attname))
+        return instances
+
+
+def running_async():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def get_loaders(context):
+    if context is None:
+        return None
+    loaders = getattr(context, '_api_loaders', None)
+    if loaders is None:
+        loaders = LoaderRegistry()
+        context._api_loaders = loaders
+    return loaders
+
+
+def collect(info, queryset):
+    # Streamed responses read the queryset lazily and collect per chunk.
+    loaders = get_loaders(info.context)
+    if loaders is None or getattr(info.context, 'graphql_streaming', False):
+        return queryset
+    return loaders.collect(queryset)
+
+
+async def acollect(info, queryset):
+    rows = [row async for row in queryset]
+    loaders = get_loaders(info.context)
+    return rows if loaders is None else loaders.collect(rows)
+
+
+def load_foreign_key(root, info, field_name):
+    field = root._meta.get_field(field_name)
+    loaders = get_loaders(info.context)
+    if loaders is None or field.is_cached(root):
+        return getattr(root, field_name)
+    pk = getattr(root, field.attname)
+    if pk is None:
+        return None
+    # Under async execution the row must not be read on the event loop.
+    if running_async():
+        return loaders.for_model(field.related_model).aload(pk)
+    return loaders.for_model(field.related_model).load(pk)
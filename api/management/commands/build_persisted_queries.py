@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql import parse, validate
+
+from api.persisted import query_hash
+from api.schema import schema
+
+
+class Command(BaseCommand):
+    help = "Builds the persisted query registry from the app's .graphql operation files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory searched recursively for .graphql files.')
+        parser.add_argument('output', help='Registry file to write, e.g. persisted_queries.json.')
+
+    def handle(self, *args, **options):
+        registry = {}
+        for path in sorted(Path(options['source']).rglob('*.graphql')):
+            query = path.read_text()
+            errors = validate(schema.graphql_schema, parse(query))
+            if errors:
+                raise CommandError('{}: {}'.format(path, errors[0].message))
+            registry[query_hash(query)] = query
+
+        with open(options['output'], 'w') as output:
+            json.dump(registry, output, indent=2)
+        self.stdout.write('Wrote {} operations to {}'.format(len(registry), options['output']))
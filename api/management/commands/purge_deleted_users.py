@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.deletion import deleted_users, purge_user
+
+
+class Command(BaseCommand):
+    help = 'Deletes the rows of accounts marked deleted without waiting for their purge jobs, a chunk at a time (see ACCOUNT_DELETION).'
+
+    def handle(self, *args, **options):
+        users = list(deleted_users())
+        for user_id in users:
+            purge_user(user_id)
+            self.stdout.write('Purged user {}'.format(user_id))
+        self.stdout.write('Purged {} users'.format(len(users)))
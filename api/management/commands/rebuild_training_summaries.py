@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import enqueue
+from api.summaries import exercise_chunks, rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily training summaries from the workout history, a chunk of exercises at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Exercises rebuilt per transaction (default 500).')
+        parser.add_argument('--background', action='store_true', help='Queue a job per chunk for `manage.py run_worker` instead.')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            jobs = 0
+            for chunk in exercise_chunks(options['chunk_size']):
+                enqueue('rebuild_summaries', exercise_ids=chunk)
+                jobs += 1
+            self.stdout.write('Queued {} jobs'.format(jobs))
+            return
+        exercises = summaries = 0
+        for chunk in exercise_chunks(options['chunk_size']):
+            summaries += rebuild_summaries(chunk)
+            exercises += len(chunk)
+            self.stdout.write('Rebuilt {} exercises'.format(exercises))
+        self.stdout.write('Wrote {} daily summaries for {} exercises'.format(summaries, exercises))
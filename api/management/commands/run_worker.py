@@ -0,0 +1,24 @@
+from threading import Thread
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_due_jobs, work
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs from the Job table until stopped (see JOB_QUEUE).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at once by this process, one thread each (default 1).')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due one at a time, then exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write('Ran {} jobs'.format(run_due_jobs()))
+            return
+        threads = [Thread(target=work, daemon=True) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        self.stdout.write('Worker started with {} threads'.format(len(threads)))
+        for thread in threads:
+            thread.join()
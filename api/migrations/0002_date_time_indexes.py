@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sessionlog',
+            index=models.Index(fields=['user_id', 'date_time'], name='sessionlog_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutlog',
+            index=models.Index(fields=['exercise_id', 'date_time'], name='workoutlog_exercise_date_idx'),
+        ),
+    ]
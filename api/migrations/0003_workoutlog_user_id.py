@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def copy_exercise_owner(apps, schema_editor):
+    # One set-based UPDATE rather than a save() per row.
+    WorkoutLog = apps.get_model('api', 'WorkoutLog')
+    Exercise = apps.get_model('api', 'Exercise')
+    WorkoutLog.objects.update(
+        user_id=Subquery(Exercise.objects.filter(pk=OuterRef('exercise_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_date_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workoutlog',
+            name='user_id',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_exercise_owner, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='workoutlog',
+            name='user_id',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='workoutlog',
+            index=models.Index(fields=['user_id', 'date_time'], name='workoutlog_user_date_idx'),
+        ),
+    ]
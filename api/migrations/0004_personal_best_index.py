@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_personal_bests(apps, schema_editor):
+    # Raise every record to the heaviest workout logged so far. Values set by
+    # hand through updateExercise are never lowered.
+    Exercise = apps.get_model('api', 'Exercise')
+    WorkoutLog = apps.get_model('api', 'WorkoutLog')
+    heaviest = WorkoutLog.objects.filter(exercise_id=OuterRef('pk')).order_by('-weight_kg').values('weight_kg')[:1]
+    Exercise.objects.update(personal_best=Greatest(F('personal_best'), Coalesce(Subquery(heaviest), Value(0))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_workoutlog_user_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workoutlog',
+            index=models.Index(fields=['exercise_id', 'weight_kg'], name='workoutlog_exercise_weight_idx'),
+        ),
+        migrations.RunPython(backfill_personal_bests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+REP_MAXES = (1, 3, 5, 8, 10)
+
+
+def backfill_rep_maxes(apps, schema_editor):
+    # Replays each exercise's history once in date order, streaming the
+    # workouts and writing records in batches.
+    WorkoutLog = apps.get_model('api', 'WorkoutLog')
+    RepMax = apps.get_model('api', 'RepMax')
+    PersonalRecord = apps.get_model('api', 'PersonalRecord')
+    history = WorkoutLog.objects.order_by('exercise_id', 'date_time', 'pk').values_list('pk', 'exercise_id', 'reps', 'weight_kg', 'date_time')
+    best = {}
+    records = []
+    for workout_id, exercise_id, reps, weight_kg, date_time in history.iterator(chunk_size=2000):
+        for rep_max in REP_MAXES:
+            key = (exercise_id, rep_max)
+            if rep_max <= reps and (key not in best or weight_kg > best[key].weight_kg):
+                best[key] = PersonalRecord(exercise_id_id=exercise_id, workout_id_id=workout_id, reps=rep_max, weight_kg=weight_kg, date_time=date_time)
+                records.append(best[key])
+        if len(records) >= 2000:
+            PersonalRecord.objects.bulk_create(records)
+            records = []
+    PersonalRecord.objects.bulk_create(records)
+    RepMax.objects.bulk_create([
+        RepMax(exercise_id_id=record.exercise_id_id, workout_id_id=record.workout_id_id, reps=record.reps, weight_kg=record.weight_kg, date_time=record.date_time)
+        for record in best.values()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_personal_best_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepMax',
+            fields=[
+                ('rep_max_id', models.AutoField(primary_key=True, serialize=False)),
+                ('reps', models.PositiveSmallIntegerField()),
+                ('weight_kg', models.PositiveSmallIntegerField()),
+                ('date_time', models.DateTimeField()),
+                ('exercise_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rep_maxes', to='api.exercise')),
+                ('workout_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.workoutlog')),
+            ],
+            options={
+                'ordering': ['reps'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PersonalRecord',
+            fields=[
+                ('record_id', models.AutoField(primary_key=True, serialize=False)),
+                ('reps', models.PositiveSmallIntegerField()),
+                ('weight_kg', models.PositiveSmallIntegerField()),
+                ('date_time', models.DateTimeField()),
+                ('exercise_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='personal_records', to='api.exercise')),
+                ('workout_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.workoutlog')),
+            ],
+            options={
+                'ordering': ['date_time', 'pk'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='repmax',
+            constraint=models.UniqueConstraint(fields=('exercise_id', 'reps'), name='repmax_exercise_reps_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='personalrecord',
+            index=models.Index(fields=['exercise_id', 'date_time'], name='personalrecord_exercise_idx'),
+        ),
+        migrations.RunPython(backfill_rep_maxes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_daily_summaries(apps, schema_editor):
+    # Same grouped read as api.summaries.rebuild_summaries, 500 exercises at a time.
+    Exercise = apps.get_model('api', 'Exercise')
+    WorkoutLog = apps.get_model('api', 'WorkoutLog')
+    DailySummary = apps.get_model('api', 'DailySummary')
+    exercise_ids = list(Exercise.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(exercise_ids), 500):
+        days = WorkoutLog.objects.filter(exercise_id__in=exercise_ids[start:start + 500]).values(
+            'exercise_id', 'user_id', day=TruncDate('date_time'),
+        ).annotate(
+            volume_kg=Sum(F('reps') * F('sets') * F('weight_kg'), output_field=models.PositiveIntegerField()),
+            top_set_kg=Max('weight_kg'),
+            workout_count=Count('pk'),
+        ).order_by()
+        DailySummary.objects.bulk_create([
+            DailySummary(
+                user_id_id=row['user_id'], exercise_id_id=row['exercise_id'], day=row['day'],
+                volume_kg=row['volume_kg'], top_set_kg=row['top_set_kg'], workout_count=row['workout_count'],
+            )
+            for row in days
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_rep_maxes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('summary_id', models.AutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('volume_kg', models.PositiveIntegerField(default=0)),
+                ('top_set_kg', models.PositiveSmallIntegerField(default=0)),
+                ('workout_count', models.PositiveIntegerField(default=0)),
+                ('exercise_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='api.exercise')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['user_id', 'day'], name='dailysummary_user_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysummary',
+            constraint=models.UniqueConstraint(fields=('exercise_id', 'day'), name='dailysummary_exercise_day_uniq'),
+        ),
+        migrations.RunPython(backfill_daily_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_session_owner(apps, schema_editor):
+    SessionLog_Exercise = apps.get_model('api', 'SessionLog_Exercise')
+    SessionLog = apps.get_model('api', 'SessionLog')
+    SessionLog_Exercise.objects.update(
+        user_id=Subquery(SessionLog.objects.filter(pk=OuterRef('session_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0006_daily_summaries'),
+    ]
+
+    operations = [
+        # Existing rows count as changed now, so the first sync sends them.
+        migrations.AddField(
+            model_name='exercise',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='workoutlog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sessionlog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sessionlog_exercise',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sessionlog_exercise',
+            name='user_id',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_session_owner, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sessionlog_exercise',
+            name='user_id',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('tombstone_id', models.AutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=30)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'deleted_at'], name='tombstone_user_deleted_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=models.Index(fields=['user_id', 'updated_at'], name='exercise_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutlog',
+            index=models.Index(fields=['user_id', 'updated_at'], name='workoutlog_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sessionlog',
+            index=models.Index(fields=['user_id', 'updated_at'], name='sessionlog_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sessionlog_exercise',
+            index=models.Index(fields=['user_id', 'updated_at'], name='sessionexercise_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_change_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedOperation',
+            fields=[
+                ('operation_id', models.AutoField(primary_key=True, serialize=False)),
+                ('idempotency_key', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=30)),
+                ('object_id', models.PositiveIntegerField()),
+                ('applied_at', models.DateTimeField(auto_now_add=True)),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='appliedoperation',
+            constraint=models.UniqueConstraint(fields=('user_id', 'idempotency_key'), name='appliedoperation_user_key_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_applied_operations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extenduser',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
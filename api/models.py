@@ -1,10 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
 
 class ExtendUser(AbstractUser):
     user_id = models.AutoField(primary_key=True)
     email = models.EmailField(blank=False, max_length=255, verbose_name='email')
+    # Set when a large account is deleted; its rows are purged later by a
+    # background job.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
 
     USERNAME_FIELD = 'username'
     EMAIL_FIELD = 'email'
@@ -19,6 +23,11 @@ class Exercise(models.Model):
     external_exercise_name = models.CharField(max_length=100, null=False)
     external_exercise_bodypart = models.CharField(max_length=20, null=False)
     personal_best = models.SmallIntegerField(default=0)
+    # Set on every write; queryset updates must set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'updated_at'], name='exercise_user_updated_idx')]
 
     def __str__(self):
         return 'User: ' + str(self.user_id) + ", Exercise: " + self.external_exercise_name
@@ -26,10 +35,29 @@ class Exercise(models.Model):
 class WorkoutLog(models.Model):
     workout_id = models.AutoField(primary_key=True)
     exercise_id = models.ForeignKey(Exercise, on_delete=models.CASCADE, null=False)
+    # Copy of exercise_id.user_id, so a user's history is one index range.
+    user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False, editable=False)
     date_time = models.DateTimeField(auto_now_add=True)
     reps = models.PositiveSmallIntegerField(null=False)
     weight_kg = models.PositiveSmallIntegerField(null=False)
     sets = models.PositiveSmallIntegerField(null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Serves "this exercise's workouts in date order" and date ranges of it.
+        indexes = [
+            models.Index(fields=['exercise_id', 'date_time'], name='workoutlog_exercise_date_idx'),
+            models.Index(fields=['user_id', 'date_time'], name='workoutlog_user_date_idx'),
+            models.Index(fields=['exercise_id', 'weight_kg'], name='workoutlog_exercise_weight_idx'),
+            models.Index(fields=['user_id', 'updated_at'], name='workoutlog_user_updated_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # An exercise never changes owner, so the copy only needs setting once.
+        # bulk_create() skips this; callers set user_id_id themselves.
+        if self.user_id_id is None:
+            self.user_id_id = self.exercise_id.user_id_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return 'Workout ID: ' + str(self.workout_id) + ", Exercise ID: " + str(self.exercise_id)
@@ -39,6 +67,13 @@ class SessionLog(models.Model):
     user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False)
     date_time = models.DateTimeField(auto_now_add=True)
     session_name = models.CharField(max_length=30, null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'date_time'], name='sessionlog_user_date_idx'),
+            models.Index(fields=['user_id', 'updated_at'], name='sessionlog_user_updated_idx'),
+        ]
 
     def __str__(self):
         return 'User: ' + str(self.user_id) + ', Session: ' + self.session_name
@@ -48,6 +83,140 @@ class SessionLog_Exercise(models.Model):
     session_exercise_id = models.AutoField(primary_key=True)
     session_id = models.ForeignKey(SessionLog, on_delete=models.CASCADE, null=False)
     exercise_id = models.ForeignKey(Exercise, on_delete=models.CASCADE, null=False)
+    # Copy of session_id.user_id, so a user's changes are one index range.
+    user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'updated_at'], name='sessionexercise_updated_idx')]
+
+    def save(self, *args, **kwargs):
+        # bulk_create() skips this; callers set user_id_id themselves.
+        if self.user_id_id is None:
+            self.user_id_id = self.session_id.user_id_id
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return 'Session ID: ' + str(self.session_id) + ', Exercise ID: ' + str(self.exercise_id)
+
+
+class RepMax(models.Model):
+    # The heaviest weight_kg lifted for at least `reps` reps, one row per
+    # exercise and tracked rep count. Kept up to date by api.records on every
+    # workout write, so reading them never touches the workout history.
+    rep_max_id = models.AutoField(primary_key=True)
+    exercise_id = models.ForeignKey(Exercise, on_delete=models.CASCADE, null=False, related_name='rep_maxes')
+    workout_id = models.ForeignKey(WorkoutLog, on_delete=models.CASCADE, null=False, related_name='+')
+    reps = models.PositiveSmallIntegerField(null=False)
+    weight_kg = models.PositiveSmallIntegerField(null=False)
+    # When the record was set, copied from the workout.
+    date_time = models.DateTimeField(null=False)
+
+    class Meta:
+        ordering = ['reps']
+        constraints = [models.UniqueConstraint(fields=['exercise_id', 'reps'], name='repmax_exercise_reps_uniq')]
+
+    def __str__(self):
+        return 'Exercise ID: ' + str(self.exercise_id_id) + ', ' + str(self.reps) + 'RM: ' + str(self.weight_kg) + 'kg'
+
+
+class PersonalRecord(models.Model):
+    # One row each time a workout beat a rep max: the timeline of records.
+    record_id = models.AutoField(primary_key=True)
+    exercise_id = models.ForeignKey(Exercise, on_delete=models.CASCADE, null=False, related_name='personal_records')
+    workout_id = models.ForeignKey(WorkoutLog, on_delete=models.CASCADE, null=False, related_name='+')
+    reps = models.PositiveSmallIntegerField(null=False)
+    weight_kg = models.PositiveSmallIntegerField(null=False)
+    date_time = models.DateTimeField(null=False)
+
+    class Meta:
+        ordering = ['date_time', 'pk']
+        indexes = [models.Index(fields=['exercise_id', 'date_time'], name='personalrecord_exercise_idx')]
+
+    def __str__(self):
+        return 'Exercise ID: ' + str(self.exercise_id_id) + ', ' + str(self.reps) + 'RM: ' + str(self.weight_kg) + 'kg'
+
+
+class DailySummary(models.Model):
+    # One row per exercise and day it was trained, kept up to date by
+    # api.summaries on every workout write. Progress charts read these
+    # instead of the workout history.
+    summary_id = models.AutoField(primary_key=True)
+    user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False)
+    exercise_id = models.ForeignKey(Exercise, on_delete=models.CASCADE, null=False, related_name='daily_summaries')
+    day = models.DateField(null=False)
+    # Sum of reps x sets x weight_kg.
+    volume_kg = models.PositiveIntegerField(default=0)
+    top_set_kg = models.PositiveSmallIntegerField(default=0)
+    workout_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [models.UniqueConstraint(fields=['exercise_id', 'day'], name='dailysummary_exercise_day_uniq')]
+        indexes = [models.Index(fields=['user_id', 'day'], name='dailysummary_user_day_idx')]
+
+    def __str__(self):
+        return 'Exercise ID: ' + str(self.exercise_id_id) + ', Day: ' + str(self.day)
+
+
+class Tombstone(models.Model):
+    # Left behind by every deleted Exercise, WorkoutLog, SessionLog and
+    # SessionLog_Exercise, so the sync query can tell clients what is gone.
+    tombstone_id = models.AutoField(primary_key=True)
+    user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False)
+    # The deleted row's model name and primary key.
+    model = models.CharField(max_length=30, null=False)
+    object_id = models.PositiveIntegerField(null=False)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_id', 'deleted_at'], name='tombstone_user_deleted_idx')]
+
+    def __str__(self):
+        return self.model + ' ID: ' + str(self.object_id)
+
+
+class AppliedOperation(models.Model):
+    # One row per operation applied by replayOperations, so a batch sent
+    # again after a timeout maps to the rows it already created.
+    operation_id = models.AutoField(primary_key=True)
+    user_id = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=False)
+    idempotency_key = models.CharField(max_length=64, null=False)
+    # The created row's model name and primary key.
+    model = models.CharField(max_length=30, null=False)
+    object_id = models.PositiveIntegerField(null=False)
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user_id', 'idempotency_key'], name='appliedoperation_user_key_uniq')]
+
+    def __str__(self):
+        return self.idempotency_key + ': ' + self.model + ' ID: ' + str(self.object_id)
+
+
+class Job(models.Model):
+    # A unit of background work for `manage.py run_worker`; see api.jobs.
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    job_id = models.AutoField(primary_key=True)
+    # The registered task that runs it, and its keyword arguments.
+    name = models.CharField(max_length=100, null=False)
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=10, choices=STATES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not run before this; pushed back after a failed attempt.
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'run_at'], name='job_state_run_at_idx')]
 
     def __str__(self):
-        return 'Session ID: ' + str(self.session_id) + ', Exercise ID: ' + str(self.exercise_id) 
\ No newline at end of file
+        return self.name + ' ID: ' + str(self.job_id) + ' (' + self.state + ')'
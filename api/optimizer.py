@@ -0,0 +1,100 @@
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def selected_fields(selection_set, fragments):
+    # Flatten a selection set into its field nodes, following named and
+    # inline fragments so `...WorkoutFields` counts the same as inline fields.
+    fields = []
+    if selection_set is None:
+        return fields
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields.append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            fields.extend(selected_fields(selection.selection_set, fragments))
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                fields.extend(selected_fields(fragment.selection_set, fragments))
+    return fields
+
+
+def model_fields(model):
+    # Reverse relations are selected by their accessor (`exercise_set`),
+    # everything else by the field name.
+    fields = {}
+    for field in model._meta.get_fields():
+        if field.auto_created and not field.concrete:
+            if field.one_to_many:
+                fields[field.get_accessor_name()] = field
+        else:
+            fields[field.name] = field
+    return fields
+
+
+def plan(model, field_nodes, fragments, prefix=''):
+    only = {prefix + model._meta.pk.name}
+    select_related = set()
+    prefetch_related = []
+    available = model_fields(model)
+    # Relations selected more than once, under aliases or from several
+    # fragments, are planned once from all of their selections.
+    relations = {}
+
+    for node in field_nodes:
+        for selection in selected_fields(node.selection_set, fragments):
+            field = available.get(to_snake_case(selection.name.value))
+            if field is None:
+                continue
+            if (field.auto_created and not field.concrete) or field.many_to_one or field.one_to_one:
+                relations.setdefault(field, []).append(selection)
+            elif field.concrete and not field.many_to_many:
+                only.add(prefix + field.name)
+
+    for field, selections in relations.items():
+        if field.auto_created and not field.concrete:
+            # The prefetched rows need their FK back to us to be matched up.
+            queryset = optimize_nodes(field.related_model._default_manager.all(), selections, fragments, field.field.name)
+            prefetch_related.append(Prefetch(prefix + field.get_accessor_name(), queryset=queryset))
+        else:
+            path = prefix + field.name
+            only.add(path)
+            select_related.add(path)
+            related = plan(field.related_model, selections, fragments, path + '__')
+            only |= related[0]
+            select_related |= related[1]
+            prefetch_related.extend(related[2])
+
+    return only, select_related, prefetch_related
+
+
+def optimize_nodes(queryset, field_nodes, fragments, *required):
+    only, select_related, prefetch_related = plan(queryset.model, field_nodes, fragments)
+    queryset = queryset.only(*only, *required)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+def optimize(queryset, info):
+    # Shape a resolver's queryset to what the client actually asked for:
+    # join forward FKs, prefetch reverse sets and fetch only selected columns.
+    return optimize_nodes(queryset, info.field_nodes, info.fragments)
+
+
+def connection_nodes(field_nodes, fragments):
+    # `edges { node { ... } }` of a connection field.
+    nodes = []
+    for node in field_nodes:
+        for edges in selected_fields(node.selection_set, fragments):
+            if edges.name.value == 'edges':
+                nodes.extend(field for field in selected_fields(edges.selection_set, fragments) if field.name.value == 'node')
+    return nodes
+
+
+def optimize_connection(queryset, info, *required):
+    return optimize_nodes(queryset, connection_nodes(info.field_nodes, info.fragments), info.fragments, *required)
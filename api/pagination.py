@@ -0,0 +1,79 @@
+import base64
+import json
+
+from django.db.models import Q
+from graphene.relay import PageInfo
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+
+from .loaders import collect
+from .optimizer import optimize_connection
+
+
+def encode_cursor(instance, keys):
+    values = [getattr(instance, key) for key in keys]
+    values = [value if isinstance(value, int) else str(value) for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(model, keys, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(keys):
+            raise ValueError
+        fields = [model._meta.pk if key == 'pk' else model._meta.get_field(key) for key in keys]
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        raise GraphQLError('Invalid cursor: ' + cursor)
+
+
+def keyset_filter(keys, values, direction):
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y)
+    condition = Q()
+    equal = {}
+    for key, value in zip(keys, values):
+        condition |= Q(**equal, **{key + '__' + direction: value})
+        equal[key] = value
+    return condition
+
+
+def paginate(info, connection_type, queryset, keys, first=None, after=None, last=None, before=None):
+    # Keyset pagination: every page is an indexed range read on `keys`, so
+    # page N costs the same as page 1.
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    for name, value in (('first', first), ('last', last)):
+        if value is not None and (value < 0 or value > max_limit):
+            raise GraphQLError('Argument "{}" must be between 0 and {}.'.format(name, max_limit))
+    if first is None and last is None:
+        first = max_limit
+
+    model = queryset.model
+    if after is not None:
+        queryset = queryset.filter(keyset_filter(keys, decode_cursor(model, keys, after), 'gt'))
+    if before is not None:
+        queryset = queryset.filter(keyset_filter(keys, decode_cursor(model, keys, before), 'lt'))
+
+    queryset = optimize_connection(queryset, info, *[key for key in keys if key != 'pk'])
+    if last is not None and first is None:
+        rows = list(collect(info, queryset.order_by(*['-' + key for key in keys])[:last + 1]))
+        has_previous_page = len(rows) > last
+        rows = rows[:last][::-1]
+        has_next_page = before is not None
+    else:
+        rows = list(collect(info, queryset.order_by(*keys)[:first + 1]))
+        has_next_page = len(rows) > first
+        rows = rows[:first]
+        if last is not None:
+            rows = rows[-last:] if last else []
+        has_previous_page = after is not None
+
+    edges = [connection_type.Edge(node=row, cursor=encode_cursor(row, keys)) for row in rows]
+    return connection_type(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        ),
+    )
@@ -0,0 +1,101 @@
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+from django.conf import settings
+
+
+def query_hash(query):
+    return sha256(query.encode()).hexdigest()
+
+
+class PersistedQueryStore:
+    # In-memory sha256 -> operation text map. The registry file warms it
+    # when the app starts, so hashed lookups never touch disk or the DB.
+    # Operations clients register at runtime go in a separate LRU of
+    # GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE entries, so anonymous clients
+    # cannot grow it without bound or evict the registry.
+
+    def __init__(self):
+        self.queries = {}
+        self.registered = OrderedDict()
+        self.lock = Lock()
+
+    def load(self, path):
+        # The registry is either {"<sha256>": "<query>", ...} or a plain list
+        # of operation strings.
+        with open(path) as registry:
+            entries = json.load(registry)
+        if isinstance(entries, dict):
+            entries = entries.values()
+        for query in entries:
+            self.queries[query_hash(query)] = query
+
+    def register(self, query):
+        key = query_hash(query)
+        with self.lock:
+            self.registered[key] = query
+            self.registered.move_to_end(key)
+            while len(self.registered) > settings.GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE:
+                self.registered.popitem(last=False)
+        return key
+
+    def get(self, key):
+        query = self.queries.get(key)
+        if query is not None:
+            return query
+        with self.lock:
+            query = self.registered.get(key)
+            if query is not None:
+                self.registered.move_to_end(key)
+        return query
+
+    def is_allowed(self, key):
+        # Strict mode only runs operations from the registry file.
+        return key in self.queries
+
+    def __contains__(self, key):
+        return key in self.queries or key in self.registered
+
+    def clear(self):
+        with self.lock:
+            self.queries.clear()
+            self.registered.clear()
+
+
+persisted_queries = PersistedQueryStore()
+
+
+class PersistedQueryError(Exception):
+    # Raised by resolve_query(); the message is what clients see.
+
+    def __init__(self, message, status=200):
+        super().__init__(message)
+        self.status = status
+
+
+def resolve_query(query, extensions):
+    # Automatic persisted queries, for every transport: the client may send
+    # only extensions.persistedQuery.sha256Hash and resend the full text once
+    # if the hash is unknown. Returns the operation text to run.
+    persisted = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+    strict = settings.GRAPHQL_PERSISTED_QUERIES['STRICT']
+
+    if persisted:
+        key = persisted.get('sha256Hash')
+        if query:
+            if query_hash(query) != key:
+                raise PersistedQueryError('provided sha does not match query', 400)
+            if not persisted_queries.is_allowed(key):
+                if strict:
+                    raise PersistedQueryError('PersistedQueryNotAllowed')
+                persisted_queries.register(query)
+        else:
+            query = persisted_queries.get(key)
+            if query is None:
+                raise PersistedQueryError('PersistedQueryNotFound')
+    elif strict and query and not persisted_queries.is_allowed(query_hash(query)):
+        raise PersistedQueryError('PersistedQueryNotAllowed')
+
+    return query
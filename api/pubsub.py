@@ -0,0 +1,108 @@
+import asyncio
+from collections import defaultdict
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class PubSub:
+    # Backends deliver messages published on a channel to everyone
+    # subscribed to it. publish() is called from sync code in any thread and
+    # must not block; subscribe() returns an async iterator that receives
+    # every message published after it was called. Messages are model
+    # instances, so a cross-process backend needs to pickle them.
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+
+class InProcessPubSub(PubSub):
+    # Delivers to subscribers in this process only. Enough for tests and a
+    # single ASGI worker; several workers need a shared backend.
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self.subscribers = defaultdict(set)
+        self.lock = Lock()
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's event loop is already closed.
+                pass
+
+    def subscribe(self, channel):
+        return InProcessSubscription(self, channel)
+
+    def add(self, subscription):
+        with self.lock:
+            self.subscribers[subscription.channel].add(subscription)
+
+    def remove(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+
+class InProcessSubscription:
+    # Registers as soon as it is created, so nothing published between the
+    # subscribe message and the first read is lost.
+
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(pubsub.max_queue_size)
+        pubsub.add(self)
+
+    def deliver(self, message):
+        # A client that stops reading loses its oldest events rather than
+        # growing the queue without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    async def aclose(self):
+        self.pubsub.remove(self)
+
+
+_pubsub = None
+
+
+def get_pubsub():
+    global _pubsub
+    if _pubsub is None:
+        options = settings.GRAPHQL_PUBSUB
+        _pubsub = import_string(options['BACKEND'])(**options.get('OPTIONS', {}))
+    return _pubsub
+
+
+def workout_logged_channel(user_id):
+    return 'api:workout-logged:{}'.format(user_id)
+
+
+def personal_best_channel(exercise_id):
+    return 'api:personal-best:{}'.format(exercise_id)
+
+
+def publish_on_commit(channel, message):
+    # Subscribers must never see a row that is rolled back.
+    transaction.on_commit(lambda: get_pubsub().publish(channel, message))
@@ -0,0 +1,121 @@
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Exercise, PersonalRecord, RepMax, WorkoutLog
+from .pubsub import personal_best_channel, publish_on_commit
+
+# Exercise.personal_best is the heaviest weight_kg logged for the exercise.
+# It is kept up to date on every workout write with single conditional
+# UPDATEs, so nobody has to read an exercise's history to find it. The
+# same goes for the RepMax table and its PersonalRecord timeline.
+
+# Rep counts with a tracked rep max. A set of 6 reps counts towards 1, 3
+# and 5 reps.
+REP_MAXES = (1, 3, 5, 8, 10)
+
+
+def heaviest_workout():
+    # The (exercise_id, weight_kg) index makes this one index probe.
+    heaviest = WorkoutLog.objects.filter(exercise_id=OuterRef('pk')).order_by('-weight_kg').values('weight_kg')[:1]
+    return Coalesce(Subquery(heaviest), Value(0))
+
+
+def raise_personal_best(exercise_id, weight_kg):
+    # Only ever raises it, so concurrent writers cannot undo each other.
+    return Exercise.objects.filter(pk=exercise_id, personal_best__lt=weight_kg).update(personal_best=weight_kg, updated_at=timezone.now()) > 0
+
+
+def recompute_personal_best(exercise_id, weight_kg):
+    # After a workout of `weight_kg` was lowered or deleted. Unless it was
+    # the record the WHERE clause matches nothing and no workouts are read.
+    # Returns the exercise if its record changed.
+    if not Exercise.objects.filter(pk=exercise_id, personal_best__lte=weight_kg).update(personal_best=heaviest_workout(), updated_at=timezone.now()):
+        return None
+    exercise = Exercise.objects.get(pk=exercise_id)
+    return exercise if exercise.personal_best != weight_kg else None
+
+
+def raise_personal_bests(workouts):
+    # One read and at most one UPDATE however many exercises and sets were
+    # logged. Returns the exercises whose record was raised.
+    heaviest = {}
+    for workout in workouts:
+        heaviest[workout.exercise_id_id] = max(workout.weight_kg, heaviest.get(workout.exercise_id_id, 0))
+    raised = [exercise for exercise in Exercise.objects.filter(pk__in=heaviest) if exercise.personal_best < heaviest[exercise.pk]]
+    if raised:
+        Exercise.objects.filter(
+            reduce(or_, (Q(pk=exercise.pk, personal_best__lt=heaviest[exercise.pk]) for exercise in raised))
+        ).update(
+            personal_best=Case(
+                *(When(pk=exercise.pk, then=Value(heaviest[exercise.pk])) for exercise in raised),
+                default=F('personal_best'),
+                output_field=Exercise._meta.get_field('personal_best'),
+            ),
+            updated_at=timezone.now(),
+        )
+        for exercise in raised:
+            exercise.personal_best = heaviest[exercise.pk]
+    return raised
+
+
+def publish_personal_bests(exercises):
+    for exercise in exercises:
+        publish_on_commit(personal_best_channel(exercise.pk), exercise)
+
+
+def record_rep_maxes(workouts):
+    # After workouts are saved: one locked read of the exercises' rep maxes
+    # and, only if records were set, one upsert and one insert. The
+    # exercises are locked first, as FOR UPDATE locks no rep max that does
+    # not exist yet and two writers could both insert the first one.
+    best = {}
+    for workout in workouts:
+        for reps in REP_MAXES:
+            key = (workout.exercise_id_id, reps)
+            if reps <= workout.reps and (key not in best or workout.weight_kg > best[key].weight_kg):
+                best[key] = workout
+    if not best:
+        return
+    exercise_ids = {exercise_id for exercise_id, reps in best}
+    list(Exercise.objects.select_for_update().filter(pk__in=exercise_ids).order_by('pk').values_list('pk', flat=True))
+    rep_maxes = RepMax.objects.select_for_update().filter(exercise_id__in=exercise_ids)
+    current = {
+        (exercise_id, reps): weight_kg
+        for exercise_id, reps, weight_kg in rep_maxes.values_list('exercise_id', 'reps', 'weight_kg')
+    }
+    records = [
+        PersonalRecord(exercise_id_id=exercise_id, workout_id=workout, reps=reps, weight_kg=workout.weight_kg, date_time=workout.date_time)
+        for (exercise_id, reps), workout in best.items()
+        if (exercise_id, reps) not in current or workout.weight_kg > current[exercise_id, reps]
+    ]
+    if records:
+        RepMax.objects.bulk_create(
+            [RepMax(exercise_id_id=record.exercise_id_id, workout_id=record.workout_id, reps=record.reps, weight_kg=record.weight_kg, date_time=record.date_time) for record in records],
+            update_conflicts=True,
+            update_fields=['workout_id', 'weight_kg', 'date_time'],
+            # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target.
+            unique_fields=['exercise_id', 'reps'] if connection.features.supports_update_conflicts_with_target else None,
+        )
+        PersonalRecord.objects.bulk_create(records)
+
+
+def forget_rep_maxes(workout):
+    # Before a workout is edited or deleted: drop the records it set and
+    # refill the rep maxes it held from the rest of the exercise's history.
+    held = list(RepMax.objects.filter(workout_id=workout).values_list('reps', flat=True))
+    PersonalRecord.objects.filter(workout_id=workout).delete()
+    if not held:
+        return
+    RepMax.objects.filter(workout_id=workout).delete()
+    history = WorkoutLog.objects.filter(exercise_id=workout.exercise_id_id).exclude(pk=workout.pk).order_by('-weight_kg', 'date_time', 'pk')
+    rep_maxes = []
+    for reps in held:
+        best = history.filter(reps__gte=reps).first()
+        if best is not None:
+            rep_maxes.append(RepMax(exercise_id_id=best.exercise_id_id, workout_id=best, reps=reps, weight_kg=best.weight_kg, date_time=best.date_time))
+    RepMax.objects.bulk_create(rep_maxes)
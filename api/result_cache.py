@@ -0,0 +1,142 @@
+import json
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from graphql import print_ast
+
+from .models import Exercise, SessionLog
+
+
+# Every cached result belongs to the user who owns the rows. Its key
+# includes that user's version number, so bumping the version from a
+# mutation orphans every stale entry at once, on any cache backend.
+
+def user_version_key(user_id):
+    return 'api:user-version:{}'.format(user_id)
+
+
+def user_version(user_id):
+    return cache.get_or_set(user_version_key(user_id), 1, None)
+
+
+def bump_user_version(user_id):
+    try:
+        cache.incr(user_version_key(user_id))
+    except ValueError:
+        cache.set(user_version_key(user_id), 2, None)
+
+
+def invalidate_user(user_id):
+    # Bump now for this request and again after commit, so a read that ran
+    # between the two cannot leave pre-commit rows cached under the new version.
+    if user_id is None:
+        return
+    bump_user_version(user_id)
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+async def abump_user_version(user_id):
+    try:
+        await cache.aincr(user_version_key(user_id))
+    except ValueError:
+        await cache.aset(user_version_key(user_id), 2, None)
+
+
+async def ainvalidate_user(user_id):
+    # The async ORM cannot run inside atomic(), so the write is already
+    # committed and a single bump is enough.
+    if user_id is not None:
+        await abump_user_version(user_id)
+
+
+def owner_key(model, pk):
+    return 'api:{}-owner:{}'.format(model._meta.model_name, pk)
+
+
+def cached_owner(model, pk):
+    # Exercises and sessions never change owner, so the mapping can be
+    # cached forever. None if the row does not exist.
+    key = owner_key(model, pk)
+    owner = cache.get(key)
+    if owner is None:
+        owner = model.objects.filter(pk=pk).values_list('user_id', flat=True).first()
+        if owner is not None:
+            cache.set(key, owner, None)
+    return owner
+
+
+async def acached_owner(model, pk):
+    key = owner_key(model, pk)
+    owner = await cache.aget(key)
+    if owner is None:
+        owner = await model.objects.filter(pk=pk).values_list('user_id', flat=True).afirst()
+        if owner is not None:
+            await cache.aset(key, owner, None)
+    return owner
+
+
+def forget_owners(model, pks):
+    # When the rows are deleted. Dropped again after commit, like
+    # invalidate_user(), so a lookup in between cannot cache them back.
+    keys = [owner_key(model, pk) for pk in pks]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_owner(model, pk):
+    forget_owners(model, [pk])
+
+
+def exercise_owner(exercise_id):
+    return cached_owner(Exercise, exercise_id)
+
+
+async def aexercise_owner(exercise_id):
+    return await acached_owner(Exercise, exercise_id)
+
+
+def session_owner(session_id):
+    return cached_owner(SessionLog, session_id)
+
+
+async def asession_owner(session_id):
+    return await acached_owner(SessionLog, session_id)
+
+
+def result_key(info, owner_id, version):
+    viewer = getattr(getattr(info.context, 'user', None), 'pk', None)
+    parts = [
+        info.parent_type.name,
+        *[print_ast(node) for node in info.field_nodes],
+        *[print_ast(info.fragments[name]) for name in sorted(info.fragments)],
+        json.dumps(info.variable_values, sort_keys=True, default=str),
+        str(viewer),
+        str(owner_id),
+        str(version),
+    ]
+    return 'api:result:' + sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def cached_result(info, owner_id, resolve):
+    if owner_id is None or getattr(info.context, 'graphql_streaming', False):
+        return resolve()
+    key = result_key(info, owner_id, user_version(owner_id))
+    result = cache.get(key)
+    if result is None:
+        result = list(resolve())
+        cache.set(key, result, settings.GRAPHQL_RESULT_CACHE_TIMEOUT)
+    return result
+
+
+async def acached_result(info, owner_id, resolve):
+    if owner_id is None:
+        return await resolve()
+    version = await cache.aget_or_set(user_version_key(owner_id), 1, None)
+    key = result_key(info, owner_id, version)
+    result = await cache.aget(key)
+    if result is None:
+        result = await resolve()
+        await cache.aset(key, result, settings.GRAPHQL_RESULT_CACHE_TIMEOUT)
+    return result
@@ -1,34 +1,195 @@
+from copy import copy
+
 import graphene
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 import graphql_jwt
 from graphene_django import DjangoObjectType 
+from graphql import GraphQLError
 from graphql_jwt.decorators import login_required
-from .models import ExtendUser, Exercise, WorkoutLog, SessionLog, SessionLog_Exercise
+from .models import ExtendUser, Exercise, WorkoutLog, SessionLog, SessionLog_Exercise, RepMax, PersonalRecord, DailySummary, Tombstone, AppliedOperation
+from .loaders import collect, load_foreign_key
+from .optimizer import optimize
+from .pagination import paginate
+from .execution import ApiSchema
+from .result_cache import cached_result, exercise_owner, forget_owner, invalidate_user, session_owner
+from .auth import get_user
+from .bulk import bulk_insert
+from .pubsub import get_pubsub, personal_best_channel, publish_on_commit, workout_logged_channel
+from .records import (
+    forget_rep_maxes, publish_personal_bests, raise_personal_best, raise_personal_bests, record_rep_maxes, recompute_personal_best,
+)
+from .summaries import add_to_summaries, change_in_summaries, remove_from_summaries, summary_series, user_summaries
+from .sync import Changes, bury_object, bury_session, decode_sync_cursor
+from .deletion import delete_user, purge_exercise
+from .writes import delete_row, does_not_exist, insert_row, payload_row, update_row
 
 class UserType(DjangoObjectType):
     class Meta:
         model = ExtendUser
-        exclude = ('password',)
+        exclude = ('password', 'deleted_at')
 
 class ExerciseType(DjangoObjectType):
     class Meta:
         model = Exercise
         fields = '__all__'
 
+    def resolve_user_id(self, info):
+        return load_foreign_key(self, info, 'user_id')
+
 class SessionLogType(DjangoObjectType):
     class Meta:
         model = SessionLog
         fields = '__all__'
 
+    def resolve_user_id(self, info):
+        return load_foreign_key(self, info, 'user_id')
+
 class WorkoutLogType(DjangoObjectType):
     class Meta:
         model = WorkoutLog
         fields = '__all__'
 
+    def resolve_exercise_id(self, info):
+        return load_foreign_key(self, info, 'exercise_id')
+
+    def resolve_user_id(self, info):
+        return load_foreign_key(self, info, 'user_id')
+
 class SessionLog_ExerciseType(DjangoObjectType):
     class Meta:
         model = SessionLog_Exercise
         fields = '__all__'
 
+    def resolve_session_id(self, info):
+        return load_foreign_key(self, info, 'session_id')
+
+    def resolve_exercise_id(self, info):
+        return load_foreign_key(self, info, 'exercise_id')
+
+    def resolve_user_id(self, info):
+        return load_foreign_key(self, info, 'user_id')
+
+# Exposed as Exercise.repMaxes and Exercise.personalRecords, which the
+# optimizer prefetches like any other reverse set.
+class RepMaxType(DjangoObjectType):
+    class Meta:
+        model = RepMax
+        fields = '__all__'
+
+    def resolve_exercise_id(self, info):
+        return load_foreign_key(self, info, 'exercise_id')
+
+    def resolve_workout_id(self, info):
+        return load_foreign_key(self, info, 'workout_id')
+
+class PersonalRecordType(DjangoObjectType):
+    class Meta:
+        model = PersonalRecord
+        fields = '__all__'
+
+    def resolve_exercise_id(self, info):
+        return load_foreign_key(self, info, 'exercise_id')
+
+    def resolve_workout_id(self, info):
+        return load_foreign_key(self, info, 'workout_id')
+
+class SummaryPeriod(graphene.Enum):
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+
+class TrainingSummaryType(DjangoObjectType):
+    # A day, week or month of one exercise. `day` is the period's first day.
+    class Meta:
+        model = DailySummary
+        exclude = ('summary_id',)
+
+    training_days = graphene.Int(required=True)
+
+    def resolve_user_id(self, info):
+        return load_foreign_key(self, info, 'user_id')
+
+    def resolve_exercise_id(self, info):
+        return load_foreign_key(self, info, 'exercise_id')
+
+    def resolve_training_days(self, info):
+        return getattr(self, 'training_days', 1)
+
+class TombstoneType(DjangoObjectType):
+    class Meta:
+        model = Tombstone
+        fields = ('model', 'object_id', 'deleted_at')
+
+class SyncType(graphene.ObjectType):
+    # Pass `cursor` as `since` on the next sync.
+    cursor = graphene.String(required=True)
+    exercises = graphene.List(graphene.NonNull(ExerciseType), required=True)
+    workouts = graphene.List(graphene.NonNull(WorkoutLogType), required=True)
+    sessions = graphene.List(graphene.NonNull(SessionLogType), required=True)
+    session_exercises = graphene.List(graphene.NonNull(SessionLog_ExerciseType), required=True)
+    deleted = graphene.List(graphene.NonNull(TombstoneType), required=True)
+
+    def resolve_exercises(self, info):
+        return self.rows(info, Exercise)
+
+    def resolve_workouts(self, info):
+        return self.rows(info, WorkoutLog)
+
+    def resolve_sessions(self, info):
+        return self.rows(info, SessionLog)
+
+    def resolve_session_exercises(self, info):
+        return self.rows(info, SessionLog_Exercise)
+
+    def resolve_deleted(self, info):
+        return self.deleted(info)
+
+
+class UserConnection(graphene.relay.Connection):
+    class Meta:
+        node = UserType
+
+class ExerciseConnection(graphene.relay.Connection):
+    class Meta:
+        node = ExerciseType
+
+class SessionLogConnection(graphene.relay.Connection):
+    class Meta:
+        node = SessionLogType
+
+class WorkoutLogConnection(graphene.relay.Connection):
+    class Meta:
+        node = WorkoutLogType
+
+
+def date_range(queryset, date_from=None, date_to=None):
+    # `from` is inclusive and `to` exclusive, so consecutive ranges never
+    # overlap. Combined with the owner filter this is a range read on the
+    # (owner, date_time) index.
+    if date_from is not None:
+        queryset = queryset.filter(date_time__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date_time__lt=date_to)
+    return queryset
+
+
+def record_workouts(workouts):
+    # Keeps the tables derived from the workout history up to date for
+    # freshly inserted workouts, inside the caller's transaction.
+    publish_personal_bests(raise_personal_bests(workouts))
+    record_rep_maxes(workouts)
+    add_to_summaries(workouts)
+
+
+def publish_workout(workout):
+    # After commit. The event carries the workout's exercise, read once here
+    # rather than by every subscriber.
+    exercise = Exercise.objects.filter(pk=workout.exercise_id_id).first()
+    if exercise is not None:
+        workout.exercise_id = exercise
+    get_pubsub().publish(workout_logged_channel(workout.user_id_id), workout)
+
 
 class Query(graphene.ObjectType):
 
@@ -41,54 +202,95 @@ class Query(graphene.ObjectType):
     get_exercise_by_exercise_id = graphene.Field(ExerciseType, exercise_id=graphene.Int())
 
     get_all_sessions = graphene.List(SessionLogType)
-    get_sessions_by_user_id = graphene.List(SessionLogType, user_id=graphene.Int())
+    get_sessions_by_user_id = graphene.List(SessionLogType, user_id=graphene.Int(), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
     get_session_by_session_id = graphene.Field(SessionLogType, session_id=graphene.Int())
 
     get_all_workouts = graphene.List(WorkoutLogType)
-    get_workouts_by_exercise_id = graphene.List(WorkoutLogType, exercise_id=graphene.Int())
+    get_workouts_by_exercise_id = graphene.List(WorkoutLogType, exercise_id=graphene.Int(), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
     get_workout_by_workout_id = graphene.Field(WorkoutLogType, workout_id=graphene.Int())
+    get_workouts_by_user_id = graphene.List(WorkoutLogType, user_id=graphene.Int(required=True), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
+    get_training_summaries = graphene.List(TrainingSummaryType, user_id=graphene.Int(required=True), period=SummaryPeriod(required=True), exercise_id=graphene.Int(), date_from=graphene.Date(name='from'), date_to=graphene.Date(name='to'))
+    sync = graphene.Field(SyncType, user_id=graphene.Int(required=True), since=graphene.String())
 
     get_exercises_by_session_id = graphene.List(SessionLog_ExerciseType, session_id=graphene.Int())
 
+    get_all_users_connection = graphene.relay.ConnectionField(UserConnection)
+    get_all_exercises_connection = graphene.relay.ConnectionField(ExerciseConnection)
+    get_all_sessions_connection = graphene.relay.ConnectionField(SessionLogConnection)
+    get_sessions_by_user_id_connection = graphene.relay.ConnectionField(SessionLogConnection, user_id=graphene.Int(required=True), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
+    get_all_workouts_connection = graphene.relay.ConnectionField(WorkoutLogConnection)
+    get_workouts_by_exercise_id_connection = graphene.relay.ConnectionField(WorkoutLogConnection, exercise_id=graphene.Int(required=True), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
+    get_workouts_by_user_id_connection = graphene.relay.ConnectionField(WorkoutLogConnection, user_id=graphene.Int(required=True), date_from=graphene.DateTime(name='from'), date_to=graphene.DateTime(name='to'))
+
     def resolve_get_all_users(self, info):
-        return ExtendUser.objects.all()
+        return collect(info, optimize(ExtendUser.objects.filter(deleted_at=None).order_by('pk'), info))
     
     def resolve_get_user_by_user_id(self, info, user_id):
-        return ExtendUser.objects.get(pk=user_id)
+        return optimize(ExtendUser.objects.filter(deleted_at=None), info).get(pk=user_id)
     
     @login_required
     def resolve_logged_in(self, info):
-        return info.context.user
+        return get_user(info)
 
     def resolve_get_all_exercises(self, info):
-        return Exercise.objects.all()
+        return collect(info, optimize(Exercise.objects.order_by('pk'), info))
     
     def resolve_get_exercises_by_user_id(self, info, user_id):
-        return Exercise.objects.filter(user_id=user_id)
+        return cached_result(info, user_id, lambda: collect(info, optimize(Exercise.objects.filter(user_id=user_id).order_by('pk'), info)))
     
     def resolve_get_exercise_by_exercise_id(self, info, exercise_id):
-        return Exercise.objects.get(pk=exercise_id)
+        return optimize(Exercise.objects.all(), info).get(pk=exercise_id)
     
     def resolve_get_all_sessions(self, info):
-        return SessionLog.objects.all()
+        return collect(info, optimize(SessionLog.objects.order_by('date_time', 'pk'), info))
     
-    def resolve_get_sessions_by_user_id(self, info, user_id):
-        return SessionLog.objects.filter(user_id=user_id)
+    def resolve_get_sessions_by_user_id(self, info, user_id, date_from=None, date_to=None):
+        return cached_result(info, user_id, lambda: collect(info, optimize(date_range(SessionLog.objects.filter(user_id=user_id), date_from, date_to).order_by('date_time', 'pk'), info)))
     
     def resolve_get_session_by_session_id(self, info, session_id):
-        return SessionLog.objects.get(pk=session_id)
+        return optimize(SessionLog.objects.all(), info).get(pk=session_id)
     
     def resolve_get_all_workouts(self, info):
-        return WorkoutLog.objects.all()
+        return collect(info, optimize(WorkoutLog.objects.order_by('date_time', 'pk'), info))
     
-    def resolve_get_workouts_by_exercise_id(self, info, exercise_id):
-        return WorkoutLog.objects.filter(exercise_id=exercise_id)
+    def resolve_get_workouts_by_exercise_id(self, info, exercise_id, date_from=None, date_to=None):
+        return cached_result(info, exercise_owner(exercise_id), lambda: collect(info, optimize(date_range(WorkoutLog.objects.filter(exercise_id=exercise_id), date_from, date_to).order_by('date_time', 'pk'), info)))
     
     def resolve_get_workout_by_workout_id(self, info, workout_id):
-        return WorkoutLog.objects.get(pk=workout_id)
+        return optimize(WorkoutLog.objects.all(), info).get(pk=workout_id)
+
+    def resolve_get_workouts_by_user_id(self, info, user_id, date_from=None, date_to=None):
+        return cached_result(info, user_id, lambda: collect(info, optimize(date_range(WorkoutLog.objects.filter(user_id=user_id), date_from, date_to).order_by('date_time', 'pk'), info)))
+    
+    def resolve_get_training_summaries(self, info, user_id, period, exercise_id=None, date_from=None, date_to=None):
+        return cached_result(info, user_id, lambda: collect(info, summary_series(user_summaries(user_id, exercise_id, date_from, date_to), period.value)))
+    
+    def resolve_sync(self, info, user_id, since=None):
+        return Changes(user_id, None if since is None else decode_sync_cursor(since))
     
     def resolve_get_exercises_by_session_id(self, info, session_id):
-        return SessionLog_Exercise.objects.filter(session_id=session_id)
+        return collect(info, optimize(SessionLog_Exercise.objects.filter(session_id=session_id).order_by('pk'), info))
+
+    def resolve_get_all_users_connection(self, info, **kwargs):
+        return paginate(info, UserConnection, ExtendUser.objects.filter(deleted_at=None), ('pk',), **kwargs)
+
+    def resolve_get_all_exercises_connection(self, info, **kwargs):
+        return paginate(info, ExerciseConnection, Exercise.objects.all(), ('pk',), **kwargs)
+
+    def resolve_get_all_sessions_connection(self, info, **kwargs):
+        return paginate(info, SessionLogConnection, SessionLog.objects.all(), ('date_time', 'pk'), **kwargs)
+
+    def resolve_get_sessions_by_user_id_connection(self, info, user_id, date_from=None, date_to=None, **kwargs):
+        return paginate(info, SessionLogConnection, date_range(SessionLog.objects.filter(user_id=user_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
+
+    def resolve_get_all_workouts_connection(self, info, **kwargs):
+        return paginate(info, WorkoutLogConnection, WorkoutLog.objects.all(), ('date_time', 'pk'), **kwargs)
+
+    def resolve_get_workouts_by_exercise_id_connection(self, info, exercise_id, date_from=None, date_to=None, **kwargs):
+        return paginate(info, WorkoutLogConnection, date_range(WorkoutLog.objects.filter(exercise_id=exercise_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
+
+    def resolve_get_workouts_by_user_id_connection(self, info, user_id, date_from=None, date_to=None, **kwargs):
+        return paginate(info, WorkoutLogConnection, date_range(WorkoutLog.objects.filter(user_id=user_id), date_from, date_to), ('date_time', 'pk'), **kwargs)
     
 
 class UserMutationCreate(graphene.Mutation):
@@ -105,6 +307,7 @@ class UserMutationCreate(graphene.Mutation):
         user = ExtendUser(username=username, email=email)
         user.set_password(password)
         user.save()
+        invalidate_user(user.pk)
         return UserMutationCreate(user = user)
 
 class UserMutationUpdate(graphene.Mutation):
@@ -117,10 +320,9 @@ class UserMutationUpdate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, user_id, username):
-        user = ExtendUser.objects.get(user_id = user_id)
-        user.username = username
-        user.save()
-        return UserMutationUpdate(user = user)
+        values = update_row(ExtendUser, user_id, username=username)
+        invalidate_user(user_id)
+        return UserMutationUpdate(user = payload_row(info, 'user', ExtendUser, user_id, **values))
 
 class UserMutationDelete(graphene.Mutation):
 
@@ -131,8 +333,8 @@ class UserMutationDelete(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, user_id):
-        user = ExtendUser.objects.get(user_id = user_id)
-        user.delete()
+        delete_user(user_id)
+        invalidate_user(user_id)
         return
 
 class ExerciseMutationCreate(graphene.Mutation):
@@ -147,9 +349,9 @@ class ExerciseMutationCreate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, user_id, external_exercise_id, external_exercise_name, external_exercise_bodypart):
-        user_obj = ExtendUser.objects.get(user_id=user_id)
-        exercise = Exercise(user_id=user_obj, external_exercise_id=external_exercise_id, external_exercise_name=external_exercise_name, external_exercise_bodypart=external_exercise_bodypart)
-        exercise.save()
+        exercise = Exercise(user_id_id=user_id, external_exercise_id=external_exercise_id, external_exercise_name=external_exercise_name, external_exercise_bodypart=external_exercise_bodypart)
+        insert_row(exercise, 'user_id')
+        invalidate_user(user_id)
         return ExerciseMutationCreate(exercise=exercise)
     
 class ExerciseMutationUpdate(graphene.Mutation):
@@ -162,9 +364,14 @@ class ExerciseMutationUpdate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, exercise_id, personal_best):
+        # Only writes if the record actually changes. The row is read back
+        # either way: the event carries all of it, and an exercise that was
+        # not updated may not exist.
+        changed = Exercise.objects.filter(exercise_id=exercise_id).exclude(personal_best=personal_best).update(personal_best=personal_best, updated_at=timezone.now())
         exercise = Exercise.objects.get(exercise_id=exercise_id)
-        exercise.personal_best = personal_best
-        exercise.save()
+        if changed:
+            invalidate_user(exercise.user_id_id)
+            publish_on_commit(personal_best_channel(exercise.pk), exercise)
         return ExerciseMutationUpdate(exercise=exercise)
 
 class ExerciseMutationDelete(graphene.Mutation):
@@ -176,8 +383,11 @@ class ExerciseMutationDelete(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, exercise_id):
-        exercise = Exercise.objects.get(exercise_id=exercise_id)
-        exercise.delete()
+        owner = exercise_owner(exercise_id)
+        if owner is None:
+            raise does_not_exist(Exercise)
+        purge_exercise(exercise_id, owner)
+        invalidate_user(owner)
         return
 
 class WorkoutMutationCreate(graphene.Mutation):
@@ -192,11 +402,52 @@ class WorkoutMutationCreate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, exercise_id, weight_kg, reps, sets):
-        exercise_obj = Exercise.objects.get(exercise_id=exercise_id)
-        workout = WorkoutLog(exercise_id=exercise_obj, weight_kg=weight_kg, reps=reps, sets=sets)
-        workout.save()
+        # The owner is cached, so usually the INSERT is the first query.
+        owner = exercise_owner(exercise_id)
+        if owner is None:
+            raise does_not_exist(Exercise)
+        workout = WorkoutLog(exercise_id_id=int(exercise_id), user_id_id=owner, weight_kg=weight_kg, reps=reps, sets=sets)
+        with transaction.atomic():
+            insert_row(workout, 'exercise_id')
+            if raise_personal_best(workout.exercise_id_id, weight_kg):
+                publish_personal_bests(Exercise.objects.filter(pk=workout.exercise_id_id))
+            record_rep_maxes([workout])
+            add_to_summaries([workout])
+        invalidate_user(owner)
+        transaction.on_commit(lambda: publish_workout(workout))
         return WorkoutMutationCreate(workout=workout)
 
+class WorkoutInput(graphene.InputObjectType):
+    exercise_id = graphene.ID(required=True)
+    weight_kg = graphene.Int(required=True)
+    reps = graphene.Int(required=True)
+    sets = graphene.Int(required=True)
+
+class WorkoutMutationBulkCreate(graphene.Mutation):
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(WorkoutInput), required=True)
+
+    workouts = graphene.List(WorkoutLogType)
+
+    @classmethod
+    def mutate(cls, root, info, input):
+        exercise_ids = {int(workout.exercise_id) for workout in input}
+        owners = dict(Exercise.objects.filter(pk__in=exercise_ids).values_list('pk', 'user_id'))
+        if len(owners) != len(exercise_ids):
+            raise Exercise.DoesNotExist('Exercise matching query does not exist.')
+        with transaction.atomic():
+            workouts = bulk_insert(WorkoutLog, [
+                WorkoutLog(exercise_id_id=int(workout.exercise_id), user_id_id=owners[int(workout.exercise_id)], weight_kg=workout.weight_kg, reps=workout.reps, sets=workout.sets)
+                for workout in input
+            ])
+            record_workouts(workouts)
+        for user_id in set(owners.values()):
+            invalidate_user(user_id)
+        for workout in workouts:
+            publish_on_commit(workout_logged_channel(owners[workout.exercise_id_id]), workout)
+        return WorkoutMutationBulkCreate(workouts=collect(info, workouts))
+
 class WorkoutMutationUpdate(graphene.Mutation):
 
     class Arguments:
@@ -209,11 +460,25 @@ class WorkoutMutationUpdate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, workout_id, weight_kg, reps, sets):
-        workout = WorkoutLog.objects.get(workout_id=workout_id)
-        workout.weight_kg = weight_kg
-        workout.reps = reps
-        workout.sets = sets
-        workout.save()
+        with transaction.atomic():
+            # The derived tables are adjusted by the old values, so this one
+            # write reads its row first, locked so edits of it apply in turn.
+            workout = WorkoutLog.objects.select_for_update().get(workout_id=workout_id)
+            previous = copy(workout)
+            workout.weight_kg = weight_kg
+            workout.reps = reps
+            workout.sets = sets
+            workout.save(update_fields=['weight_kg', 'reps', 'sets', 'updated_at'])
+            if weight_kg > previous.weight_kg:
+                publish_personal_bests(raise_personal_bests([workout]))
+            elif weight_kg < previous.weight_kg:
+                exercise = recompute_personal_best(workout.exercise_id_id, previous.weight_kg)
+                publish_personal_bests([exercise] if exercise else [])
+            if (weight_kg, reps) != (previous.weight_kg, previous.reps):
+                forget_rep_maxes(workout)
+                record_rep_maxes([workout])
+            change_in_summaries(previous, workout)
+        invalidate_user(workout.user_id_id)
         return WorkoutMutationUpdate(workout=workout)
 
 class WorkoutMutationDelete(graphene.Mutation):
@@ -225,8 +490,16 @@ class WorkoutMutationDelete(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, workout_id):
-        workout = WorkoutLog.objects.get(workout_id=workout_id)
-        workout.delete()
+        with transaction.atomic():
+            # As for updates, the derived tables need the deleted values.
+            workout = WorkoutLog.objects.select_for_update().get(workout_id=workout_id)
+            bury_object(workout)
+            forget_rep_maxes(workout)
+            delete_row(WorkoutLog, workout.pk)
+            exercise = recompute_personal_best(workout.exercise_id_id, workout.weight_kg)
+            publish_personal_bests([exercise] if exercise else [])
+            remove_from_summaries(workout)
+        invalidate_user(workout.user_id_id)
         return
 
 class SessionMutationCreate(graphene.Mutation):
@@ -239,9 +512,9 @@ class SessionMutationCreate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, user_id, session_name):
-        user_obj = ExtendUser.objects.get(user_id=user_id)
-        session = SessionLog(user_id=user_obj, session_name=session_name)
-        session.save()
+        session = SessionLog(user_id_id=user_id, session_name=session_name)
+        insert_row(session, 'user_id')
+        invalidate_user(user_id)
         return SessionMutationCreate(session=session)
     
 class SessionMutationUpdate(graphene.Mutation):
@@ -254,10 +527,10 @@ class SessionMutationUpdate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, session_id, session_name):
-        session = SessionLog.objects.get(session_id=session_id)
-        session.session_name = session_name
-        session.save()
-        return SessionMutationUpdate(session=session)
+        values = update_row(SessionLog, session_id, session_name=session_name)
+        owner = session_owner(session_id)
+        invalidate_user(owner)
+        return SessionMutationUpdate(session=payload_row(info, 'session', SessionLog, session_id, user_id_id=owner, **values))
     
 class SessionMutationDelete(graphene.Mutation):
 
@@ -268,8 +541,14 @@ class SessionMutationDelete(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, session_id):
-        session = SessionLog.objects.get(session_id=session_id)
-        session.delete()
+        owner = session_owner(session_id)
+        if owner is None:
+            raise does_not_exist(SessionLog)
+        with transaction.atomic():
+            bury_session(SessionLog(session_id=session_id, user_id_id=owner))
+            delete_row(SessionLog, session_id)
+            forget_owner(SessionLog, session_id)
+        invalidate_user(owner)
         return
     
 class SessionExerciseMutationCreate(graphene.Mutation):
@@ -282,12 +561,69 @@ class SessionExerciseMutationCreate(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, session_id, exercise_id):
-        session_obj = SessionLog.objects.get(session_id=session_id)
-        exercise_obj = Exercise.objects.get(exercise_id=exercise_id)
-        session_exercise = SessionLog_Exercise(session_id=session_obj, exercise_id=exercise_obj)
-        session_exercise.save()
+        # Both owners are cached, so usually the INSERT is the only query.
+        owner = session_owner(session_id)
+        if owner is None:
+            raise does_not_exist(SessionLog)
+        if exercise_owner(exercise_id) is None:
+            raise does_not_exist(Exercise)
+        session_exercise = SessionLog_Exercise(session_id_id=session_id, exercise_id_id=exercise_id, user_id_id=owner)
+        insert_row(session_exercise, 'session_id', 'exercise_id')
+        invalidate_user(owner)
         return SessionExerciseMutationCreate(session_exercise=session_exercise)
     
+class WorkoutSetInput(graphene.InputObjectType):
+    weight_kg = graphene.Int(required=True)
+    reps = graphene.Int(required=True)
+    sets = graphene.Int(required=True)
+
+class SessionExerciseInput(graphene.InputObjectType):
+    exercise_id = graphene.ID(required=True)
+    workouts = graphene.List(graphene.NonNull(WorkoutSetInput), default_value=[])
+
+class SessionMutationLog(graphene.Mutation):
+
+    class Arguments:
+        user_id = graphene.ID(required=True)
+        session_name = graphene.String(required=True)
+        exercises = graphene.List(graphene.NonNull(SessionExerciseInput), required=True)
+
+    session = graphene.Field(SessionLogType)
+    session_exercises = graphene.List(SessionLog_ExerciseType)
+    workouts = graphene.List(WorkoutLogType)
+
+    @classmethod
+    def mutate(cls, root, info, user_id, session_name, exercises):
+        # One check query and three inserts however many exercises and sets are logged.
+        exercise_ids = {int(exercise.exercise_id) for exercise in exercises}
+        if exercise_ids:
+            owned = Exercise.objects.filter(pk__in=exercise_ids, user_id=user_id).count()
+            if owned != len(exercise_ids):
+                raise Exercise.DoesNotExist('Exercise matching query does not exist.')
+        elif not ExtendUser.objects.filter(pk=user_id).exists():
+            raise ExtendUser.DoesNotExist('ExtendUser matching query does not exist.')
+
+        with transaction.atomic():
+            session = SessionLog(user_id_id=int(user_id), session_name=session_name)
+            session.save()
+            session_exercises = bulk_insert(SessionLog_Exercise, [
+                SessionLog_Exercise(session_id=session, exercise_id_id=int(exercise.exercise_id), user_id_id=session.user_id_id)
+                for exercise in exercises
+            ])
+            workouts = bulk_insert(WorkoutLog, [
+                WorkoutLog(exercise_id_id=int(exercise.exercise_id), user_id_id=session.user_id_id, weight_kg=workout.weight_kg, reps=workout.reps, sets=workout.sets)
+                for exercise in exercises for workout in exercise.workouts
+            ])
+            record_workouts(workouts)
+        invalidate_user(session.user_id_id)
+        for workout in workouts:
+            publish_on_commit(workout_logged_channel(session.user_id_id), workout)
+        return SessionMutationLog(
+            session=session,
+            session_exercises=collect(info, session_exercises),
+            workouts=collect(info, workouts),
+        )
+
 class SessionExerciseMutationDelete(graphene.Mutation):
 
     class Arguments:
@@ -297,10 +633,107 @@ class SessionExerciseMutationDelete(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, session_exercise_id):
-        session_exercise = SessionLog_Exercise.objects.get(session_exercise_id=session_exercise_id)
-        session_exercise.delete()
+        owner = SessionLog_Exercise.objects.filter(session_exercise_id=session_exercise_id).values_list('user_id', flat=True).first()
+        if owner is None:
+            raise does_not_exist(SessionLog_Exercise)
+        with transaction.atomic():
+            bury_object(SessionLog_Exercise(session_exercise_id=session_exercise_id, user_id_id=owner))
+            delete_row(SessionLog_Exercise, session_exercise_id)
+        invalidate_user(owner)
         return
 
+class ReplaySessionInput(graphene.InputObjectType):
+    session_name = graphene.String(required=True)
+
+class ReplayOperationInput(graphene.InputObjectType):
+    # Exactly one of the create fields is set.
+    client_id = graphene.String(required=True)
+    idempotency_key = graphene.String(required=True)
+    create_workout = graphene.Field(WorkoutInput)
+    create_session = graphene.Field(ReplaySessionInput)
+
+class ReplayedIdType(graphene.ObjectType):
+    client_id = graphene.String(required=True)
+    model = graphene.String(required=True)
+    object_id = graphene.ID(required=True)
+    # False if an earlier request already applied the operation.
+    created = graphene.Boolean(required=True)
+
+class ReplayOperations(graphene.Mutation):
+    # Applies a batch of operations queued on a device while it was offline,
+    # in order and in one transaction. Idempotency keys are unique per user,
+    # so operations that were already applied are mapped, not repeated.
+
+    class Arguments:
+        user_id = graphene.ID(required=True)
+        operations = graphene.List(graphene.NonNull(ReplayOperationInput), required=True)
+
+    ids = graphene.List(graphene.NonNull(ReplayedIdType))
+
+    @classmethod
+    def mutate(cls, root, info, user_id, operations):
+        for operation in operations:
+            if (operation.create_workout is None) == (operation.create_session is None):
+                raise GraphQLError('Each operation must set exactly one of createWorkout and createSession.')
+            if len(operation.idempotency_key) > AppliedOperation._meta.get_field('idempotency_key').max_length:
+                raise GraphQLError('Idempotency keys are at most 64 characters.')
+        exercise_ids = {int(operation.create_workout.exercise_id) for operation in operations if operation.create_workout}
+        if exercise_ids:
+            owned = Exercise.objects.filter(pk__in=exercise_ids, user_id=user_id).count()
+            if owned != len(exercise_ids):
+                raise Exercise.DoesNotExist('Exercise matching query does not exist.')
+        elif not ExtendUser.objects.filter(pk=user_id).exists():
+            raise ExtendUser.DoesNotExist('ExtendUser matching query does not exist.')
+
+        try:
+            applied, created = cls.apply(int(user_id), operations)
+        except IntegrityError:
+            # The same batch was replayed concurrently and committed first;
+            # every key is applied now, so this pass only maps them.
+            applied, created = cls.apply(int(user_id), operations)
+        return ReplayOperations(ids=[
+            ReplayedIdType(client_id=operation.client_id, model=applied[operation.idempotency_key].model, object_id=applied[operation.idempotency_key].object_id, created=operation.idempotency_key in created)
+            for operation in operations
+        ])
+
+    @classmethod
+    def apply(cls, user_id, operations):
+        # One read of the keys, then only for new operations one insert per
+        # model and one for their keys. A key repeated within the batch is
+        # applied once.
+        keys = {operation.idempotency_key for operation in operations}
+        applied = {row.idempotency_key: row for row in AppliedOperation.objects.filter(user_id=user_id, idempotency_key__in=keys)}
+        pending = {}
+        for operation in operations:
+            if operation.idempotency_key not in applied:
+                pending.setdefault(operation.idempotency_key, operation)
+        if not pending:
+            return applied, set()
+
+        objects = {}
+        for key, operation in pending.items():
+            if operation.create_session:
+                objects[key] = SessionLog(user_id_id=user_id, session_name=operation.create_session.session_name)
+            else:
+                workout = operation.create_workout
+                objects[key] = WorkoutLog(exercise_id_id=int(workout.exercise_id), user_id_id=user_id, weight_kg=workout.weight_kg, reps=workout.reps, sets=workout.sets)
+        with transaction.atomic():
+            bulk_insert(SessionLog, [instance for instance in objects.values() if isinstance(instance, SessionLog)])
+            workouts = bulk_insert(WorkoutLog, [instance for instance in objects.values() if isinstance(instance, WorkoutLog)])
+            created = [
+                AppliedOperation(user_id_id=user_id, idempotency_key=key, model=type(instance).__name__, object_id=instance.pk)
+                for key, instance in objects.items()
+            ]
+            # The unique (user_id, idempotency_key) index makes a concurrent
+            # replay of the same keys fail here and roll back.
+            AppliedOperation.objects.bulk_create(created)
+            record_workouts(workouts)
+        invalidate_user(user_id)
+        for workout in workouts:
+            publish_on_commit(workout_logged_channel(user_id), workout)
+        applied.update((row.idempotency_key, row) for row in created)
+        return applied, set(pending)
+
 
 class Mutation(graphene.ObjectType):
 
@@ -313,18 +746,34 @@ class Mutation(graphene.ObjectType):
     delete_exercise = ExerciseMutationDelete.Field()
 
     create_workout = WorkoutMutationCreate.Field()
+    create_workouts = WorkoutMutationBulkCreate.Field()
     update_workout = WorkoutMutationUpdate.Field()
     delete_workout = WorkoutMutationDelete.Field()
 
     create_session = SessionMutationCreate.Field()
     update_session = SessionMutationUpdate.Field()
     delete_session = SessionMutationDelete.Field()
+    log_session = SessionMutationLog.Field()
 
     create_session_exercise = SessionExerciseMutationCreate.Field()
     delete_session_exercise = SessionExerciseMutationDelete.Field()
 
+    replay_operations = ReplayOperations.Field()
+
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
     verify_token = graphql_jwt.Verify.Field()
     refresh_token = graphql_jwt.Refresh.Field()
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+
+class Subscription(graphene.ObjectType):
+
+    workout_logged = graphene.Field(WorkoutLogType, user_id=graphene.Int(required=True))
+    personal_best_changed = graphene.Field(ExerciseType, exercise_id=graphene.Int(required=True))
+
+    def subscribe_workout_logged(root, info, user_id):
+        return get_pubsub().subscribe(workout_logged_channel(user_id))
+
+    def subscribe_personal_best_changed(root, info, exercise_id):
+        return get_pubsub().subscribe(personal_best_channel(exercise_id))
+
+schema = ApiSchema(query=Query, mutation=Mutation, subscription=Subscription)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import json
+from itertools import islice
+
+from django.db.models import QuerySet
+from graphql import OperationType, is_list_type, is_non_null_type
+from graphql.error import located_error
+from graphql.execution import ExecutionContext
+from graphql.execution.collect_fields import collect_fields
+from graphql.execution.execute import get_field_def
+from graphql.execution.values import get_argument_values
+from graphql.pyutils import Path
+
+from .loaders import LoaderRegistry
+
+
+def streamable_field(context):
+    # Only a query with a single top-level list field can be streamed; the
+    # list is then the only thing that grows with the row count.
+    if context.operation.operation != OperationType.QUERY:
+        return None
+    root_type = context.schema.query_type
+    fields = collect_fields(context.schema, context.fragments, context.variable_values, root_type, context.operation.selection_set)
+    if len(fields) != 1:
+        return None
+    response_name, field_nodes = next(iter(fields.items()))
+    field_def = get_field_def(context.schema, root_type, field_nodes[0])
+    return_type = field_def.type.of_type if is_non_null_type(field_def.type) else field_def.type
+    if not is_list_type(return_type):
+        return None
+    return response_name, field_nodes, field_def, return_type.of_type
+
+
+def stream_query(context, request, chunk_size):
+    # Yields the JSON response for a streamable query a chunk of rows at a
+    # time, reading them with QuerySet.iterator() so memory stays flat.
+    response_name, field_nodes, field_def, item_type = streamable_field(context)
+    root_type = context.schema.query_type
+    path = Path(None, response_name, root_type.name)
+    info = context.build_resolve_info(field_def, field_nodes, root_type, path)
+    resolve_fn = field_def.resolve or context.field_resolver
+    if context.middleware_manager:
+        resolve_fn = context.middleware_manager.get_field_resolver(resolve_fn)
+
+    request.graphql_streaming = True
+    try:
+        args = get_argument_values(field_def, field_nodes[0], context.variable_values)
+        rows = resolve_fn(context.root_value, info, **args)
+        if isinstance(rows, QuerySet):
+            rows = rows.iterator(chunk_size=chunk_size)
+        rows = iter(rows)
+    except Exception as raw_error:
+        context.errors.append(located_error(raw_error, field_nodes, path.as_list()))
+        yield json.dumps({'errors': [error.formatted for error in context.errors], 'data': {response_name: None}})
+        return
+
+    yield '{"data":{%s:[' % json.dumps(response_name)
+    index = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        # A fresh registry per chunk keeps FK batching without letting the
+        # loader cache grow with the result.
+        request._api_loaders = LoaderRegistry()
+        chunk = request._api_loaders.collect(chunk)
+        items = []
+        for row in chunk:
+            item_path = path.add_key(index, None)
+            try:
+                completed = context.complete_value(item_type, field_nodes, info, item_path, row)
+            except Exception as raw_error:
+                context.errors.append(located_error(raw_error, field_nodes, item_path.as_list()))
+                completed = None
+            items.append(json.dumps(completed, separators=(',', ':')))
+            index += 1
+        yield (',' if index > len(chunk) else '') + ','.join(items)
+    yield ']}'
+    if context.errors:
+        yield ',"errors":' + json.dumps([error.formatted for error in context.errors])
+    yield '}'
+
+
+def build_streaming_context(schema, document, request, variables, operation_name, middleware):
+    context = ExecutionContext.build(
+        schema.graphql_schema, document, None, request, variables, operation_name, middleware=middleware
+    )
+    if isinstance(context, list) or streamable_field(context) is None:
+        return None
+    return context
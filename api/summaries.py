@@ -0,0 +1,176 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, PositiveIntegerField, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailySummary, Exercise, WorkoutLog
+from .result_cache import invalidate_user
+
+# DailySummary rows are adjusted in place by every workout write, so a
+# progress chart is a range read of at most one row per exercise and day.
+# Days are calendar days in settings.TIME_ZONE.
+
+
+def training_day(workout):
+    return timezone.localdate(workout.date_time)
+
+
+def volume(workout):
+    return workout.reps * workout.sets * workout.weight_kg
+
+
+def day_workouts(exercise_id, day):
+    # A range on the (exercise_id, date_time) index.
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return WorkoutLog.objects.filter(exercise_id=exercise_id, date_time__gte=start, date_time__lt=end)
+
+
+def locked_summary(workout):
+    return DailySummary.objects.select_for_update().filter(exercise_id=workout.exercise_id_id, day=training_day(workout)).first()
+
+
+def summaries_from(workouts):
+    # DailySummary rows for a queryset of workouts, from one grouped read.
+    days = workouts.values('exercise_id', 'user_id', day=TruncDate('date_time')).annotate(
+        volume_kg=Sum(F('reps') * F('sets') * F('weight_kg'), output_field=PositiveIntegerField()),
+        top_set_kg=Max('weight_kg'),
+        workout_count=Count('pk'),
+    ).order_by()
+    return [
+        DailySummary(
+            user_id_id=row['user_id'], exercise_id_id=row['exercise_id'], day=row['day'],
+            volume_kg=row['volume_kg'], top_set_kg=row['top_set_kg'], workout_count=row['workout_count'],
+        )
+        for row in days
+    ]
+
+
+def rebuild_day(workout):
+    # For a day with no row yet, e.g. workouts written outside the API.
+    DailySummary.objects.bulk_create(summaries_from(day_workouts(workout.exercise_id_id, training_day(workout))))
+
+
+def add_to_summaries(workouts):
+    # After workouts are inserted: one insert of any missing days, one locked
+    # read and one bulk update however many workouts were logged.
+    totals = {}
+    for workout in workouts:
+        key = (workout.exercise_id_id, training_day(workout))
+        user_id, volume_kg, top_set_kg, workout_count = totals.get(key, (workout.user_id_id, 0, 0, 0))
+        totals[key] = (user_id, volume_kg + volume(workout), max(top_set_kg, workout.weight_kg), workout_count + 1)
+    if not totals:
+        return
+    DailySummary.objects.bulk_create([
+        DailySummary(user_id_id=user_id, exercise_id_id=exercise_id, day=day)
+        for (exercise_id, day), (user_id, *_) in totals.items()
+    ], ignore_conflicts=True)
+    summaries = DailySummary.objects.select_for_update().filter(
+        exercise_id__in={exercise_id for exercise_id, day in totals},
+        day__in={day for exercise_id, day in totals},
+    )
+    changed = []
+    for summary in summaries:
+        key = (summary.exercise_id_id, summary.day)
+        if key in totals:
+            user_id, volume_kg, top_set_kg, workout_count = totals[key]
+            summary.volume_kg += volume_kg
+            summary.top_set_kg = max(summary.top_set_kg, top_set_kg)
+            summary.workout_count += workout_count
+            changed.append(summary)
+    DailySummary.objects.bulk_update(changed, ['volume_kg', 'top_set_kg', 'workout_count'])
+
+
+def change_in_summaries(previous, workout):
+    # After a workout is edited; `previous` holds its old values. The day's
+    # workouts are only read when its top set got lighter.
+    summary = locked_summary(workout)
+    if summary is None:
+        rebuild_day(workout)
+        return
+    summary.volume_kg += volume(workout) - volume(previous)
+    if workout.weight_kg >= summary.top_set_kg:
+        summary.top_set_kg = workout.weight_kg
+    elif previous.weight_kg >= summary.top_set_kg:
+        summary.top_set_kg = day_workouts(workout.exercise_id_id, summary.day).aggregate(top=Max('weight_kg'))['top']
+    summary.save(update_fields=['volume_kg', 'top_set_kg'])
+
+
+def remove_from_summaries(workout):
+    # After a workout is deleted. The day's row goes with its last workout.
+    summary = locked_summary(workout)
+    if summary is None:
+        rebuild_day(workout)
+        return
+    if summary.workout_count <= 1:
+        summary.delete()
+        return
+    summary.volume_kg -= volume(workout)
+    summary.workout_count -= 1
+    if workout.weight_kg >= summary.top_set_kg:
+        summary.top_set_kg = day_workouts(workout.exercise_id_id, summary.day).aggregate(top=Max('weight_kg'))['top']
+    summary.save(update_fields=['volume_kg', 'top_set_kg', 'workout_count'])
+
+
+def rebuild_summaries(exercise_ids):
+    # Recomputes the rows of some exercises from their history, replacing
+    # whatever was there. The history is read only once the exercises and
+    # their rows are locked, so a workout written meanwhile either waits
+    # for the rebuild or is already counted in it. The owners' cached
+    # results are dropped once the new rows are committed.
+    with transaction.atomic():
+        owners = set(Exercise.objects.select_for_update().filter(pk__in=exercise_ids).order_by('pk').values_list('user_id', flat=True))
+        DailySummary.objects.filter(exercise_id__in=exercise_ids).delete()
+        summaries = summaries_from(WorkoutLog.objects.filter(exercise_id__in=exercise_ids))
+        DailySummary.objects.bulk_create(summaries)
+        for owner in owners:
+            invalidate_user(owner)
+    return len(summaries)
+
+
+def exercise_chunks(chunk_size):
+    # Keyset pagination over exercise ids, so every pass is an index range.
+    last = 0
+    while True:
+        chunk = list(Exercise.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def user_summaries(user_id, exercise_id=None, date_from=None, date_to=None):
+    # `from` is inclusive and `to` exclusive, like date_range() in api.schema.
+    queryset = DailySummary.objects.filter(user_id=user_id)
+    if exercise_id is not None:
+        queryset = queryset.filter(exercise_id=exercise_id)
+    if date_from is not None:
+        queryset = queryset.filter(day__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(day__lt=date_to)
+    return queryset
+
+
+def summary_series(queryset, period):
+    # Daily rows as stored, or rolled up per exercise into weeks (starting on
+    # Monday) or calendar months, each dated by its first day.
+    if period == 'day':
+        return list(queryset.order_by('day', 'exercise_id'))
+    truncate = TruncWeek if period == 'week' else TruncMonth
+    rows = queryset.values('user_id', 'exercise_id', start=truncate('day')).annotate(
+        volume=Sum('volume_kg'),
+        top_set=Max('top_set_kg'),
+        workouts=Sum('workout_count'),
+        days=Count('pk'),
+    ).order_by('start', 'exercise_id')
+    series = []
+    for row in rows:
+        summary = DailySummary(
+            user_id_id=row['user_id'], exercise_id_id=row['exercise_id'], day=row['start'],
+            volume_kg=row['volume'], top_set_kg=row['top_set'], workout_count=row['workouts'],
+        )
+        summary.training_days = row['days']
+        series.append(summary)
+    return series
@@ -0,0 +1,75 @@
+import base64
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+from graphql import GraphQLError
+
+from .loaders import acollect, collect, running_async
+from .models import SessionLog_Exercise, Tombstone
+from .optimizer import optimize
+
+# Delta sync: clients send back the cursor of their last sync and get the
+# rows created, changed or deleted since, each table read as one range of
+# its (user_id, updated_at) index.
+
+# A write stamps updated_at when it runs but only becomes visible when its
+# transaction commits. Cursors are moved back by this much so rows from
+# transactions still open during a sync are sent again next time; clients
+# apply rows by id, so receiving one twice is harmless.
+OVERLAP = timedelta(seconds=30)
+
+
+def encode_sync_cursor(moment):
+    return base64.urlsafe_b64encode(moment.isoformat().encode()).decode()
+
+
+def decode_sync_cursor(cursor):
+    try:
+        moment = datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if timezone.is_naive(moment):
+            raise ValueError
+        return moment
+    except Exception:
+        raise GraphQLError('Invalid cursor: ' + cursor)
+
+
+def bury(queryset):
+    # Leave tombstones for the rows of `queryset`, which are about to be
+    # deleted. One read and one insert however many rows there are.
+    model = queryset.model.__name__
+    Tombstone.objects.bulk_create([
+        Tombstone(user_id_id=user_id, model=model, object_id=pk)
+        for pk, user_id in queryset.values_list('pk', 'user_id')
+    ])
+
+
+def bury_object(instance):
+    Tombstone.objects.create(user_id_id=instance.user_id_id, model=type(instance).__name__, object_id=instance.pk)
+
+
+def bury_session(session):
+    bury_object(session)
+    bury(SessionLog_Exercise.objects.filter(session_id=session.pk))
+
+
+class Changes:
+    # The root of a sync result. Nothing is read until a list is selected.
+
+    def __init__(self, user_id, since=None):
+        self.user_id = user_id
+        self.since = since
+        self.cursor = encode_sync_cursor(timezone.now() - OVERLAP)
+
+    def rows(self, info, model):
+        queryset = model.objects.filter(user_id=self.user_id)
+        if self.since is not None:
+            queryset = queryset.filter(updated_at__gte=self.since)
+        queryset = optimize(queryset.order_by('updated_at', 'pk'), info)
+        return acollect(info, queryset) if running_async() else collect(info, queryset)
+
+    def deleted(self, info):
+        # A first sync has nothing to delete.
+        if self.since is None:
+            return []
+        queryset = Tombstone.objects.filter(user_id=self.user_id, deleted_at__gte=self.since).order_by('deleted_at', 'pk')
+        return acollect(info, queryset) if running_async() else collect(info, queryset)
@@ -0,0 +1,19 @@
+from .deletion import purge_user
+from .jobs import task
+from .models import ExtendUser
+from .summaries import rebuild_summaries
+
+# Work handed to `manage.py run_worker`. Jobs may run more than once, e.g.
+# after a lost worker, so every task must be safe to repeat.
+
+
+@task('purge_user', limit=2)
+def purge_deleted_user(user_id):
+    # `manage.py purge_deleted_users` may have got there first.
+    if ExtendUser.objects.filter(pk=user_id).exclude(deleted_at=None).exists():
+        purge_user(user_id)
+
+
+@task('rebuild_summaries')
+def rebuild_exercise_summaries(exercise_ids):
+    rebuild_summaries(exercise_ids)
@@ -1,8 +1,21 @@
+from django.conf import settings
 from django.urls import path
-from graphene_django.views import GraphQLView
+from .views import ApiGraphQLView, AsyncApiGraphQLView
 from .schema import schema
+from .async_schema import async_schema
 from django.views.decorators.csrf import csrf_exempt
 
+
+def graphql_view():
+    if settings.GRAPHQL_ASYNC:
+        view = AsyncApiGraphQLView.as_view(graphiql=True, schema=schema, async_schema=async_schema)
+        # csrf_exempt() in Django 4.2 wraps the view in a sync function,
+        # which would hide that it is a coroutine.
+        view.csrf_exempt = True
+        return view
+    return csrf_exempt(ApiGraphQLView.as_view(graphiql=True, schema=schema))
+
+
 urlpatterns = [
-    path('', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema)))
+    path('', graphql_view())
 ]
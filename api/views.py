@@ -0,0 +1,270 @@
+import json
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast
+
+from .auth import authenticate_request
+from .cost import QueryCost
+from .persisted import PersistedQueryError, resolve_query
+from .streaming import build_streaming_context, stream_query
+
+
+class ApiGraphQLView(GraphQLView):
+    # Rows read per round trip when a response is streamed.
+    stream_chunk_size = 2000
+
+    def dispatch(self, request, *args, **kwargs):
+        authenticate_request(request)
+        if request.method.lower() == 'post' and request.GET.get('stream') == 'true':
+            response = self.get_streaming_response(request)
+            if response is not None:
+                return response
+        if request.method.lower() == 'post':
+            try:
+                data = self.parse_body(request)
+            except HttpError:
+                data = None
+            if isinstance(data, list):
+                return self.get_batch_response(request, data)
+        return super().dispatch(request, *args, **kwargs)
+
+    def parse_body(self, request):
+        # A JSON array is a batch of operations; anything else is handled
+        # exactly as graphene-django does. The parsed body is kept so it is
+        # only decoded once per request.
+        if not hasattr(request, '_graphql_body'):
+            if self.get_content_type(request) == 'application/json':
+                try:
+                    body = json.loads(request.body.decode('utf-8'))
+                except (UnicodeDecodeError, ValueError):
+                    raise HttpError(HttpResponseBadRequest('POST body sent invalid JSON.'))
+                if not isinstance(body, (dict, list)):
+                    raise HttpError(HttpResponseBadRequest('The received data is not a valid JSON query.'))
+                request._graphql_body = body
+            else:
+                request._graphql_body = super().parse_body(request)
+        return request._graphql_body
+
+    def get_batch_response(self, request, data):
+        # Runs every operation of a batch on this request's connection and
+        # context, so loaders are shared between them. With ?atomic=true the
+        # whole batch is rolled back if any operation fails.
+        atomic = request.GET.get('atomic') == 'true'
+        try:
+            if not data or len(data) > settings.GRAPHQL_MAX_BATCH_SIZE:
+                raise HttpError(HttpResponseBadRequest(
+                    'Batches must contain between 1 and {} operations.'.format(settings.GRAPHQL_MAX_BATCH_SIZE)
+                ))
+            if not all(isinstance(entry, dict) for entry in data):
+                raise HttpError(HttpResponseBadRequest('The received data is not a valid JSON query.'))
+            with transaction.atomic() if atomic else nullcontext():
+                responses = []
+                for entry in data:
+                    if atomic and responses and request._graphql_errors:
+                        skipped = {'data': None, 'errors': [{'message': 'Skipped: an earlier operation in this atomic batch failed.'}]}
+                        responses.append((self.json_encode(request, skipped), 200))
+                        continue
+                    try:
+                        responses.append(self.get_response(request, entry))
+                    except HttpError as e:
+                        # A malformed operation fails in its own slot.
+                        request._graphql_errors = True
+                        responses.append((self.json_encode(request, {'errors': [self.format_error(e)]}), e.response.status_code))
+                    if atomic and request._graphql_errors:
+                        transaction.set_rollback(True)
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+
+        return HttpResponse(
+            status=max(status_code for result, status_code in responses),
+            content='[{}]'.format(','.join(result for result, status_code in responses)),
+            content_type='application/json',
+        )
+
+    def get_streaming_response(self, request):
+        # Opt-in with `?stream=true`. Anything that is not a single top-level
+        # list query falls back to the regular buffered response.
+        try:
+            data = self.parse_body(request)
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+        except Exception:
+            return None
+        if not query:
+            return None
+        document, errors = self.schema.get_document(query)
+        if errors or request.jwt_error is not None:
+            return None
+        if QueryCost(self.schema.graphql_schema, document, operation_name, variables).errors():
+            return None
+        context = build_streaming_context(
+            self.schema, document, self.get_context(request), variables, operation_name, self.get_middleware(request)
+        )
+        if context is None:
+            return None
+        return StreamingHttpResponse(
+            stream_query(context, request, self.stream_chunk_size), content_type='application/json'
+        )
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions') or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        try:
+            query = resolve_query(query, extensions)
+        except PersistedQueryError as e:
+            raise HttpError(HttpResponse(status=e.status), str(e))
+
+        return query, variables, operation_name, id
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        # Same as graphene-django's, but the operation is looked up once in
+        # the schema's document cache and that document is what executes.
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        document, errors = self.schema.get_document(query)
+        if document is None:
+            return ExecutionResult(errors=errors)
+        if request.jwt_error is not None:
+            return ExecutionResult(data=None, errors=[GraphQLError(str(request.jwt_error))])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if request.method.lower() == 'get' and operation_ast and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'], 'Can only perform a {} operation from a POST request.'.format(operation_ast.operation.value)
+            ))
+
+        options = {
+            'root_value': self.get_root_value(request),
+            'variable_values': variables,
+            'operation_name': operation_name,
+            'context_value': self.get_context(request),
+            'middleware': self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            options['execution_context_class'] = self.execution_context_class
+        try:
+            if self.is_atomic_mutation(operation_ast):
+                with transaction.atomic():
+                    result = self.schema.execute(query, prepared=(document, errors), **options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+            else:
+                result = self.schema.execute(query, prepared=(document, errors), **options)
+        except Exception as e:
+            result = ExecutionResult(errors=[e])
+
+        request._graphql_extensions = result.extensions
+        request._graphql_errors = bool(result.errors)
+        return result
+
+    def is_atomic_mutation(self, operation_ast):
+        return operation_ast is not None and operation_ast.operation == OperationType.MUTATION and (
+            graphene_settings.ATOMIC_MUTATIONS is True
+            or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+        )
+
+    def json_encode(self, request, d, pretty=False):
+        # graphene-django drops ExecutionResult.extensions (the query cost),
+        # so add them back to the response of the request that produced them.
+        extensions = getattr(request, '_graphql_extensions', None)
+        if extensions:
+            d = dict(d, extensions=extensions)
+            request._graphql_extensions = None
+        return super().json_encode(request, d, pretty)
+
+
+class AsyncApiGraphQLView(ApiGraphQLView):
+    # Native async path for ASGI. A single POSTed operation is executed on
+    # the event loop against `async_schema`; GraphiQL, GET, streaming,
+    # batches and atomic mutations need the sync machinery and run the sync
+    # view with `schema` in a worker thread.
+    async_schema = None
+    view_is_async = True
+
+    def __init__(self, async_schema=None, **kwargs):
+        super().__init__(**kwargs)
+        if async_schema is not None:
+            self.async_schema = async_schema
+
+    async def dispatch(self, request, *args, **kwargs):
+        await sync_to_async(authenticate_request)(request)
+        try:
+            data = None
+            if request.method.lower() == 'post' and request.GET.get('stream') != 'true':
+                data = self.parse_body(request)
+            if not isinstance(data, dict) or (self.graphiql and self.can_display_graphiql(request, data)):
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+            result, status_code = await self.get_async_response(request, data)
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+        return HttpResponse(status=status_code, content=result, content_type='application/json')
+
+    async def get_async_response(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = await self.execute_graphql_request_async(request, data, query, variables, operation_name)
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+        response = {}
+        status_code = 200
+        if execution_result.errors:
+            set_rollback()
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, 'path', None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        return self.json_encode(request, response), status_code
+
+    async def execute_graphql_request_async(self, request, data, query, variables, operation_name):
+        if not query:
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        document, errors = self.async_schema.get_document(query)
+        if document is None:
+            return ExecutionResult(errors=errors)
+        if request.jwt_error is not None:
+            return ExecutionResult(data=None, errors=[GraphQLError(str(request.jwt_error))])
+        if self.is_atomic_mutation(get_operation_ast(document, operation_name)):
+            return await sync_to_async(self.execute_graphql_request)(request, data, query, variables, operation_name)
+
+        options = {
+            'root_value': self.get_root_value(request),
+            'variable_values': variables,
+            'operation_name': operation_name,
+            'context_value': self.get_context(request),
+            'middleware': self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            options['execution_context_class'] = self.execution_context_class
+        try:
+            result = await self.async_schema.execute_async(query, prepared=(document, errors), **options)
+        except Exception as e:
+            result = ExecutionResult(errors=[e])
+
+        request._graphql_extensions = result.extensions
+        request._graphql_errors = bool(result.errors)
+        return result
@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from graphql import OperationType, get_operation_ast
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+
+from .auth import get_user_by_token
+from .persisted import PersistedQueryError, resolve_query
+
+# GraphQL over WebSocket with the graphql-transport-ws protocol (the one
+# spoken by the `graphql-ws` client), on the raw ASGI websocket interface.
+PROTOCOL = 'graphql-transport-ws'
+
+
+class WebSocketContext:
+    # info.context for operations sent over a socket; the user is set from
+    # the token in the connection_init payload.
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.user = AnonymousUser()
+        self.jwt_error = None
+
+
+class GraphQLWebSocketConnection:
+
+    def __init__(self, schema, scope, send):
+        self.schema = schema
+        self.send = send
+        self.context = WebSocketContext(scope)
+        self.initialised = False
+        self.acknowledged = False
+        self.closed = False
+        self.operations = {}
+
+    async def send_json(self, message):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def send_error(self, id, errors):
+        await self.send_json({'id': id, 'type': 'error', 'payload': errors})
+
+    async def close(self, code, reason):
+        if not self.closed:
+            self.closed = True
+            await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def receive(self, text):
+        try:
+            message = json.loads(text)
+            message_type = message['type']
+        except (TypeError, ValueError, KeyError):
+            await self.close(4400, 'Invalid message received')
+            return
+
+        if message_type == 'connection_init':
+            await self.init(message.get('payload') or {})
+        elif message_type == 'ping':
+            await self.send_json({'type': 'pong'})
+        elif message_type == 'pong':
+            pass
+        elif message_type == 'subscribe':
+            if not self.acknowledged:
+                await self.close(4401, 'Unauthorized')
+            elif message.get('id') in self.operations:
+                await self.close(4409, 'Subscriber for {} already exists'.format(message.get('id')))
+            else:
+                await self.start(message.get('id'), message.get('payload') or {})
+        elif message_type == 'complete':
+            self.stop(message.get('id'))
+        else:
+            await self.close(4400, 'Invalid message received')
+
+    async def init(self, payload):
+        if self.initialised:
+            await self.close(4429, 'Too many initialisation requests')
+            return
+        self.initialised = True
+        header = payload.get('Authorization') or payload.get('authorization')
+        if header:
+            prefix, _, token = header.partition(' ')
+            try:
+                if prefix.lower() != jwt_settings.JWT_AUTH_HEADER_PREFIX.lower():
+                    raise JSONWebTokenError
+                user = await sync_to_async(get_user_by_token)(token, self.context)
+            except JSONWebTokenError:
+                user = None
+            if user is None:
+                await self.close(4403, 'Forbidden')
+                return
+            self.context.user = user
+        self.acknowledged = True
+        await self.send_json({'type': 'connection_ack'})
+
+    async def start(self, id, payload):
+        query = payload.get('query')
+        options = {
+            'context_value': self.context,
+            'variable_values': payload.get('variables'),
+            'operation_name': payload.get('operationName'),
+        }
+        if query is not None and not isinstance(query, str):
+            await self.send_error(id, [{'message': 'Must provide query string.'}])
+            return
+        try:
+            query = resolve_query(query, payload.get('extensions'))
+        except PersistedQueryError as e:
+            await self.send_error(id, [{'message': str(e)}])
+            return
+        if not query:
+            await self.send_error(id, [{'message': 'Must provide query string.'}])
+            return
+        document, errors = self.schema.get_document(query)
+        if errors:
+            await self.send_error(id, [error.formatted for error in errors])
+            return
+
+        operation = get_operation_ast(document, options['operation_name'])
+        if operation is not None and operation.operation == OperationType.SUBSCRIPTION:
+            # Subscribing registers with the pub/sub before anything else is
+            # read from the socket, so no event published after this is lost.
+            results = await self.schema.subscribe(query, **options)
+            if not hasattr(results, '__aiter__'):
+                await self.send_error(id, [error.formatted for error in results.errors])
+                return
+        else:
+            results = self.execute(query, options)
+        self.operations[id] = asyncio.ensure_future(self.stream(id, results))
+
+    async def execute(self, query, options):
+        yield await self.schema.execute_async(query, **options)
+
+    async def stream(self, id, results):
+        try:
+            async for result in results:
+                await self.send_json({'id': id, 'type': 'next', 'payload': result.formatted})
+            await self.send_json({'id': id, 'type': 'complete'})
+        finally:
+            self.operations.pop(id, None)
+            await results.aclose()
+
+    def stop(self, id):
+        task = self.operations.pop(id, None)
+        if task is not None:
+            task.cancel()
+
+    async def stop_all(self):
+        tasks = list(self.operations.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class GraphQLWebSocketApp:
+    # ASGI application for `websocket` scopes. Like Django's ASGI handler,
+    # each connection gets its own thread for sync database work.
+    connection_init_timeout = 3
+
+    def __init__(self, schema, path='/api/'):
+        self.schema = schema
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        await receive()
+        if scope['path'] != self.path or PROTOCOL not in scope.get('subprotocols', ()):
+            await send({'type': 'websocket.close', 'code': 4406})
+            return
+        await send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+
+        connection = GraphQLWebSocketConnection(self.schema, scope, send)
+        async with ThreadSensitiveContext():
+            try:
+                while not connection.closed:
+                    try:
+                        timeout = None if connection.initialised else self.connection_init_timeout
+                        message = await asyncio.wait_for(receive(), timeout)
+                    except asyncio.TimeoutError:
+                        await connection.close(4408, 'Connection initialisation timeout')
+                        break
+                    if message['type'] == 'websocket.disconnect':
+                        break
+                    if message['type'] == 'websocket.receive':
+                        await connection.receive(message.get('text') or message.get('bytes', b'').decode())
+            finally:
+                await connection.stop_all()
+                await sync_to_async(close_old_connections)()
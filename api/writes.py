@@ -0,0 +1,154 @@
+from contextlib import nullcontext
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from graphene.utils.str_converters import to_snake_case
+
+from .optimizer import model_fields, optimize_nodes, selected_fields
+
+# Mutations write by primary key without reading the row first. A missing
+# row is still reported with the message .get() would have raised, and the
+# row a mutation returns is only read back when the client selected
+# columns the mutation does not already know.
+
+
+def does_not_exist(model):
+    return model.DoesNotExist('{} matching query does not exist.'.format(model._meta.object_name))
+
+
+def auto_now(model, values):
+    # Queryset updates skip auto_now, so stamp those columns here.
+    now = timezone.now()
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False):
+            values.setdefault(field.attname, now)
+    return values
+
+
+def update_row(model, pk, **values):
+    # One UPDATE ... WHERE pk = of just these columns. Returns the values
+    # written, for payload_row().
+    values = auto_now(model, values)
+    if not model.objects.filter(pk=pk).update(**values):
+        raise does_not_exist(model)
+    return values
+
+
+async def aupdate_row(model, pk, **values):
+    values = auto_now(model, values)
+    if not await model.objects.filter(pk=pk).aupdate(**values):
+        raise does_not_exist(model)
+    return values
+
+
+def delete_row(model, pk):
+    deleted, _ = model.objects.filter(pk=pk).delete()
+    if not deleted:
+        raise does_not_exist(model)
+
+
+def missing_parent(instance, foreign_keys):
+    # The first of `foreign_keys` whose row does not exist, if any.
+    for name in foreign_keys:
+        field = instance._meta.get_field(name)
+        if not field.related_model.objects.filter(pk=getattr(instance, field.attname)).exists():
+            return field.related_model
+    return None
+
+
+async def amissing_parent(instance, foreign_keys):
+    for name in foreign_keys:
+        field = instance._meta.get_field(name)
+        if not await field.related_model.objects.filter(pk=getattr(instance, field.attname)).aexists():
+            return field.related_model
+    return None
+
+
+def insert_row(instance, *foreign_keys):
+    # Saves a new row whose `foreign_keys` were set by raw id. MySQL checks
+    # them on the INSERT itself and only a failed insert looks for the
+    # missing parent. SQLite and PostgreSQL defer the check to commit, too
+    # late to fail this mutation, so there the parents are looked up first.
+    # Inside a caller's transaction the insert gets its own savepoint, so
+    # the lookup can still run after it failed; in autocommit it needs none.
+    if connection.features.can_defer_constraint_checks:
+        parent = missing_parent(instance, foreign_keys)
+        if parent is not None:
+            raise does_not_exist(parent)
+        instance.save(force_insert=True)
+        return instance
+    try:
+        with transaction.atomic() if connection.in_atomic_block else nullcontext():
+            instance.save(force_insert=True)
+    except IntegrityError:
+        parent = missing_parent(instance, foreign_keys)
+        if parent is not None:
+            raise does_not_exist(parent)
+        raise
+    return instance
+
+
+async def ainsert_row(instance, *foreign_keys):
+    # The async ORM runs outside atomic() in autocommit, where a failed
+    # insert leaves nothing to roll back, so no savepoint is needed.
+    if connection.features.can_defer_constraint_checks:
+        parent = await amissing_parent(instance, foreign_keys)
+        if parent is not None:
+            raise does_not_exist(parent)
+        await instance.asave(force_insert=True)
+        return instance
+    try:
+        await instance.asave(force_insert=True)
+    except IntegrityError:
+        parent = await amissing_parent(instance, foreign_keys)
+        if parent is not None:
+            raise does_not_exist(parent)
+        raise
+    return instance
+
+
+def payload_nodes(info, name):
+    return [
+        field for node in info.field_nodes
+        for field in selected_fields(node.selection_set, info.fragments)
+        if to_snake_case(field.name.value) == name
+    ]
+
+
+def known_row(model, nodes, fragments, pk, known):
+    # An instance built from the `known` column values, or None if the
+    # selection needs a column, relation set or field they lack.
+    values = {model._meta.pk.attname: model._meta.pk.to_python(pk), **known}
+    available = model_fields(model)
+    for node in nodes:
+        for selection in selected_fields(node.selection_set, fragments):
+            if selection.name.value == '__typename':
+                continue
+            field = available.get(to_snake_case(selection.name.value))
+            if field is None or not field.concrete or field.attname not in values:
+                return None
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(connection.alias, names, [values[name] for name in names])
+
+
+def payload_row(info, name, model, pk, **known):
+    # The `name` field of a mutation's payload, for the row `pk` whose
+    # columns in `known` were just written. Read back, shaped like a query
+    # would be, only if the client asked for more than that.
+    nodes = payload_nodes(info, name)
+    if not nodes:
+        return None
+    instance = known_row(model, nodes, info.fragments, pk, known)
+    if instance is None:
+        instance = optimize_nodes(model.objects.all(), nodes, info.fragments).get(pk=pk)
+    return instance
+
+
+async def apayload_row(info, name, model, pk, **known):
+    nodes = payload_nodes(info, name)
+    if not nodes:
+        return None
+    instance = known_row(model, nodes, info.fragments, pk, known)
+    if instance is None:
+        instance = await optimize_nodes(model.objects.all(), nodes, info.fragments).aget(pk=pk)
+    return instance
@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'be_1_percent_better.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up by get_asgi_application().
+from api.async_schema import async_schema
+from api.websocket import GraphQLWebSocketApp
+
+# GraphQL subscriptions are served over WebSockets on api/.
+websocket_application = GraphQLWebSocketApp(async_schema, path='/api/')
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -84,6 +84,10 @@ WSGI_APPLICATION = 'be_1_percent_better.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# Bulk inserts (api/bulk.py) take their ids from LAST_INSERT_ID() in one
+# multi-row INSERT only if the server runs innodb_autoinc_lock_mode = 1 (or 0)
+# and auto_increment_increment = 1. Other servers get a slower row-by-row
+# insert instead.
 
 DATABASES = {
     'default': {
@@ -143,10 +147,88 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'api.ExtendUser'
 
+# JWTs are verified once per request by api.views.ApiGraphQLView rather
+# than by graphql_jwt's per-field JSONWebTokenMiddleware.
 GRAPHENE = {
-    "MIDDLEWARE": [
-        "graphql_jwt.middleware.JSONWebTokenMiddleware",
-    ],
+    "MIDDLEWARE": [],
+}
+
+# Operations estimated above MAX_COST or nested deeper than MAX_DEPTH are
+# rejected before execution. Lists without `first` / `last` count as
+# DEFAULT_LIST_SIZE rows; FIELD_WEIGHTS overrides the cost of single fields,
+# e.g. {'Query.getAllWorkouts': 10}.
+GRAPHQL_QUERY_COST = {
+    'MAX_COST': 25000,
+    'MAX_DEPTH': 10,
+    'DEFAULT_LIST_SIZE': 100,
+    'FIELD_WEIGHTS': {},
+}
+
+# Number of parsed and validated operation documents kept in memory.
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
+# Automatic persisted queries. REGISTRY is a JSON file of the app's
+# operations (see `manage.py build_persisted_queries`) loaded at start-up;
+# with STRICT on, only operations in the registry are executed.
+GRAPHQL_PERSISTED_QUERIES = {
+    'REGISTRY': os.environ.get('GRAPHQL_PERSISTED_QUERIES_REGISTRY'),
+    'STRICT': os.environ.get('GRAPHQL_PERSISTED_QUERIES_STRICT') == 'True',
+}
+
+# Operations registered by clients through automatic persisted queries that
+# are kept in memory, least recently used first out. The registry file's
+# operations are always kept.
+GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE = 1000
+
+# Seconds a cached per-user query result is kept. Entries are also
+# invalidated by mutations, so this only bounds memory use. Any shared
+# CACHES backend works in production.
+GRAPHQL_RESULT_CACHE_TIMEOUT = 60 * 60
+
+# Largest JSON array of operations accepted in one POST to api/.
+GRAPHQL_MAX_BATCH_SIZE = 20
+
+GRAPHQL_JWT = {
+    "JWT_PAYLOAD_HANDLER": "api.auth.jwt_payload",
+}
+
+# Opt-in: trust the verified token claims (user_id, username) and only load
+# ExtendUser when a resolver asks for it, saving a query per request. Users
+# deactivated after a token was issued keep access until it expires.
+GRAPHQL_CLAIMS_ONLY_AUTH = os.environ.get('GRAPHQL_CLAIMS_ONLY_AUTH') == 'True'
+
+# Serve api/ with the async view and schema. Only worth enabling when the
+# app runs under ASGI (be_1_percent_better.asgi); under WSGI every request
+# would pay for an event loop.
+GRAPHQL_ASYNC = os.environ.get('GRAPHQL_ASYNC') == 'True'
+
+# Backend that carries subscription events from mutations to WebSocket
+# subscribers. The in-process backend only reaches subscribers connected to
+# the same worker.
+GRAPHQL_PUBSUB = {
+    'BACKEND': 'api.pubsub.InProcessPubSub',
+    'OPTIONS': {},
+}
+
+# Users and exercises are deleted CHUNK_SIZE rows at a time, each chunk in
+# its own transaction. Deleting a user with more than BACKGROUND_AFTER
+# workouts only marks the account deleted and queues a job to purge it;
+# None deletes every account straight away.
+ACCOUNT_DELETION = {
+    'CHUNK_SIZE': 1000,
+    'BACKGROUND_AFTER': 10000,
+}
+
+# Background jobs (api.jobs), run by `manage.py run_worker`. A failed job is
+# retried up to MAX_ATTEMPTS times in all, RETRY_DELAY seconds later,
+# doubling each time. A job still running STALE_AFTER seconds after it was
+# claimed is taken to have lost its worker. Idle workers poll every
+# POLL_INTERVAL seconds.
+JOB_QUEUE = {
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 30,
+    'STALE_AFTER': 60 * 60,
+    'POLL_INTERVAL': 1,
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -0,0 +1,9 @@
+from django.core.cache import cache
+import pytest
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached query results outlive the rolled-back test database.
+    cache.clear()
+    yield
+    cache.clear()
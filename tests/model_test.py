@@ -1,4 +1,5 @@
 import pytest
+from django.db import connection
 from api.models import ExtendUser, Exercise, SessionLog, WorkoutLog, SessionLog_Exercise
 
 @pytest.mark.django_db
@@ -52,3 +53,12 @@ def test_create_session_log_exercise():
     assert session_log_exercise.session_id.session_name == 'Test Session', "Session log exercise's session name does not match the expected value."
     assert session_log_exercise.session_id.user_id.username == 'testuser', "Exercise's user username does not match the expected value."
 
+
+@pytest.mark.django_db
+def test_date_time_indexes_lead_with_the_owner():
+    with connection.cursor() as cursor:
+        workout_indexes = connection.introspection.get_constraints(cursor, WorkoutLog._meta.db_table)
+        session_indexes = connection.introspection.get_constraints(cursor, SessionLog._meta.db_table)
+
+    assert workout_indexes['workoutlog_exercise_date_idx']['columns'] == ['exercise_id_id', 'date_time']
+    assert session_indexes['sessionlog_user_date_idx']['columns'] == ['user_id_id', 'date_time']
@@ -1,6 +1,16 @@
+from datetime import datetime, timedelta, timezone
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import RequestFactory
 from graphene.test import Client
-from api.schema import schema
-from api.models import ExtendUser, Exercise, WorkoutLog, SessionLog
+from api.schema import schema, Query
+from api.execution import ApiSchema, DocumentCache
+from api.loaders import LoaderRegistry
+from api import jobs
+from api.result_cache import exercise_owner, owner_key, session_owner, user_version
+from api.sync import encode_sync_cursor
+from api.models import ExtendUser, Exercise, WorkoutLog, SessionLog, SessionLog_Exercise, RepMax, PersonalRecord, DailySummary, AppliedOperation, Job
 import pytest
 
 @pytest.mark.django_db
@@ -2195,3 +2205,1073 @@ def test_create_user_no_password():
                         'errors': [{'locations': [{'column': 13, 'line': 3}],
                                     'message': "Field 'createUser' argument 'password' of type 'String!' "
                                     'is required, but it was not provided.'}]}
+
+
+@pytest.mark.django_db
+def test_get_all_workouts_joins_selected_foreign_keys(django_assert_num_queries):
+    user1 = ExtendUser.objects.create(username='batchuser1', password='password', email='testuser@test.com')
+    user2 = ExtendUser.objects.create(username='batchuser2', password='password', email='testuser@test.com')
+    for user in (user1, user2):
+        for name in ('Squat', 'Bench Press'):
+            exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name=name, external_exercise_bodypart='Legs', personal_best=0)
+            for reps in (5, 8, 10):
+                WorkoutLog.objects.create(exercise_id=exercise, reps=reps, weight_kg=50, sets=3)
+
+    query = '''
+        query {
+            getAllWorkouts {
+                reps
+                exerciseId {
+                    externalExerciseName
+                    userId {
+                        username
+                    }
+                }
+            }
+        }
+    '''
+
+    client = Client(schema)
+    with django_assert_num_queries(1):
+        executed = client.execute(query, context_value=RequestFactory().post('/api/'))
+
+    assert 'errors' not in executed
+    assert len(executed['data']['getAllWorkouts']) == 12
+    assert executed['data']['getAllWorkouts'][0]['exerciseId'] == {'externalExerciseName': 'Squat', 'userId': {'username': 'batchuser1'}}
+    assert executed['data']['getAllWorkouts'][-1]['exerciseId'] == {'externalExerciseName': 'Bench Press', 'userId': {'username': 'batchuser2'}}
+
+
+@pytest.mark.django_db
+def test_loader_registry_batches_each_level(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='loaderuser', password='password', email='testuser@test.com')
+    for name in ('Squat', 'Deadlift', 'Row'):
+        exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name=name, external_exercise_bodypart='Legs', personal_best=0)
+        WorkoutLog.objects.create(exercise_id=exercise, reps=5, weight_kg=100, sets=5)
+
+    loaders = LoaderRegistry()
+    with django_assert_num_queries(3):
+        workouts = loaders.collect(WorkoutLog.objects.all())
+        exercises = [loaders.for_model(Exercise).load(workout.exercise_id_id) for workout in workouts]
+        users = [loaders.for_model(ExtendUser).load(exercise.user_id_id) for exercise in exercises]
+
+    assert [exercise.external_exercise_name for exercise in exercises] == ['Squat', 'Deadlift', 'Row']
+    assert {u.username for u in users} == {'loaderuser'}
+
+
+@pytest.mark.django_db
+def test_get_all_users_prefetches_reverse_sets_from_fragments(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='fragmentuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    WorkoutLog.objects.create(exercise_id=exercise, reps=5, weight_kg=100, sets=5)
+    WorkoutLog.objects.create(exercise_id=exercise, reps=3, weight_kg=110, sets=3)
+
+    query = '''
+        query {
+            getAllUsers {
+                username
+                exerciseSet {
+                    ...ExerciseFields
+                }
+            }
+        }
+
+        fragment ExerciseFields on ExerciseType {
+            externalExerciseName
+            workoutlogSet {
+                weightKg
+            }
+        }
+    '''
+
+    client = Client(schema)
+    with django_assert_num_queries(3) as captured:
+        executed = client.execute(query, context_value=RequestFactory().post('/api/'))
+
+    assert executed == {
+        'data': {
+            'getAllUsers': [{
+                'username': 'fragmentuser',
+                'exerciseSet': [{
+                    'externalExerciseName': 'Squat',
+                    'workoutlogSet': [{'weightKg': 100}, {'weightKg': 110}]
+                }]
+            }]
+        }
+    }
+    assert 'external_exercise_bodypart' not in captured.captured_queries[1]['sql']
+    assert 'reps' not in captured.captured_queries[2]['sql']
+
+
+@pytest.mark.django_db
+def test_reverse_set_selected_twice_is_prefetched_once(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='twiceuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    WorkoutLog.objects.create(exercise_id=exercise, reps=5, weight_kg=100, sets=3)
+
+    aliases = '''
+        query {
+            getAllExercises {
+                a: workoutlogSet { reps }
+                b: workoutlogSet { sets }
+            }
+        }
+    '''
+    fragments = '''
+        query ($userId: Int) {
+            getExercisesByUserId(userId: $userId) { ...A ...B }
+        }
+        fragment A on ExerciseType { workoutlogSet { reps } }
+        fragment B on ExerciseType { workoutlogSet { weightKg } }
+    '''
+
+    client = Client(schema)
+    with django_assert_num_queries(2):
+        by_alias = client.execute(aliases, context_value=RequestFactory().post('/api/'))
+    with django_assert_num_queries(2):
+        by_fragment = client.execute(fragments, variables={'userId': user.user_id}, context_value=RequestFactory().post('/api/'))
+
+    assert by_alias == {'data': {'getAllExercises': [{'a': [{'reps': 5}], 'b': [{'sets': 3}]}]}}
+    assert by_fragment == {'data': {'getExercisesByUserId': [{'workoutlogSet': [{'reps': 5, 'weightKg': 100}]}]}}
+
+
+@pytest.mark.django_db
+def test_get_workouts_by_exercise_id_connection_pages_forwards_and_backwards():
+    user = ExtendUser.objects.create(username='pageuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    for reps in range(1, 6):
+        WorkoutLog.objects.create(exercise_id=exercise, reps=reps, weight_kg=100, sets=3)
+
+    query = '''
+        query ($exerciseId: Int!, $first: Int, $after: String, $last: Int, $before: String) {
+            getWorkoutsByExerciseIdConnection(exerciseId: $exerciseId, first: $first, after: $after, last: $last, before: $before) {
+                edges {
+                    cursor
+                    node {
+                        reps
+                    }
+                }
+                pageInfo {
+                    hasNextPage
+                    hasPreviousPage
+                    endCursor
+                    startCursor
+                }
+            }
+        }
+    '''
+
+    client = Client(schema)
+    first_page = client.execute(query, variables={'exerciseId': exercise.exercise_id, 'first': 2})['data']['getWorkoutsByExerciseIdConnection']
+    assert [edge['node']['reps'] for edge in first_page['edges']] == [1, 2]
+    assert first_page['pageInfo']['hasNextPage'] == True
+    assert first_page['pageInfo']['hasPreviousPage'] == False
+
+    invalid_cursor = client.execute(query, variables={'exerciseId': exercise.exercise_id, 'first': 2, 'after': 'WzBd'})
+    assert invalid_cursor['errors'][0]['message'] == 'Invalid cursor: WzBd'
+
+    second_page = client.execute(query, variables={'exerciseId': exercise.exercise_id, 'first': 2, 'after': first_page['pageInfo']['endCursor']})['data']['getWorkoutsByExerciseIdConnection']
+    assert [edge['node']['reps'] for edge in second_page['edges']] == [3, 4]
+    assert second_page['pageInfo']['hasNextPage'] == True
+
+    third_page = client.execute(query, variables={'exerciseId': exercise.exercise_id, 'first': 2, 'after': second_page['pageInfo']['endCursor']})['data']['getWorkoutsByExerciseIdConnection']
+    assert [edge['node']['reps'] for edge in third_page['edges']] == [5]
+    assert third_page['pageInfo']['hasNextPage'] == False
+
+    previous_page = client.execute(query, variables={'exerciseId': exercise.exercise_id, 'last': 2, 'before': third_page['pageInfo']['startCursor']})['data']['getWorkoutsByExerciseIdConnection']
+    assert [edge['node']['reps'] for edge in previous_page['edges']] == [3, 4]
+    assert previous_page['pageInfo']['hasPreviousPage'] == True
+    assert previous_page['pageInfo']['hasNextPage'] == True
+
+
+@pytest.mark.django_db
+def test_get_all_users_connection_rejects_oversized_pages():
+    query = '''
+        query {
+            getAllUsersConnection(first: 101) {
+                edges {
+                    node {
+                        username
+                    }
+                }
+            }
+        }
+    '''
+
+    client = Client(schema)
+    executed = client.execute(query)
+    assert executed['data'] == {'getAllUsersConnection': None}
+    assert executed['errors'][0]['message'] == 'Argument "first" must be between 0 and 100.'
+    assert executed['errors'][0]['path'] == ['getAllUsersConnection']
+
+
+@pytest.mark.django_db
+def test_query_over_cost_budget_is_rejected_before_execution(django_assert_num_queries):
+    query = '''
+        query {
+            getAllUsers {
+                exerciseSet {
+                    workoutlogSet {
+                        exerciseId {
+                            userId {
+                                username
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    '''
+
+    client = Client(schema)
+    with django_assert_num_queries(0):
+        executed = client.execute(query)
+
+    assert executed == {
+        'data': None,
+        'errors': [{'message': 'Query cost 2010101 exceeds the maximum of 25000.'}]
+    }
+
+
+@pytest.mark.django_db
+def test_negative_page_size_does_not_lower_the_query_cost(settings, django_assert_num_queries):
+    settings.GRAPHQL_QUERY_COST = {**settings.GRAPHQL_QUERY_COST, 'MAX_COST': 50}
+    query = '''
+        query {
+            a: getAllUsersConnection(first: -1000000) { edges { node { exerciseSet { workoutlogSet { reps } } } } }
+            getAllUsers { exerciseSet { workoutlogSet { reps } } }
+        }
+    '''
+
+    with django_assert_num_queries(0):
+        executed = Client(schema).execute(query)
+
+    assert executed['data'] is None
+    assert executed['errors'][0]['message'].startswith('Query cost ')
+
+@pytest.mark.django_db
+def test_query_cost_is_reported_in_extensions():
+    query = '''
+        query ($first: Int) {
+            getAllWorkoutsConnection(first: $first) {
+                edges {
+                    node {
+                        reps
+                        exerciseId {
+                            userId {
+                                username
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    '''
+
+    executed = schema.execute(query, variables={'first': 20})
+
+    assert executed.errors is None
+    assert executed.extensions == {'cost': {'estimated': 81, 'depth': 6, 'maximum': 25000}}
+
+
+@pytest.mark.django_db
+def test_repeated_operations_are_served_from_the_document_cache():
+    schema.document_cache.clear()
+    query = '''
+        query {
+            getAllSessions {
+                sessionName
+            }
+        }
+    '''
+
+    client = Client(schema)
+    first = client.execute(query)
+    second = client.execute(query)
+    client.execute('query { getAllSessions { banana } }')
+    invalid = client.execute('query { getAllSessions { banana } }')
+
+    assert first == second == {'data': {'getAllSessions': []}}
+    assert invalid['errors'][0]['message'] == "Cannot query field 'banana' on type 'SessionLogType'."
+    assert schema.document_cache.info() == {'hits': 2, 'misses': 2, 'size': 2, 'maxsize': 256}
+
+
+def test_document_cache_evicts_least_recently_used_and_resets_on_schema_change():
+    cache = DocumentCache(maxsize=2)
+    cache.get(schema.graphql_schema, 'query { getAllUsers { username } }')
+    cache.get(schema.graphql_schema, 'query { getAllSessions { sessionName } }')
+    cache.get(schema.graphql_schema, 'query { getAllUsers { username } }')
+    cache.get(schema.graphql_schema, 'query { getAllWorkouts { reps } }')
+
+    assert cache.info() == {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+
+    cache.get(ApiSchema(query=Query).graphql_schema, 'query { getAllUsers { username } }')
+
+    assert cache.info() == {'hits': 1, 'misses': 4, 'size': 1, 'maxsize': 2}
+
+
+@pytest.mark.django_db
+def test_workouts_by_exercise_id_are_cached_until_a_workout_mutation(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='cacheuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    WorkoutLog.objects.create(exercise_id=exercise, reps=5, weight_kg=100, sets=5)
+
+    query = '''
+        query ($exerciseId: Int) {
+            getWorkoutsByExerciseId(exerciseId: $exerciseId) {
+                reps
+                weightKg
+            }
+        }
+    '''
+    creation = '''
+        mutation ($exerciseId: ID!) {
+            createWorkout(exerciseId: $exerciseId, weightKg: 110, reps: 3, sets: 3) {
+                workout {
+                    workoutId
+                }
+            }
+        }
+    '''
+    variables = {'exerciseId': exercise.exercise_id}
+
+    client = Client(schema)
+    first = client.execute(query, variables=variables)
+    with django_assert_num_queries(0):
+        cached = client.execute(query, variables=variables)
+    client.execute(creation, variables=variables)
+    refreshed = client.execute(query, variables=variables)
+
+    assert first == cached == {'data': {'getWorkoutsByExerciseId': [{'reps': 5, 'weightKg': 100}]}}
+    assert refreshed == {'data': {'getWorkoutsByExerciseId': [{'reps': 5, 'weightKg': 100}, {'reps': 3, 'weightKg': 110}]}}
+
+
+@pytest.mark.django_db
+def test_create_workouts_in_bulk(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='bulkuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench Press', external_exercise_bodypart='Chest', personal_best=0)
+
+    mutation = '''
+        mutation ($input: [WorkoutInput!]!) {
+            createWorkouts(input: $input) {
+                workouts {
+                    workoutId
+                    reps
+                    exerciseId {
+                        externalExerciseName
+                    }
+                }
+            }
+        }
+    '''
+    workouts = [
+        {'exerciseId': squat.exercise_id, 'weightKg': 100, 'reps': 5, 'sets': 5},
+        {'exerciseId': bench.exercise_id, 'weightKg': 80, 'reps': 8, 'sets': 3},
+        {'exerciseId': squat.exercise_id, 'weightKg': 110, 'reps': 3, 'sets': 2},
+    ]
+
+    client = Client(schema)
+    # exercise check, savepoint, insert, personal best read and update,
+    # exercise lock, rep max read and upsert, record insert, summary insert,
+    # read and update, release, exercise batch
+    with django_assert_num_queries(14):
+        executed = client.execute(mutation, variables={'input': workouts}, context_value=RequestFactory().post('/api/'))
+
+    created = executed['data']['createWorkouts']['workouts']
+    assert [workout['reps'] for workout in created] == [5, 8, 3]
+    assert [workout['exerciseId']['externalExerciseName'] for workout in created] == ['Squat', 'Bench Press', 'Squat']
+    assert [workout['workoutId'] for workout in created] == [str(workout.workout_id) for workout in WorkoutLog.objects.order_by('pk')]
+
+
+@pytest.mark.django_db
+def test_create_workouts_rejects_the_batch_on_unknown_exercise():
+    user = ExtendUser.objects.create(username='bulkuser2', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    mutation = '''
+        mutation ($input: [WorkoutInput!]!) {
+            createWorkouts(input: $input) {
+                workouts {
+                    workoutId
+                }
+            }
+        }
+    '''
+    workouts = [
+        {'exerciseId': squat.exercise_id, 'weightKg': 100, 'reps': 5, 'sets': 5},
+        {'exerciseId': 987654, 'weightKg': 80, 'reps': 8, 'sets': 3},
+    ]
+
+    client = Client(schema)
+    executed = client.execute(mutation, variables={'input': workouts})
+
+    assert executed['data'] == {'createWorkouts': None}
+    assert executed['errors'][0]['message'] == 'Exercise matching query does not exist.'
+    assert WorkoutLog.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_log_session_writes_everything_in_one_round_trip(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='sessionlogger', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench Press', external_exercise_bodypart='Chest', personal_best=0)
+
+    mutation = '''
+        mutation ($userId: ID!, $exercises: [SessionExerciseInput!]!) {
+            logSession(userId: $userId, sessionName: "Push Day", exercises: $exercises) {
+                session {
+                    sessionName
+                }
+                sessionExercises {
+                    exerciseId {
+                        externalExerciseName
+                    }
+                }
+                workouts {
+                    reps
+                    weightKg
+                }
+            }
+        }
+    '''
+    exercises = [
+        {'exerciseId': squat.exercise_id, 'workouts': [{'weightKg': 100, 'reps': 5, 'sets': 5}, {'weightKg': 110, 'reps': 3, 'sets': 2}]},
+        {'exerciseId': bench.exercise_id, 'workouts': [{'weightKg': 80, 'reps': 8, 'sets': 3}]},
+    ]
+
+    client = Client(schema)
+    # exercise check, savepoint, three inserts, personal best read and update,
+    # exercise lock, rep max read and upsert, record insert, summary insert,
+    # read and update, release, exercise batch
+    with django_assert_num_queries(16):
+        executed = client.execute(mutation, variables={'userId': user.user_id, 'exercises': exercises}, context_value=RequestFactory().post('/api/'))
+
+    assert executed == {
+        'data': {
+            'logSession': {
+                'session': {'sessionName': 'Push Day'},
+                'sessionExercises': [
+                    {'exerciseId': {'externalExerciseName': 'Squat'}},
+                    {'exerciseId': {'externalExerciseName': 'Bench Press'}}
+                ],
+                'workouts': [
+                    {'reps': 5, 'weightKg': 100},
+                    {'reps': 3, 'weightKg': 110},
+                    {'reps': 8, 'weightKg': 80}
+                ]
+            }
+        }
+    }
+    assert SessionLog.objects.filter(user_id=user).count() == 1
+
+
+@pytest.mark.django_db
+def test_log_session_rejects_exercises_of_another_user():
+    owner = ExtendUser.objects.create(username='owner', password='password', email='testuser@test.com')
+    other = ExtendUser.objects.create(username='other', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=owner, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    mutation = '''
+        mutation ($userId: ID!, $exercises: [SessionExerciseInput!]!) {
+            logSession(userId: $userId, sessionName: "Leg Day", exercises: $exercises) {
+                session {
+                    sessionId
+                }
+            }
+        }
+    '''
+
+    client = Client(schema)
+    executed = client.execute(mutation, variables={'userId': other.user_id, 'exercises': [{'exerciseId': squat.exercise_id}]})
+
+    assert executed['data'] == {'logSession': None}
+    assert executed['errors'][0]['message'] == 'Exercise matching query does not exist.'
+    assert SessionLog.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_workouts_and_sessions_filtered_by_date_range():
+    user = ExtendUser.objects.create(username='rangeuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    for day in (1, 10, 20, 30):
+        workout = WorkoutLog.objects.create(exercise_id=exercise, reps=day, weight_kg=100, sets=3)
+        session = SessionLog.objects.create(user_id=user, session_name='Day {}'.format(day))
+        # date_time is auto_now_add, so backdate the rows after creating them.
+        WorkoutLog.objects.filter(pk=workout.pk).update(date_time=datetime(2024, 1, day, tzinfo=timezone.utc))
+        SessionLog.objects.filter(pk=session.pk).update(date_time=datetime(2024, 1, day, tzinfo=timezone.utc))
+
+    query = '''
+        query ($exerciseId: Int!, $userId: Int!, $from: DateTime, $to: DateTime) {
+            getWorkoutsByExerciseId(exerciseId: $exerciseId, from: $from, to: $to) { reps }
+            getSessionsByUserId(userId: $userId, from: $from) { sessionName }
+            getWorkoutsByExerciseIdConnection(exerciseId: $exerciseId, to: $to, first: 1) { edges { node { reps } } pageInfo { hasNextPage } }
+        }
+    '''
+
+    client = Client(schema)
+    executed = client.execute(query, variables={
+        'exerciseId': exercise.exercise_id, 'userId': user.user_id, 'from': '2024-01-10T00:00:00+00:00', 'to': '2024-01-30T00:00:00+00:00',
+    })
+
+    assert executed == {
+        'data': {
+            'getWorkoutsByExerciseId': [{'reps': 10}, {'reps': 20}],
+            'getSessionsByUserId': [{'sessionName': 'Day 10'}, {'sessionName': 'Day 20'}, {'sessionName': 'Day 30'}],
+            'getWorkoutsByExerciseIdConnection': {'edges': [{'node': {'reps': 1}}], 'pageInfo': {'hasNextPage': True}},
+        }
+    }
+
+
+@pytest.mark.django_db
+def test_get_workouts_by_user_id_spans_exercises_without_a_join(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='feeduser', password='password', email='testuser@test.com')
+    other = ExtendUser.objects.create(username='otherfeeduser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench Press', external_exercise_bodypart='Chest', personal_best=0)
+    deadlift = Exercise.objects.create(user_id=other, external_exercise_id='9012', external_exercise_name='Deadlift', external_exercise_bodypart='Back', personal_best=0)
+
+    client = Client(schema)
+    client.execute('mutation ($id: ID!) { createWorkout(exerciseId: $id, weightKg: 100, reps: 5, sets: 3) { workout { reps } } }', variables={'id': squat.exercise_id})
+    client.execute('mutation ($input: [WorkoutInput!]!) { createWorkouts(input: $input) { workouts { reps } } }', variables={'input': [
+        {'exerciseId': bench.exercise_id, 'weightKg': 80, 'reps': 8, 'sets': 3},
+        {'exerciseId': deadlift.exercise_id, 'weightKg': 140, 'reps': 3, 'sets': 1},
+    ]})
+    client.execute('mutation ($userId: ID!, $exercises: [SessionExerciseInput!]!) { logSession(userId: $userId, sessionName: "Legs", exercises: $exercises) { session { sessionName } } }', variables={
+        'userId': user.user_id, 'exercises': [{'exerciseId': squat.exercise_id, 'workouts': [{'weightKg': 105, 'reps': 4, 'sets': 2}]}],
+    })
+
+    query = '''
+        query ($userId: Int!) {
+            getWorkoutsByUserId(userId: $userId) { reps userId { username } }
+        }
+    '''
+
+    with django_assert_num_queries(1) as captured:
+        executed = Client(schema).execute(query, variables={'userId': user.user_id})
+
+    assert 'api_exercise' not in captured.captured_queries[0]['sql']
+    assert executed == {
+        'data': {
+            'getWorkoutsByUserId': [
+                {'reps': 5, 'userId': {'username': 'feeduser'}},
+                {'reps': 8, 'userId': {'username': 'feeduser'}},
+                {'reps': 4, 'userId': {'username': 'feeduser'}},
+            ]
+        }
+    }
+    assert list(WorkoutLog.objects.filter(exercise_id=deadlift).values_list('user_id', flat=True)) == [other.user_id]
+
+    connection_query = '''
+        query ($userId: Int!, $after: String) {
+            getWorkoutsByUserIdConnection(userId: $userId, first: 2, after: $after) { edges { node { reps } } pageInfo { hasNextPage endCursor } }
+        }
+    '''
+    first_page = Client(schema).execute(connection_query, variables={'userId': user.user_id})['data']['getWorkoutsByUserIdConnection']
+    second_page = Client(schema).execute(connection_query, variables={'userId': user.user_id, 'after': first_page['pageInfo']['endCursor']})['data']['getWorkoutsByUserIdConnection']
+
+    assert [edge['node']['reps'] for edge in first_page['edges'] + second_page['edges']] == [5, 8, 4]
+    assert second_page['pageInfo']['hasNextPage'] is False
+
+@pytest.mark.django_db
+def test_personal_best_follows_workout_writes():
+    user = ExtendUser.objects.create(username='recorduser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench', external_exercise_bodypart='Chest', personal_best=90)
+    client = Client(schema)
+
+    def personal_best(exercise):
+        return Exercise.objects.get(pk=exercise.pk).personal_best
+
+    def log(exercise, weight_kg):
+        executed = client.execute('mutation ($id: ID!, $kg: Int!) { createWorkout(exerciseId: $id, weightKg: $kg, reps: 5, sets: 3) { workout { workoutId exerciseId { personalBest } } } }', variables={'id': exercise.exercise_id, 'kg': weight_kg})
+        return executed['data']['createWorkout']['workout']
+
+    first = log(squat, 100)
+    second = log(squat, 120)
+    log(squat, 110)
+    assert first['exerciseId'] == {'personalBest': 100}
+    assert second['exerciseId'] == {'personalBest': 120}
+    assert personal_best(squat) == 120
+
+    # A record set by hand is only ever raised by heavier workouts.
+    log(bench, 80)
+    assert personal_best(bench) == 90
+
+    client.execute('mutation ($id: ID!) { updateWorkout(workoutId: $id, weightKg: 105, reps: 5, sets: 3) { workout { weightKg } } }', variables={'id': second['workoutId']})
+    assert personal_best(squat) == 110
+    client.execute('mutation ($id: ID!) { updateWorkout(workoutId: $id, weightKg: 130, reps: 5, sets: 3) { workout { weightKg } } }', variables={'id': first['workoutId']})
+    assert personal_best(squat) == 130
+    client.execute('mutation ($id: ID!) { deleteWorkout(workoutId: $id) { workout { weightKg } } }', variables={'id': first['workoutId']})
+    assert personal_best(squat) == 110
+
+    client.execute('mutation ($input: [WorkoutInput!]!) { createWorkouts(input: $input) { workouts { reps } } }', variables={'input': [
+        {'exerciseId': squat.exercise_id, 'weightKg': 140, 'reps': 1, 'sets': 1},
+        {'exerciseId': squat.exercise_id, 'weightKg': 150, 'reps': 1, 'sets': 1},
+        {'exerciseId': bench.exercise_id, 'weightKg': 95, 'reps': 3, 'sets': 1},
+    ]})
+    assert (personal_best(squat), personal_best(bench)) == (150, 95)
+
+    client.execute('mutation ($userId: ID!, $exercises: [SessionExerciseInput!]!) { logSession(userId: $userId, sessionName: "Push", exercises: $exercises) { session { sessionName } } }', variables={
+        'userId': user.user_id, 'exercises': [{'exerciseId': bench.exercise_id, 'workouts': [{'weightKg': 100, 'reps': 2, 'sets': 1}]}],
+    })
+    assert personal_best(bench) == 100
+
+@pytest.mark.django_db
+def test_rep_maxes_and_record_timeline_follow_workout_writes(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='repmaxuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench', external_exercise_bodypart='Chest', personal_best=0)
+    client = Client(schema)
+
+    def log(weight_kg, reps):
+        executed = client.execute('mutation ($id: ID!, $kg: Int!, $reps: Int!) { createWorkout(exerciseId: $id, weightKg: $kg, reps: $reps, sets: 1) { workout { workoutId } } }', variables={'id': squat.exercise_id, 'kg': weight_kg, 'reps': reps})
+        return executed['data']['createWorkout']['workout']['workoutId']
+
+    log(100, 5)
+    heavy_single = log(120, 1)
+    log(90, 8)
+    log(95, 3)
+    client.execute('mutation ($input: [WorkoutInput!]!) { createWorkouts(input: $input) { workouts { reps } } }', variables={'input': [
+        {'exerciseId': squat.exercise_id, 'weightKg': 80, 'reps': 10, 'sets': 1},
+        {'exerciseId': squat.exercise_id, 'weightKg': 85, 'reps': 10, 'sets': 1},
+    ]})
+
+    query = '''
+        query ($userId: Int!) {
+            getExercisesByUserId(userId: $userId) {
+                externalExerciseName
+                repMaxes { reps weightKg }
+                personalRecords { reps weightKg }
+            }
+        }
+    '''
+
+    # exercises, rep maxes, records
+    with django_assert_num_queries(3):
+        executed = client.execute(query, variables={'userId': user.user_id})
+
+    squat_records, bench_records = executed['data']['getExercisesByUserId']
+    assert squat_records['repMaxes'] == [
+        {'reps': 1, 'weightKg': 120},
+        {'reps': 3, 'weightKg': 100},
+        {'reps': 5, 'weightKg': 100},
+        {'reps': 8, 'weightKg': 90},
+        {'reps': 10, 'weightKg': 85},
+    ]
+    assert squat_records['personalRecords'] == [
+        {'reps': 1, 'weightKg': 100},
+        {'reps': 3, 'weightKg': 100},
+        {'reps': 5, 'weightKg': 100},
+        {'reps': 1, 'weightKg': 120},
+        {'reps': 8, 'weightKg': 90},
+        {'reps': 10, 'weightKg': 85},
+    ]
+    assert bench_records == {'externalExerciseName': 'Bench', 'repMaxes': [], 'personalRecords': []}
+
+    # Losing the heavy single hands the 1RM back to the next best set, without a new record.
+    client.execute('mutation ($id: ID!) { deleteWorkout(workoutId: $id) { workout { weightKg } } }', variables={'id': heavy_single})
+    squat_records = client.execute(query, variables={'userId': user.user_id})['data']['getExercisesByUserId'][0]
+    assert squat_records['repMaxes'][0] == {'reps': 1, 'weightKg': 100}
+    assert {'reps': 1, 'weightKg': 120} not in squat_records['personalRecords']
+    assert len(squat_records['personalRecords']) == 5
+
+    assert RepMax.objects.filter(exercise_id=squat).count() == 5
+    assert PersonalRecord.objects.filter(exercise_id=squat).count() == 5
+
+@pytest.mark.django_db
+def test_daily_summaries_follow_workout_writes_and_match_a_rebuild():
+    user = ExtendUser.objects.create(username='summaryuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    client = Client(schema)
+
+    created = client.execute('mutation ($input: [WorkoutInput!]!) { createWorkouts(input: $input) { workouts { workoutId } } }', variables={'input': [
+        {'exerciseId': squat.exercise_id, 'weightKg': 100, 'reps': 5, 'sets': 3},
+        {'exerciseId': squat.exercise_id, 'weightKg': 120, 'reps': 2, 'sets': 2},
+    ]})['data']['createWorkouts']['workouts']
+    client.execute('mutation ($id: ID!) { createWorkout(exerciseId: $id, weightKg: 60, reps: 10, sets: 1) { workout { reps } } }', variables={'id': squat.exercise_id})
+    client.execute('mutation ($id: ID!) { updateWorkout(workoutId: $id, weightKg: 90, reps: 2, sets: 2) { workout { reps } } }', variables={'id': created[1]['workoutId']})
+
+    summary = DailySummary.objects.get(exercise_id=squat)
+    assert (summary.volume_kg, summary.top_set_kg, summary.workout_count) == (1500 + 360 + 600, 100, 3)
+
+    client.execute('mutation ($id: ID!) { deleteWorkout(workoutId: $id) { workout { reps } } }', variables={'id': created[0]['workoutId']})
+    summary = DailySummary.objects.get(exercise_id=squat)
+    assert (summary.volume_kg, summary.top_set_kg, summary.workout_count) == (360 + 600, 90, 2)
+
+    incremental = list(DailySummary.objects.values_list('exercise_id', 'day', 'volume_kg', 'top_set_kg', 'workout_count'))
+    call_command('rebuild_training_summaries', chunk_size=1, stdout=open('/dev/null', 'w'))
+    assert list(DailySummary.objects.values_list('exercise_id', 'day', 'volume_kg', 'top_set_kg', 'workout_count')) == incremental
+
+@pytest.mark.django_db
+def test_editing_a_workout_whose_day_has_no_summary_rebuilds_the_day():
+    user = ExtendUser.objects.create(username='nosummaryuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    # Written outside the API, so no DailySummary row exists for the day.
+    first = WorkoutLog.objects.create(user_id=user, exercise_id=squat, weight_kg=100, reps=5, sets=3)
+    second = WorkoutLog.objects.create(user_id=user, exercise_id=squat, weight_kg=80, reps=5, sets=1)
+    client = Client(schema)
+
+    updated = client.execute('mutation ($id: ID!) { updateWorkout(workoutId: $id, weightKg: 110, reps: 2, sets: 2) { workout { weightKg } } }', variables={'id': first.workout_id})
+    assert updated == {'data': {'updateWorkout': {'workout': {'weightKg': 110}}}}
+    summary = DailySummary.objects.get(exercise_id=squat)
+    assert (summary.volume_kg, summary.top_set_kg, summary.workout_count) == (440 + 400, 110, 2)
+
+    DailySummary.objects.all().delete()
+    deleted = client.execute('mutation ($id: ID!) { deleteWorkout(workoutId: $id) { workout { weightKg } } }', variables={'id': second.workout_id})
+    assert 'errors' not in deleted
+    assert not WorkoutLog.objects.filter(pk=second.workout_id).exists()
+    summary = DailySummary.objects.get(exercise_id=squat)
+    assert (summary.volume_kg, summary.top_set_kg, summary.workout_count) == (440, 110, 1)
+
+@pytest.mark.django_db
+def test_rebuilding_summaries_drops_cached_summary_results():
+    user = ExtendUser.objects.create(username='repairuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    WorkoutLog.objects.create(user_id=user, exercise_id=squat, weight_kg=100, reps=5, sets=1)
+    query = 'query ($userId: Int!) { getTrainingSummaries(userId: $userId, period: DAY) { volumeKg workoutCount } }'
+    client = Client(schema)
+
+    assert client.execute(query, variables={'userId': user.user_id})['data']['getTrainingSummaries'] == []
+    call_command('rebuild_training_summaries', stdout=open('/dev/null', 'w'))
+
+    assert client.execute(query, variables={'userId': user.user_id})['data']['getTrainingSummaries'] == [{'volumeKg': 500, 'workoutCount': 1}]
+
+@pytest.mark.django_db
+def test_training_summaries_roll_up_by_week_and_month(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='rollupuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench', external_exercise_bodypart='Chest', personal_best=0)
+    for exercise, day, weight_kg in [
+        (squat, datetime(2024, 1, 29, 9, tzinfo=timezone.utc), 100),
+        (squat, datetime(2024, 1, 29, 18, tzinfo=timezone.utc), 110),
+        (squat, datetime(2024, 2, 1, 9, tzinfo=timezone.utc), 105),
+        (squat, datetime(2024, 2, 6, 9, tzinfo=timezone.utc), 115),
+        (bench, datetime(2024, 2, 6, 9, tzinfo=timezone.utc), 80),
+    ]:
+        workout = WorkoutLog.objects.create(exercise_id=exercise, weight_kg=weight_kg, reps=5, sets=1)
+        WorkoutLog.objects.filter(pk=workout.pk).update(date_time=day)
+    call_command('rebuild_training_summaries', stdout=open('/dev/null', 'w'))
+
+    query = '''
+        query ($userId: Int!, $period: SummaryPeriod!, $exerciseId: Int, $from: Date) {
+            getTrainingSummaries(userId: $userId, period: $period, exerciseId: $exerciseId, from: $from) {
+                day volumeKg topSetKg workoutCount trainingDays exerciseId { externalExerciseName }
+            }
+        }
+    '''
+
+    client = Client(schema)
+
+    # summaries, exercise batch
+    with django_assert_num_queries(2):
+        executed = client.execute(query, variables={'userId': user.user_id, 'period': 'WEEK'}, context_value=RequestFactory().post('/api/'))
+
+    weeks = executed['data']['getTrainingSummaries']
+
+    assert weeks == [
+        {'day': '2024-01-29', 'volumeKg': 1575, 'topSetKg': 110, 'workoutCount': 3, 'trainingDays': 2, 'exerciseId': {'externalExerciseName': 'Squat'}},
+        {'day': '2024-02-05', 'volumeKg': 575, 'topSetKg': 115, 'workoutCount': 1, 'trainingDays': 1, 'exerciseId': {'externalExerciseName': 'Squat'}},
+        {'day': '2024-02-05', 'volumeKg': 400, 'topSetKg': 80, 'workoutCount': 1, 'trainingDays': 1, 'exerciseId': {'externalExerciseName': 'Bench'}},
+    ]
+    months = client.execute(query, variables={'userId': user.user_id, 'period': 'MONTH', 'exerciseId': squat.exercise_id})['data']['getTrainingSummaries']
+    assert [(month['day'], month['volumeKg'], month['trainingDays']) for month in months] == [('2024-01-01', 1050, 1), ('2024-02-01', 1100, 2)]
+    days = client.execute(query, variables={'userId': user.user_id, 'period': 'DAY', 'exerciseId': squat.exercise_id, 'from': '2024-02-01'})['data']['getTrainingSummaries']
+    assert [(day['day'], day['topSetKg'], day['trainingDays']) for day in days] == [('2024-02-01', 105, 1), ('2024-02-06', 115, 1)]
+
+@pytest.mark.django_db
+def test_sync_returns_rows_changed_or_deleted_since_the_cursor(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='syncuser', password='password', email='testuser@test.com')
+    other = ExtendUser.objects.create(username='othersyncuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    bench = Exercise.objects.create(user_id=user, external_exercise_id='5678', external_exercise_name='Bench', external_exercise_bodypart='Chest', personal_best=0)
+    Exercise.objects.create(user_id=other, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    workout = WorkoutLog.objects.create(exercise_id=squat, weight_kg=100, reps=5, sets=3)
+    session = SessionLog.objects.create(user_id=user, session_name='Legs')
+    SessionLog_Exercise.objects.create(session_id=session, exercise_id=squat)
+    benched = SessionLog_Exercise.objects.create(session_id=session, exercise_id=bench)
+    client = Client(schema)
+
+    query = '''
+        query ($userId: Int!, $since: String) {
+            sync(userId: $userId, since: $since) {
+                cursor
+                exercises { exerciseId personalBest }
+                workouts { workoutId weightKg }
+                sessions { sessionName }
+                sessionExercises { sessionExerciseId }
+                deleted { model objectId }
+            }
+        }
+    '''
+
+    first = client.execute(query, variables={'userId': user.user_id})['data']['sync']
+    assert [exercise['exerciseId'] for exercise in first['exercises']] == [str(squat.exercise_id), str(bench.exercise_id)]
+    assert first['workouts'] == [{'workoutId': str(workout.workout_id), 'weightKg': 100}]
+    assert first['sessions'] == [{'sessionName': 'Legs'}]
+    assert len(first['sessionExercises']) == 2
+    assert first['deleted'] == []
+
+    # Pretend the first sync happened an hour ago.
+    an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+    for model in (Exercise, WorkoutLog, SessionLog, SessionLog_Exercise):
+        model.objects.update(updated_at=an_hour_ago - timedelta(minutes=5))
+    since = encode_sync_cursor(an_hour_ago)
+
+    client.execute('mutation ($id: ID!) { updateWorkout(workoutId: $id, weightKg: 110, reps: 5, sets: 3) { workout { weightKg } } }', variables={'id': workout.workout_id})
+    client.execute('mutation ($id: ID!) { deleteSessionExercise(sessionExerciseId: $id) { sessionExercise { sessionExerciseId } } }', variables={'id': benched.session_exercise_id})
+
+    # one read per table
+    with django_assert_num_queries(5):
+        delta = client.execute(query, variables={'userId': user.user_id, 'since': since}, context_value=RequestFactory().post('/api/'))['data']['sync']
+
+    assert delta['exercises'] == [{'exerciseId': str(squat.exercise_id), 'personalBest': 110}]
+    assert delta['workouts'] == [{'workoutId': str(workout.workout_id), 'weightKg': 110}]
+    assert delta['sessions'] == []
+    assert delta['sessionExercises'] == []
+    assert delta['deleted'] == [{'model': 'SessionLog_Exercise', 'objectId': benched.session_exercise_id}]
+
+    client.execute('mutation ($id: ID!) { deleteExercise(exerciseId: $id) { exercise { exerciseId } } }', variables={'id': squat.exercise_id})
+    deleted = client.execute(query, variables={'userId': user.user_id, 'since': since})['data']['sync']['deleted']
+    assert sorted((row['model'], row['objectId']) for row in deleted) == sorted([
+        ('Exercise', squat.exercise_id),
+        ('SessionLog_Exercise', benched.session_exercise_id),
+        ('SessionLog_Exercise', benched.session_exercise_id - 1),
+        ('WorkoutLog', workout.workout_id),
+    ])
+
+    invalid = client.execute(query, variables={'userId': user.user_id, 'since': 'not-a-cursor'})
+    assert invalid['errors'][0]['message'] == 'Invalid cursor: not-a-cursor'
+
+@pytest.mark.django_db
+def test_replay_operations_applies_each_idempotency_key_once():
+    user = ExtendUser.objects.create(username='replayuser', password='password', email='testuser@test.com')
+    other = ExtendUser.objects.create(username='otherreplayuser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    foreign = Exercise.objects.create(user_id=other, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    client = Client(schema)
+
+    mutation = '''
+        mutation ($userId: ID!, $operations: [ReplayOperationInput!]!) {
+            replayOperations(userId: $userId, operations: $operations) { ids { clientId model objectId created } }
+        }
+    '''
+    operations = [
+        {'clientId': 'local-session-1', 'idempotencyKey': 'key-1', 'createSession': {'sessionName': 'Legs'}},
+        {'clientId': 'local-workout-1', 'idempotencyKey': 'key-2', 'createWorkout': {'exerciseId': squat.exercise_id, 'weightKg': 100, 'reps': 5, 'sets': 3}},
+        {'clientId': 'local-workout-2', 'idempotencyKey': 'key-3', 'createWorkout': {'exerciseId': squat.exercise_id, 'weightKg': 110, 'reps': 3, 'sets': 3}},
+    ]
+
+    first = client.execute(mutation, variables={'userId': user.user_id, 'operations': operations[:2]})['data']['replayOperations']['ids']
+    session = SessionLog.objects.get(user_id=user)
+    workout = WorkoutLog.objects.get(user_id=user)
+    assert first == [
+        {'clientId': 'local-session-1', 'model': 'SessionLog', 'objectId': str(session.session_id), 'created': True},
+        {'clientId': 'local-workout-1', 'model': 'WorkoutLog', 'objectId': str(workout.workout_id), 'created': True},
+    ]
+
+    # The response was lost, so the device sends its whole queue again.
+    second = client.execute(mutation, variables={'userId': user.user_id, 'operations': operations})['data']['replayOperations']['ids']
+    assert [(row['objectId'], row['created']) for row in second[:2]] == [(str(session.session_id), False), (str(workout.workout_id), False)]
+    assert second[2]['created'] is True
+    assert SessionLog.objects.filter(user_id=user).count() == 1
+    assert WorkoutLog.objects.filter(user_id=user).count() == 2
+    assert Exercise.objects.get(pk=squat.pk).personal_best == 110
+
+    repeated = client.execute(mutation, variables={'userId': user.user_id, 'operations': [operations[2], operations[2]]})['data']['replayOperations']['ids']
+    assert repeated[0] == repeated[1] == {'clientId': 'local-workout-2', 'model': 'WorkoutLog', 'objectId': second[2]['objectId'], 'created': False}
+
+    ambiguous = client.execute(mutation, variables={'userId': user.user_id, 'operations': [{'clientId': 'x', 'idempotencyKey': 'key-4'}]})
+    assert ambiguous['errors'][0]['message'] == 'Each operation must set exactly one of createWorkout and createSession.'
+    foreign_workout = {'clientId': 'x', 'idempotencyKey': 'key-4', 'createWorkout': {'exerciseId': foreign.exercise_id, 'weightKg': 100, 'reps': 5, 'sets': 3}}
+    rejected = client.execute(mutation, variables={'userId': user.user_id, 'operations': [foreign_workout]})
+    assert rejected['errors'][0]['message'] == 'Exercise matching query does not exist.'
+    assert WorkoutLog.objects.filter(exercise_id=foreign).count() == 0
+
+@pytest.mark.django_db
+def test_replay_racing_an_identical_replay_maps_to_the_winners_rows(monkeypatch):
+    user = ExtendUser.objects.create(username='racinguser', password='password', email='testuser@test.com')
+    mutation = '''
+        mutation ($userId: ID!, $operations: [ReplayOperationInput!]!) {
+            replayOperations(userId: $userId, operations: $operations) { ids { objectId created } }
+        }
+    '''
+    operations = [{'clientId': 'local-session-1', 'idempotencyKey': 'key-1', 'createSession': {'sessionName': 'Legs'}}]
+    winner = Client(schema).execute(mutation, variables={'userId': user.user_id, 'operations': operations})['data']['replayOperations']['ids'][0]
+
+    # The loser read the keys before the winner committed.
+    reads = []
+    filter = AppliedOperation.objects.filter
+
+    def stale_filter(*args, **kwargs):
+        reads.append(kwargs)
+        return filter(*args, **kwargs).none() if len(reads) == 1 else filter(*args, **kwargs)
+
+    monkeypatch.setattr(AppliedOperation.objects, 'filter', stale_filter)
+    loser = Client(schema).execute(mutation, variables={'userId': user.user_id, 'operations': operations})['data']['replayOperations']['ids'][0]
+
+    assert loser == {'objectId': winner['objectId'], 'created': False}
+    assert SessionLog.objects.filter(user_id=user).count() == 1
+
+@pytest.mark.django_db
+def test_updates_write_without_reading_the_row_first(django_assert_num_queries):
+    user = ExtendUser.objects.create(username='writeuser', password='password', email='testuser@test.com')
+    session = SessionLog.objects.create(user_id=user, session_name='Legs')
+    client = Client(schema)
+
+    # Only columns the mutation wrote were selected, so nothing is read back.
+    with django_assert_num_queries(1):
+        result = client.execute('mutation ($id: ID!) { updateUser(userId: $id, username: "renamed") { user { userId username } } }', variables={'id': user.user_id})
+    assert result['data']['updateUser']['user'] == {'userId': str(user.user_id), 'username': 'renamed'}
+
+    result = client.execute('mutation ($id: ID!) { updateUser(userId: $id, username: "again") { user { email } } }', variables={'id': user.user_id})
+    assert result['data']['updateUser']['user'] == {'email': 'testuser@test.com'}
+
+    # The session's owner is cached after the first update.
+    client.execute('mutation ($id: ID!) { updateSession(sessionId: $id, sessionName: "Push") { session { sessionName } } }', variables={'id': session.session_id})
+    with django_assert_num_queries(1):
+        result = client.execute('mutation ($id: ID!) { updateSession(sessionId: $id, sessionName: "Pull") { session { sessionId sessionName } } }', variables={'id': session.session_id})
+    assert result['data']['updateSession']['session'] == {'sessionId': str(session.session_id), 'sessionName': 'Pull'}
+    assert SessionLog.objects.get(pk=session.pk).session_name == 'Pull'
+    assert ExtendUser.objects.get(pk=user.pk).username == 'again'
+
+@pytest.mark.django_db
+def test_delete_user_removes_their_rows_a_chunk_at_a_time(settings):
+    settings.ACCOUNT_DELETION = {'CHUNK_SIZE': 2, 'BACKGROUND_AFTER': None}
+    user = ExtendUser.objects.create(username='leavinguser', password='password', email='testuser@test.com')
+    other = ExtendUser.objects.create(username='stayinguser', password='password', email='testuser@test.com')
+    client = Client(schema)
+    for owner in (user, other):
+        exercise = Exercise.objects.create(user_id=owner, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+        client.execute('''
+            mutation ($userId: ID!, $exerciseId: ID!) {
+                logSession(userId: $userId, sessionName: "Legs", exercises: [{exerciseId: $exerciseId, workouts: [
+                    {weightKg: 100, reps: 5, sets: 3}, {weightKg: 105, reps: 3, sets: 3}, {weightKg: 110, reps: 1, sets: 1}
+                ]}]) { session { sessionId } }
+            }
+        ''', variables={'userId': owner.user_id, 'exerciseId': exercise.exercise_id})
+
+    executed = client.execute('mutation ($id: ID!) { deleteUser(userId: $id) { user { userId } } }', variables={'id': user.user_id})
+
+    assert 'errors' not in executed
+    assert not ExtendUser.objects.filter(pk=user.pk).exists()
+    for model in (Exercise, WorkoutLog, SessionLog, SessionLog_Exercise, DailySummary):
+        assert not model.objects.filter(user_id=user.pk).exists()
+        assert model.objects.filter(user_id=other.pk).exists()
+    assert not RepMax.objects.filter(exercise_id__user_id=user.pk).exists()
+    assert not PersonalRecord.objects.filter(exercise_id__user_id=user.pk).exists()
+    assert RepMax.objects.filter(exercise_id__user_id=other.pk).count() == 3
+
+    missing = client.execute('mutation ($id: ID!) { deleteUser(userId: $id) { user { userId } } }', variables={'id': user.user_id})
+    assert missing['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+
+@pytest.mark.django_db
+def test_large_accounts_are_hidden_at_once_and_purged_later(settings):
+    settings.ACCOUNT_DELETION = {'CHUNK_SIZE': 2, 'BACKGROUND_AFTER': 1}
+    user = ExtendUser.objects.create(username='largeuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    client = Client(schema)
+    for weight_kg in (100, 105):
+        client.execute('mutation ($id: ID!, $weightKg: Int!) { createWorkout(exerciseId: $id, weightKg: $weightKg, reps: 5, sets: 3) { workout { workoutId } } }', variables={'id': exercise.exercise_id, 'weightKg': weight_kg})
+
+    client.execute('mutation ($id: ID!) { deleteUser(userId: $id) { user { userId } } }', variables={'id': user.user_id})
+
+    marked = ExtendUser.objects.get(pk=user.pk)
+    assert marked.deleted_at is not None
+    assert not marked.is_active
+    assert client.execute('query { getAllUsers { userId } }') == {'data': {'getAllUsers': []}}
+    hidden = client.execute('query ($id: Int!) { getUserByUserId(userId: $id) { userId } }', variables={'id': user.user_id})
+    assert hidden['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+    again = client.execute('mutation ($id: ID!) { deleteUser(userId: $id) { user { userId } } }', variables={'id': user.user_id})
+    assert again['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+
+    assert list(Job.objects.values_list('name', 'payload', 'state')) == [('purge_user', {'user_id': user.user_id}, Job.QUEUED)]
+    assert exercise_owner(exercise.exercise_id) == user.user_id
+    version = user_version(user.user_id)
+    call_command('run_worker', once=True, stdout=open('/dev/null', 'w'))
+
+    assert Job.objects.get().state == Job.DONE
+    assert cache.get(owner_key(Exercise, exercise.exercise_id)) is None
+    assert user_version(user.user_id) > version
+    gone = client.execute('mutation ($id: ID!) { deleteExercise(exerciseId: $id) { exercise { exerciseId } } }', variables={'id': exercise.exercise_id})
+    assert gone['errors'][0]['message'] == 'Exercise matching query does not exist.'
+
+    assert not ExtendUser.objects.filter(pk=user.pk).exists()
+    assert not WorkoutLog.objects.filter(user_id=user.pk).exists()
+    assert not DailySummary.objects.filter(user_id=user.pk).exists()
+
+@pytest.mark.django_db
+def test_worker_retries_failed_jobs_and_respects_task_limits(settings, monkeypatch):
+    settings.JOB_QUEUE = {'MAX_ATTEMPTS': 3, 'RETRY_DELAY': 0, 'STALE_AFTER': 60, 'POLL_INTERVAL': 0}
+    calls = []
+
+    def flaky(number):
+        calls.append(number)
+        if len(calls) < 2:
+            raise ValueError('not yet')
+
+    monkeypatch.setitem(jobs.tasks, 'flaky', jobs.Task(flaky, None, 3))
+    monkeypatch.setitem(jobs.tasks, 'broken', jobs.Task(lambda: 1 / 0, None, 2))
+    monkeypatch.setitem(jobs.tasks, 'single', jobs.Task(lambda: None, 1, 3))
+    flaky_job = jobs.enqueue('flaky', number=7)
+    broken_job = jobs.enqueue('broken')
+    unknown_job = jobs.enqueue('unknown')
+
+    assert jobs.run_due_jobs() == 5
+
+    assert calls == [7, 7]
+    flaky_job.refresh_from_db()
+    assert (flaky_job.state, flaky_job.attempts) == (Job.DONE, 2)
+    broken_job.refresh_from_db()
+    assert (broken_job.state, broken_job.attempts) == (Job.FAILED, 2)
+    assert 'ZeroDivisionError' in broken_job.last_error
+    unknown_job.refresh_from_db()
+    assert (unknown_job.state, unknown_job.last_error) == (Job.FAILED, 'No task is registered as unknown.')
+
+    # One `single` job is already running, so the other waits; once that one
+    # has been running too long it is taken for lost and retried.
+    running = jobs.enqueue('single')
+    Job.objects.filter(pk=running.pk).update(state=Job.RUNNING, attempts=1, locked_at=datetime.now(timezone.utc))
+    waiting = jobs.enqueue('single')
+    assert jobs.claim() is None
+    Job.objects.filter(pk=running.pk).update(locked_at=datetime.now(timezone.utc) - timedelta(minutes=5))
+    assert jobs.run_due_jobs() == 2
+    assert set(Job.objects.filter(pk__in=[running.pk, waiting.pk]).values_list('state', flat=True)) == {Job.DONE}
+
+@pytest.mark.django_db
+def test_deleting_an_exercise_or_session_forgets_its_cached_owner():
+    user = ExtendUser.objects.create(username='owneruser', password='password', email='testuser@test.com')
+    squat = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    session = SessionLog.objects.create(user_id=user, session_name='Leg Day')
+    assert (exercise_owner(squat.exercise_id), session_owner(session.session_id)) == (user.user_id, user.user_id)
+    client = Client(schema)
+
+    client.execute('mutation ($id: ID!) { deleteExercise(exerciseId: $id) { exercise { exerciseId } } }', variables={'id': squat.exercise_id})
+    client.execute('mutation ($id: ID) { deleteSession(sessionId: $id) { session { sessionId } } }', variables={'id': session.session_id})
+
+    assert cache.get(owner_key(Exercise, squat.exercise_id)) is None
+    assert cache.get(owner_key(SessionLog, session.session_id)) is None
+    assert (exercise_owner(squat.exercise_id), session_owner(session.session_id)) == (None, None)
+
+def test_job_worker_backs_off_while_the_database_is_unavailable(monkeypatch, settings, caplog):
+    settings.JOB_QUEUE = {**settings.JOB_QUEUE, 'POLL_INTERVAL': 1}
+    sleeps = []
+
+    class Stop(Exception):
+        pass
+
+    def unavailable():
+        raise OperationalError('server has gone away')
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            raise Stop
+
+    monkeypatch.setattr(jobs, 'close_old_connections', lambda: None)
+    monkeypatch.setattr(jobs, 'claim', unavailable)
+    monkeypatch.setattr(jobs.time, 'sleep', sleep)
+    with pytest.raises(Stop):
+        jobs.work()
+
+    assert sleeps == [1, 2, 4]
+    assert 'server has gone away' in caplog.text
@@ -0,0 +1,348 @@
+import json
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.test import AsyncRequestFactory
+from api.models import ExtendUser, Exercise, WorkoutLog, SessionLog
+from api.views import ApiGraphQLView, AsyncApiGraphQLView
+from api.schema import schema
+from api.async_schema import async_schema
+from api.persisted import persisted_queries, query_hash
+import pytest
+
+@pytest.mark.django_db
+def test_streamed_get_all_workouts(client, monkeypatch):
+    monkeypatch.setattr(ApiGraphQLView, 'stream_chunk_size', 2)
+    user = ExtendUser.objects.create(username='streamuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    for reps in range(1, 6):
+        WorkoutLog.objects.create(exercise_id=exercise, reps=reps, weight_kg=100, sets=3)
+
+    query = '''
+        query {
+            getAllWorkouts {
+                reps
+                exerciseId {
+                    externalExerciseName
+                }
+            }
+        }
+    '''
+
+    response = client.post('/api/?stream=true', {'query': query}, content_type='application/json')
+
+    assert response.streaming
+    assert json.loads(b''.join(response.streaming_content)) == {
+        'data': {
+            'getAllWorkouts': [{'reps': reps, 'exerciseId': {'externalExerciseName': 'Squat'}} for reps in range(1, 6)]
+        }
+    }
+
+@pytest.mark.django_db
+def test_streamed_empty_list(client):
+    query = '''
+        query {
+            getAllUsers {
+                username
+            }
+        }
+    '''
+
+    response = client.post('/api/?stream=true', {'query': query}, content_type='application/json')
+
+    assert json.loads(b''.join(response.streaming_content)) == {'data': {'getAllUsers': []}}
+
+@pytest.mark.django_db
+def test_stream_falls_back_for_single_object_queries(client):
+    query = '''
+        query {
+            getUserByUserId(userId: 1) {
+                username
+            }
+        }
+    '''
+
+    response = client.post('/api/?stream=true', {'query': query}, content_type='application/json')
+
+    assert not response.streaming
+    assert json.loads(response.content)['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+
+@pytest.mark.django_db
+def test_response_includes_query_cost_extensions(client):
+    query = '''
+        query {
+            getAllExercises {
+                externalExerciseName
+                userId {
+                    username
+                }
+            }
+        }
+    '''
+
+    response = client.post('/api/', {'query': query}, content_type='application/json')
+
+    assert json.loads(response.content) == {
+        'data': {'getAllExercises': []},
+        'extensions': {'cost': {'estimated': 101, 'depth': 3, 'maximum': 25000}}
+    }
+
+@pytest.mark.django_db
+def test_automatic_persisted_query_round_trip(client):
+    persisted_queries.clear()
+    query = 'query { getAllSessions { sessionName } }'
+    extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(query)}}
+
+    not_found = client.post('/api/', {'extensions': extensions}, content_type='application/json')
+    registered = client.post('/api/', {'query': query, 'extensions': extensions}, content_type='application/json')
+    hashed = client.post('/api/', {'extensions': extensions}, content_type='application/json')
+    hashed_get = client.get('/api/', {'extensions': json.dumps(extensions)}, HTTP_ACCEPT='application/json')
+
+    assert json.loads(not_found.content) == {'errors': [{'message': 'PersistedQueryNotFound'}]}
+    assert json.loads(registered.content)['data'] == {'getAllSessions': []}
+    assert json.loads(hashed.content)['data'] == {'getAllSessions': []}
+    assert json.loads(hashed_get.content)['data'] == {'getAllSessions': []}
+
+@pytest.mark.django_db
+def test_runtime_persisted_queries_are_bounded(client, settings, tmp_path):
+    settings.GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE = 2
+    persisted_queries.clear()
+    (tmp_path / 'registry.json').write_text(json.dumps(['query { getAllUsers { username } }']))
+    persisted_queries.load(tmp_path / 'registry.json')
+    queries = ['query { getAllSessions { sessionName %s } }' % field for field in ('', 'sessionId', 'dateTime')]
+
+    for query in queries:
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(query)}}
+        client.post('/api/', {'query': query, 'extensions': extensions}, content_type='application/json')
+
+    assert len(persisted_queries.registered) == 2
+    assert query_hash(queries[0]) not in persisted_queries
+    assert query_hash(queries[2]) in persisted_queries
+    assert persisted_queries.is_allowed(query_hash('query { getAllUsers { username } }'))
+
+@pytest.mark.django_db
+def test_persisted_query_hash_must_match_query(client):
+    extensions = {'persistedQuery': {'version': 1, 'sha256Hash': 'banana'}}
+
+    response = client.post('/api/', {'query': 'query { getAllSessions { sessionName } }', 'extensions': extensions}, content_type='application/json')
+
+    assert response.status_code == 400
+    assert json.loads(response.content) == {'errors': [{'message': 'provided sha does not match query'}]}
+
+@pytest.mark.django_db
+def test_strict_mode_only_runs_registered_operations(client, settings, tmp_path):
+    settings.GRAPHQL_PERSISTED_QUERIES = {'REGISTRY': None, 'STRICT': True}
+    persisted_queries.clear()
+    (tmp_path / 'operations').mkdir()
+    (tmp_path / 'operations' / 'sessions.graphql').write_text('query { getAllSessions { sessionName } }')
+    call_command('build_persisted_queries', str(tmp_path / 'operations'), str(tmp_path / 'registry.json'))
+    persisted_queries.load(tmp_path / 'registry.json')
+
+    registered = client.post('/api/', {'query': 'query { getAllSessions { sessionName } }'}, content_type='application/json')
+    unregistered = client.post('/api/', {'query': 'query { getAllUsers { username } }'}, content_type='application/json')
+
+    assert json.loads(registered.content)['data'] == {'getAllSessions': []}
+    assert json.loads(unregistered.content) == {'errors': [{'message': 'PersistedQueryNotAllowed'}]}
+
+@pytest.mark.django_db
+def test_jwt_is_verified_once_per_request(client):
+    user = ExtendUser(username='tokenuser', email='testuser@test.com')
+    user.set_password('password')
+    user.save()
+
+    token_auth = '''
+        mutation {
+            tokenAuth(username: "tokenuser", password: "password") {
+                token
+            }
+        }
+    '''
+    logged_in = '''
+        query {
+            loggedIn {
+                username
+            }
+        }
+    '''
+
+    token = json.loads(client.post('/api/', {'query': token_auth}, content_type='application/json').content)['data']['tokenAuth']['token']
+    authenticated = client.post('/api/', {'query': logged_in}, content_type='application/json', HTTP_AUTHORIZATION='JWT ' + token)
+    anonymous = client.post('/api/', {'query': logged_in}, content_type='application/json')
+    invalid = client.post('/api/', {'query': logged_in}, content_type='application/json', HTTP_AUTHORIZATION='JWT banana')
+
+    assert json.loads(authenticated.content)['data'] == {'loggedIn': {'username': 'tokenuser'}}
+    assert json.loads(anonymous.content)['errors'][0]['message'] == 'You do not have permission to perform this action'
+    assert json.loads(invalid.content)['errors'] == [{'message': 'Error decoding signature'}]
+
+@pytest.mark.django_db
+def test_claims_only_auth_loads_the_user_lazily(client, settings, django_assert_num_queries):
+    settings.GRAPHQL_CLAIMS_ONLY_AUTH = True
+    user = ExtendUser(username='claimsuser', email='testuser@test.com')
+    user.set_password('password')
+    user.save()
+
+    token_auth = '''
+        mutation {
+            tokenAuth(username: "claimsuser", password: "password") {
+                token
+            }
+        }
+    '''
+    token = json.loads(client.post('/api/', {'query': token_auth}, content_type='application/json').content)['data']['tokenAuth']['token']
+
+    with django_assert_num_queries(1):
+        sessions = client.post('/api/', {'query': 'query { getAllSessions { sessionName } }'}, content_type='application/json', HTTP_AUTHORIZATION='JWT ' + token)
+    with django_assert_num_queries(1):
+        logged_in = client.post('/api/', {'query': 'query { loggedIn { userId username } }'}, content_type='application/json', HTTP_AUTHORIZATION='JWT ' + token)
+
+    assert json.loads(sessions.content)['data'] == {'getAllSessions': []}
+    assert json.loads(logged_in.content)['data'] == {'loggedIn': {'userId': str(user.user_id), 'username': 'claimsuser'}}
+
+@pytest.mark.django_db
+def test_batched_operations_return_an_array_of_results(client):
+    user = ExtendUser.objects.create(username='batchuser', password='password', email='testuser@test.com')
+    Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    batch = [
+        {'query': 'query ($userId: Int) { getExercisesByUserId(userId: $userId) { externalExerciseName } }', 'variables': {'userId': user.user_id}},
+        {'query': 'query ($userId: Int) { getSessionsByUserId(userId: $userId) { sessionName } }', 'variables': {'userId': user.user_id}},
+    ]
+
+    response = client.post('/api/', batch, content_type='application/json')
+
+    assert response.status_code == 200
+    results = json.loads(response.content)
+    assert [result['data'] for result in results] == [
+        {'getExercisesByUserId': [{'externalExerciseName': 'Squat'}]},
+        {'getSessionsByUserId': []},
+    ]
+
+@pytest.mark.django_db
+def test_atomic_batch_rolls_back_when_an_operation_fails(client):
+    user = ExtendUser.objects.create(username='atomicuser', password='password', email='testuser@test.com')
+
+    batch = [
+        {'query': 'mutation ($userId: ID) { createSession(userId: $userId, sessionName: "Leg Day") { session { sessionId } } }', 'variables': {'userId': user.user_id}},
+        {'query': 'mutation { createSession(userId: 987654, sessionName: "Arm Day") { session { sessionId } } }'},
+        {'query': 'query { getAllSessions { sessionName } }'},
+    ]
+
+    response = client.post('/api/?atomic=true', batch, content_type='application/json')
+
+    results = json.loads(response.content)
+    assert results[1]['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+    assert results[2] == {'data': None, 'errors': [{'message': 'Skipped: an earlier operation in this atomic batch failed.'}]}
+    assert SessionLog.objects.count() == 0
+
+@pytest.mark.django_db
+def test_malformed_operation_fails_in_its_own_batch_slot(client):
+    ExtendUser.objects.create(username='slotuser', password='password', email='testuser@test.com')
+
+    response = client.post('/api/', [{'query': '{ getAllUsers { username } }'}, {'variables': {}}], content_type='application/json')
+
+    assert response.status_code == 400
+    results = json.loads(response.content)
+    assert results[0]['data'] == {'getAllUsers': [{'username': 'slotuser'}]}
+    assert results[1] == {'errors': [{'message': 'Must provide query string.'}]}
+
+@pytest.mark.django_db
+def test_malformed_operation_rolls_back_an_atomic_batch(client):
+    user = ExtendUser.objects.create(username='atomicslot', password='password', email='testuser@test.com')
+
+    batch = [
+        {'query': 'mutation ($userId: ID) { createSession(userId: $userId, sessionName: "Leg Day") { session { sessionId } } }', 'variables': {'userId': user.user_id}},
+        {'variables': {}},
+        {'query': 'query { getAllSessions { sessionName } }'},
+    ]
+
+    response = client.post('/api/?atomic=true', batch, content_type='application/json')
+
+    results = json.loads(response.content)
+    assert results[1] == {'errors': [{'message': 'Must provide query string.'}]}
+    assert results[2] == {'data': None, 'errors': [{'message': 'Skipped: an earlier operation in this atomic batch failed.'}]}
+    assert SessionLog.objects.count() == 0
+
+@pytest.mark.django_db
+def test_empty_batch_is_rejected(client):
+    response = client.post('/api/', [], content_type='application/json')
+
+    assert response.status_code == 400
+    assert json.loads(response.content) == {'errors': [{'message': 'Batches must contain between 1 and 20 operations.'}]}
+
+def post_async(body, path='/api/'):
+    request = AsyncRequestFactory().post(path, body, content_type='application/json')
+    request.user = AnonymousUser()
+    view = AsyncApiGraphQLView.as_view(schema=schema, async_schema=async_schema)
+    return async_to_sync(view)(request)
+
+@pytest.mark.django_db
+def test_async_view_matches_sync_view(client):
+    user = ExtendUser.objects.create(username='asyncuser', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+    for reps in range(1, 4):
+        WorkoutLog.objects.create(exercise_id=exercise, reps=reps, weight_kg=100, sets=3)
+
+    query = '''
+        query ($userId: Int) {
+            getAllWorkouts { reps exerciseId { externalExerciseName userId { username } } }
+            getExercisesByUserId(userId: $userId) { externalExerciseName workoutlogSet { reps } }
+            getAllWorkoutsConnection(first: 2) { edges { node { reps } } pageInfo { hasNextPage } }
+        }
+    '''
+    body = {'query': query, 'variables': {'userId': user.user_id}}
+
+    response = post_async(body)
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == json.loads(client.post('/api/', body, content_type='application/json').content)
+    assert json.loads(response.content)['data']['getAllWorkouts'][0] == {'reps': 1, 'exerciseId': {'externalExerciseName': 'Squat', 'userId': {'username': 'asyncuser'}}}
+
+@pytest.mark.django_db
+def test_async_mutation_loads_nested_fields():
+    user = ExtendUser.objects.create(username='asyncmutation', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    mutation = '''
+        mutation ($exerciseId: ID!) {
+            createWorkout(exerciseId: $exerciseId, weightKg: 100, reps: 5, sets: 3) {
+                workout { reps exerciseId { userId { username exerciseSet { externalExerciseName } } } }
+            }
+        }
+    '''
+
+    response = post_async({'query': mutation, 'variables': {'exerciseId': exercise.exercise_id}})
+
+    assert json.loads(response.content)['data'] == {
+        'createWorkout': {'workout': {'reps': 5, 'exerciseId': {'userId': {'username': 'asyncmutation', 'exerciseSet': [{'externalExerciseName': 'Squat'}]}}}}
+    }
+    assert WorkoutLog.objects.get().reps == 5
+
+@pytest.mark.django_db
+def test_async_view_reports_resolver_errors():
+    response = post_async({'query': 'mutation { createSession(userId: 987654, sessionName: "Arm Day") { session { sessionId } } }'})
+
+    assert response.status_code == 200
+    assert json.loads(response.content)['errors'][0]['message'] == 'ExtendUser matching query does not exist.'
+
+@pytest.mark.django_db
+def test_async_view_runs_batches_on_the_sync_schema():
+    ExtendUser.objects.create(username='asyncbatch', password='password', email='testuser@test.com')
+
+    response = post_async([{'query': 'query { getAllUsers { username } }'}] * 2)
+
+    assert [result['data'] for result in json.loads(response.content)] == [{'getAllUsers': [{'username': 'asyncbatch'}]}] * 2
+
+@pytest.mark.django_db
+def test_http_requests_look_up_each_operation_once(client):
+    query = 'query { getAllSessions { sessionName } }'
+    schema.document_cache.clear()
+    async_schema.document_cache.clear()
+
+    for _ in range(2):
+        client.post('/api/', {'query': query}, content_type='application/json')
+        post_async({'query': query})
+
+    assert schema.document_cache.info()['hits'] == 1
+    assert schema.document_cache.info()['misses'] == 1
+    assert async_schema.document_cache.info()['hits'] == 1
+    assert async_schema.document_cache.info()['misses'] == 1
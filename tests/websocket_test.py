@@ -0,0 +1,185 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync, sync_to_async
+from graphene.test import Client
+from graphql_jwt.shortcuts import get_token
+from api.models import ExtendUser, Exercise
+from api.schema import schema
+from api.async_schema import async_schema
+from api.persisted import persisted_queries, query_hash
+from api.pubsub import get_pubsub
+from api.websocket import GraphQLWebSocketApp
+import pytest
+
+
+class WebSocket:
+    # Drives the ASGI app the way a server would, one JSON message at a time.
+
+    def __init__(self, path='/api/', subprotocols=('graphql-transport-ws',)):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'subprotocols': list(subprotocols), 'headers': []}
+        self.task = asyncio.ensure_future(GraphQLWebSocketApp(async_schema)(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.outgoing.get()
+
+    async def send(self, message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive(self):
+        message = await asyncio.wait_for(self.outgoing.get(), 5)
+        return json.loads(message['text']) if message['type'] == 'websocket.send' else message
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await self.task
+
+    async def initialise(self, payload=None):
+        assert (await self.connect())['type'] == 'websocket.accept'
+        await self.send({'type': 'connection_init', 'payload': payload or {}})
+        return await self.receive()
+
+    async def subscribe(self, id, query, variables=None):
+        await self.send({'id': id, 'type': 'subscribe', 'payload': {'query': query, 'variables': variables or {}}})
+        # Messages are handled in order, so the pong means the subscription is registered.
+        await self.send({'type': 'ping'})
+        assert await self.receive() == {'type': 'pong'}
+
+
+@pytest.mark.django_db
+def test_workout_logged_is_pushed_to_subscribers(django_capture_on_commit_callbacks):
+    user = ExtendUser.objects.create(username='subscriber', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    def log_workout():
+        with django_capture_on_commit_callbacks(execute=True):
+            Client(schema).execute('mutation ($id: ID!) { createWorkout(exerciseId: $id, weightKg: 100, reps: 5, sets: 3) { workout { reps } } }', variables={'id': exercise.exercise_id})
+
+    async def scenario():
+        socket = WebSocket()
+        assert await socket.initialise() == {'type': 'connection_ack'}
+        await socket.subscribe('1', 'subscription ($userId: Int!) { workoutLogged(userId: $userId) { reps exerciseId { externalExerciseName } } }', {'userId': user.user_id})
+
+        await sync_to_async(log_workout)()
+        message = await socket.receive()
+
+        await socket.send({'id': '1', 'type': 'complete'})
+        await socket.disconnect()
+        return message
+
+    message = async_to_sync(scenario)()
+
+    assert message['id'] == '1'
+    assert message['type'] == 'next'
+    assert message['payload']['data'] == {'workoutLogged': {'reps': 5, 'exerciseId': {'externalExerciseName': 'Squat'}}}
+    assert not get_pubsub().subscribers
+
+@pytest.mark.django_db
+def test_personal_best_changed_is_only_published_on_change(django_capture_on_commit_callbacks):
+    user = ExtendUser.objects.create(username='pbsubscriber', password='password', email='testuser@test.com')
+    exercise = Exercise.objects.create(user_id=user, external_exercise_id='1234', external_exercise_name='Squat', external_exercise_bodypart='Legs', personal_best=0)
+
+    def update_personal_best(value):
+        with django_capture_on_commit_callbacks(execute=True):
+            Client(schema).execute('mutation ($id: ID!, $pb: Int!) { updateExercise(exerciseId: $id, personalBest: $pb) { exercise { personalBest } } }', variables={'id': exercise.exercise_id, 'pb': value})
+
+    async def scenario():
+        socket = WebSocket()
+        await socket.initialise()
+        await socket.subscribe('pb', 'subscription ($id: Int!) { personalBestChanged(exerciseId: $id) { personalBest } }', {'id': exercise.exercise_id})
+
+        for value in (0, 120, 120, 130):
+            await sync_to_async(update_personal_best)(value)
+        messages = [await socket.receive() for _ in range(2)]
+
+        await socket.disconnect()
+        return messages
+
+    messages = async_to_sync(scenario)()
+
+    assert [message['payload']['data'] for message in messages] == [
+        {'personalBestChanged': {'personalBest': 120}},
+        {'personalBestChanged': {'personalBest': 130}},
+    ]
+    assert not get_pubsub().subscribers
+
+@pytest.mark.django_db
+def test_queries_run_over_the_socket_and_complete():
+    async def scenario():
+        socket = WebSocket()
+        await socket.initialise()
+        await socket.send({'id': 'q', 'type': 'subscribe', 'payload': {'query': 'query { __typename }'}})
+        messages = [await socket.receive(), await socket.receive()]
+        await socket.send({'id': 'bad', 'type': 'subscribe', 'payload': {'query': 'subscription { workoutLogged { reps } }'}})
+        messages.append(await socket.receive())
+        await socket.disconnect()
+        return messages
+
+    result, complete, error = async_to_sync(scenario)()
+
+    assert result == {'id': 'q', 'type': 'next', 'payload': {'data': {'__typename': 'Query'}, 'extensions': {'cost': {'estimated': 0, 'depth': 0, 'maximum': 25000}}}}
+    assert complete == {'id': 'q', 'type': 'complete'}
+    assert error['type'] == 'error'
+    assert error['payload'][0]['message'] == "Field 'workoutLogged' argument 'userId' of type 'Int!' is required, but it was not provided."
+
+@pytest.mark.django_db
+def test_socket_requires_init_and_a_valid_token(settings):
+    settings.GRAPHQL_CLAIMS_ONLY_AUTH = True
+    user = ExtendUser.objects.create(username='socketuser', password='password', email='testuser@test.com')
+    token = get_token(user)
+
+    async def scenario():
+        uninitialised = WebSocket()
+        await uninitialised.connect()
+        await uninitialised.send({'id': '1', 'type': 'subscribe', 'payload': {'query': 'query { __typename }'}})
+        unauthorised = await uninitialised.receive()
+        await uninitialised.task
+
+        forged = WebSocket()
+        forbidden = await forged.initialise({'Authorization': 'JWT not-a-token'})
+        await forged.task
+
+        valid = WebSocket()
+        acknowledged = await valid.initialise({'Authorization': 'JWT ' + token})
+        await valid.disconnect()
+        return unauthorised, forbidden, acknowledged
+
+    unauthorised, forbidden, acknowledged = async_to_sync(scenario)()
+
+    assert (unauthorised['type'], unauthorised['code']) == ('websocket.close', 4401)
+    assert (forbidden['type'], forbidden['code']) == ('websocket.close', 4403)
+    assert acknowledged == {'type': 'connection_ack'}
+
+@pytest.mark.django_db
+def test_socket_applies_strict_persisted_queries(settings, tmp_path):
+    settings.GRAPHQL_PERSISTED_QUERIES = {'REGISTRY': None, 'STRICT': True}
+    persisted_queries.clear()
+    registered = 'query { __typename }'
+    (tmp_path / 'registry.json').write_text(json.dumps([registered]))
+    persisted_queries.load(tmp_path / 'registry.json')
+
+    async def scenario():
+        socket = WebSocket()
+        await socket.initialise()
+        await socket.send({'id': 'adhoc', 'type': 'subscribe', 'payload': {'query': 'query { getAllUsers { username } }'}})
+        rejected = await socket.receive()
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(registered)}}
+        await socket.send({'id': 'hashed', 'type': 'subscribe', 'payload': {'extensions': extensions}})
+        result = await socket.receive()
+        await socket.receive()
+        await socket.disconnect()
+        return rejected, result
+
+    rejected, result = async_to_sync(scenario)()
+    persisted_queries.clear()
+
+    assert rejected == {'id': 'adhoc', 'type': 'error', 'payload': [{'message': 'PersistedQueryNotAllowed'}]}
+    assert result['payload']['data'] == {'__typename': 'Query'}
+
+@pytest.mark.django_db
+def test_subscriptions_are_rejected_over_http():
+    executed = Client(schema).execute('subscription { workoutLogged(userId: 1) { reps } }')
+
+    assert executed == {'data': None, 'errors': [{'message': 'Subscriptions are only served over WebSockets.'}]}